@@ -3,6 +3,8 @@ import json
 import csv
 import sys
 import os
+import time
+import asyncio
 
 from typing import Any
 from datetime import datetime
@@ -10,11 +12,18 @@ from argparse import ArgumentParser
 
 import humps
 import tqdm
-import parse
 import multiprocessing as mp
 
-from dateutil.parser import parse as _date_parse, ParserError
-from utils.dgraph import get_client, initialize_dgraph
+from utils.async_dgraph import AsyncDgraphClient
+from utils.batch import AsyncMutationBatch, MutationBatch
+from utils.csvsplit import byte_ranges, read_range
+from utils.dates import DateParser
+from utils.dgraph import configure, get_client, initialize_dgraph, schema
+from utils.manifest import Manifest, reset_manifest, row_hash
+from utils.pipeline import UploadWorkers, windowed_imap
+from utils.rdf import RDFShardWriter, blank_node, nquad, nquad_literal
+from utils.shards import ShardWriter, read_shard
+from utils.upsert import UpsertBatch, is_unlinked
 
 
 class State(object):
@@ -46,6 +55,12 @@ class State(object):
         self._field_uid_set = {field: set() for field in self.field_keys}
 
         self.root_uid = None
+        self.uid_version = 0
+        self.batch_records = 1000
+        self.batch_bytes = 0
+        self.batch_adaptive = True
+        self.commit_timeout = 30.0
+        self.inflight = 0
         self.root_edges = [
             ('country', 'countries'),
             ('port_of_entry', 'ports_of_entry'),
@@ -53,172 +68,394 @@ class State(object):
             ('year_of_entry', 'years_of_entry')
         ]
 
+    def batch_options(self) -> dict:
+        return {
+            'max_records': self.batch_records,
+            'max_bytes': self.batch_bytes,
+            'adaptive': self.batch_adaptive,
+            'timeout': self.commit_timeout,
+        }
+
     def add_field_set(self, field, value):
         if field not in self.field_sets:
             self.field_sets[field] = set()
 
         self.field_sets[field].add(value)
 
+    def merge_field_sets(self, field_sets: dict):
+        for field, values in field_sets.items():
+            if field not in self.field_sets:
+                self.field_sets[field] = set()
+
+            self.field_sets[field].update(values)
+
     def add_field_uid(self, field, key, uid):
         self.field_uids[field][key] = uid
         self._field_uid_set[field].add(uid)
 
+    def save_uid_delta(self, delta: dict) -> int:
+        # Newly created uids are written to their own numbered file. Upload
+        # workers load each file once, so tasks only need to carry the number.
+        self.uid_version += 1
+        pickle.dump(delta, open(f'_people/uids-{self.uid_version}.pickle', 'wb'))
+        return self.uid_version
+
+    def load_uid_deltas(self, version: int):
+        while self.uid_version < version:
+            self.uid_version += 1
+            delta = pickle.load(open(f'_people/uids-{self.uid_version}.pickle', 'rb'))
+            for field, uids in delta.items():
+                for key, uid in uids.items():
+                    self.add_field_uid(field, key, uid)
+
     def get_stored_field_uids(self, field: str) -> set:
         return self._field_uid_set[field]
 
 
+dates = DateParser()
+
+
 def date_parse(date_str: str, default: Any = None) -> datetime:
-    if date_str == '' or date_str is None:
-        return default
+    return dates.parse(date_str, default)
 
-    try:
-        return _date_parse(date_str)
-    except ParserError:
-        return default
+
+def parse_row(row: dict) -> dict:
+    naid = row['naid']
+    name = row['name'].strip()
+    alias = row['alias'].strip()
+    birth_date = row['birth date'].strip()
+    date_of_entry = row['date of entry'].strip()
+    naturalization_date = row['naturalization date'].strip()
+    country = row['country'].strip()
+    port_of_entry = row['port of entry'].strip()
+    sex = row['sex'].strip()
+
+    now = datetime.today()
+    dob = date_parse(birth_date, default=now)
+    entry = date_parse(date_of_entry)
+    doe = entry if entry is not None else dob
+    don = date_parse(naturalization_date, default=dob)
+    yoe = str(entry.year) if entry is not None else -1
+
+    age = (now - dob).days // 365
+    aae = (doe - dob).days // 365
+    aan = (don - dob).days // 365
+
+    return {
+        'name': name,
+        'naid': naid,
+        'alias': alias,
+        'age': age,
+        'age_of_entry': aae,
+        'age_of_naturalization': aan,
+        'country': country,
+        'port_of_entry': port_of_entry,
+        'year_of_entry': yoe,
+        'sex': sex,
+    }
+
+
+def iter_range(start: int, end: int, fieldnames: list, n: int = 0):
+    for index, row in enumerate(read_range('alien.csv', start, end, fieldnames)):
+        yield parse_row(row)
+
+        index += 1
+        if n != 0 and index > n:
+            break
+
+
+def parse_range(field_keys: list, range_index: int, start: int, end: int, fieldnames: list, n: int = 0):
+    shards = ShardWriter(f'_people/people{range_index:03d}', 10_000)
+    field_sets = {field: set() for field in field_keys}
+
+    # Pool workers are reused across ranges, so only report this range's hits
+    dates.hits.clear()
+
+    for person in iter_range(start, end, fieldnames, n):
+        shards.add(person)
+
+        for field in field_keys:
+            field_sets[field].add(person[field])
+    shards.close()
+
+    return shards.paths, field_sets, dates.stats()
 
 
-def parse_file(state: State, n: int = 0):
+def parse_range_people(task: tuple):
+    field_keys, range_index, start, end, fieldnames, n = task
+    field_sets = {field: set() for field in field_keys}
+    dates.hits.clear()
+
+    people = list(iter_range(start, end, fieldnames, n))
+    for person in people:
+        for field in field_keys:
+            field_sets[field].add(person[field])
+
+    return people, field_sets, dates.stats()
+
+
+def parse_range_task(task: tuple):
+    return parse_range(*task)
+
+
+def split_file(state: State, n: int = 0, ranges: int = 1):
     os.makedirs('_people/', exist_ok=True)
-    person_file_index = 0
-    person_file_cap = 10_000
-    person_file = open(f'_people/people{person_file_index}.json', 'w')
 
+    # A line limit only makes sense when reading from the top of the file
+    if n != 0:
+        ranges = 1
+
+    fieldnames, byte_range_list = byte_ranges('alien.csv', ranges)
+    return [
+        (state.field_keys, range_index, start, end, fieldnames, n)
+        for range_index, (start, end) in enumerate(byte_range_list)
+    ]
+
+
+def export_bulk(state: State, directory: str, n: int = 0, shard_records: int = 100_000):
+    # Every node gets a deterministic blank node name, so the shards can be
+    # written in one pass without looking anything up in a cluster.
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'schema.txt'), 'w') as schema_file:
+        schema_file.write(schema)
+
+    people = RDFShardWriter(directory, 'people', shard_records)
+    categories = RDFShardWriter(directory, 'categories', 0)
+    root_down = dict(state.root_edges)
+
+    root = blank_node('root', 'root')
+    categories.write(nquad_literal(root, 'dgraph.type', 'Root'))
+
+    seen = {field: set() for field in state.field_keys}
     with open('alien.csv', 'r') as csvfile:
         reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
 
-        person_file_size = 0
         for index, row in enumerate(reader):
-            naid = row['naid']
-            name = row['name'].strip()
-            alias = row['alias'].strip()
-            birth_date = row['birth date'].strip()
-            date_of_entry = row['date of entry'].strip()
-            naturalization_date = row['naturalization date'].strip()
-            country = row['country'].strip()
-            port_of_entry = row['port of entry'].strip()
-            sex = row['sex'].strip()
-
-            now = datetime.today()
-            dob = date_parse(birth_date, default=now)
-            doe = date_parse(date_of_entry, default=dob)
-            don = date_parse(naturalization_date, default=dob)
-            yoe = parse.parse('{}-{}-{}', date_of_entry)
-            yoe = yoe[0] if yoe else -1
-
-            age = (now - dob).days // 365
-            aae = (doe - dob).days // 365
-            aan = (don - dob).days // 365
-
-            person = {
-                'uid': '_:' + naid,
-                'dgraph.type': 'Person',
-                'name': name,
-                'naid': naid,
-                'alias': alias,
-                'age': age,
-                'age_of_entry': aae,
-                'age_of_naturalization': aan,
-                'country': country,
-                'port_of_entry': port_of_entry,
-                'year_of_entry': yoe,
-                'sex': sex,
-            }
-
-            person_file.write(json.dumps(person) + '\n')
-
-            for field in state.field_keys:
-                state.add_field_set(field, person[field])
+            person = parse_row(row)
+            subject = blank_node('person', person['naid'])
+
+            lines = [
+                nquad_literal(subject, 'dgraph.type', 'Person'),
+                nquad_literal(subject, 'name', person['name']),
+                nquad_literal(subject, 'naid', person['naid']),
+                nquad_literal(subject, 'alias', person['alias']),
+                nquad(root, 'people', subject),
+            ]
+            for field, edge in state.field_uid_map.items():
+                value = person[field]
+                if value == '':
+                    value = 'unknown'
+                if is_unlinked(field, value):
+                    continue
+                category = blank_node(field, value)
+                lines.append(nquad(subject, edge, category))
+
+                # Category vertices are written the first time they are seen
+                if value not in seen[field]:
+                    seen[field].add(value)
+                    category_lines = nquad_literal(category, 'dgraph.type', humps.pascalize(field))
+                    category_lines += nquad_literal(category, field, value)
+                    if field in root_down:
+                        category_lines += nquad(root, root_down[field], category)
+                    categories.write(category_lines)
+
+            people.write(''.join(lines))
 
             index += 1
             if n != 0 and index > n:
                 break
-
-            person_file_size += 1
-            if person_file_size % person_file_cap == 0:
-                person_file.close()
-                person_file_index += 1
-                person_file = open(f'_people/people{person_file_index}.json', 'w')
         csvfile.close()
 
-    return person_file_index
+    people.close()
+    categories.close()
+
+    print(f'Date parse paths: {dates.report()}')
+
+    print(f'Wrote {len(people.paths) + len(categories.paths)} rdf shards to {directory}')
+    print(f'Load with: dgraph bulk -f {directory} -s {os.path.join(directory, "schema.txt")} --zero=localhost:5080')
+
+
+worker_state: State = None
+
+
+def init_upload_worker(root_uid: str, batch_options: dict, inflight: int = 0):
+    global worker_state
+    worker_state = State()
+    worker_state.root_uid = root_uid
+    worker_state.batch_records = batch_options['max_records']
+    worker_state.batch_bytes = batch_options['max_bytes']
+    worker_state.batch_adaptive = batch_options['adaptive']
+    worker_state.commit_timeout = batch_options['timeout']
+    worker_state.inflight = inflight
+
+
+def create_people(path: str, uid_version: int):
+    print(f'Starting {path}')
 
+    state = worker_state
+    state.load_uid_deltas(uid_version)
 
-def create_people(state: State, _index: int):
-    print(f'Starting _people/people{_index}.json')
+    if state.inflight > 0:
+        asyncio.run(async_create_people(state, path))
+        return
 
     client, stub = get_client()
-    txn = client.txn()
+    batch = MutationBatch(
+        client,
+        link_to=(state.root_uid, 'people'),
+        name=os.path.basename(path),
+        upsert_key='naid',
+        **state.batch_options(),
+    )
+
+    for people in read_shard(path, state.batch_records or 10_000):
+        for person in people:
+            batch.add(person_object(state, person))
+
+    batch.close()
+    stub.close()
+
+    print(f'Finishing {path} '
+          f'({batch.total_records} records in {batch.total_time:.2f}s, {batch.total_retries} retries)')
+
+
+async def async_create_people(state: State, path: str):
+    # The shard's batches are committed from a single event loop, with at
+    # most state.inflight commits outstanding.
+    client = AsyncDgraphClient()
+    batch = AsyncMutationBatch(
+        client,
+        inflight=state.inflight,
+        link_to=(state.root_uid, 'people'),
+        name=os.path.basename(path),
+        upsert_key='naid',
+        **state.batch_options(),
+    )
 
-    for index, person_line in enumerate(open(f'_people/people{_index}.json', 'r')):
-        person = json.loads(person_line)
+    try:
+        for people in read_shard(path, state.batch_records or 10_000):
+            for person in people:
+                await batch.add(person_object(state, person))
+        await batch.close()
+    finally:
+        await client.close()
 
-        fields = {
-            field: person[field]
-            for field in state.field_keys
-        }
-        for field in fields:
-            del person[field]
+    print(f'Finishing {path} '
+          f'({batch.total_records} records in {batch.total_time:.2f}s, {batch.total_retries} retries)')
 
-        response = txn.mutate(set_obj=person)
-        person_uid = response.uids[person['naid']]
-        create_edges(state, txn, person_uid, fields)
 
-        del person
-        del person_line
+def upload_worker(queue: mp.Queue, root_uid: str, batch_options: dict):
+    client, stub = get_client()
+    batch = MutationBatch(
+        client,
+        link_to=(root_uid, 'people'),
+        name=f'upload{os.getpid()}',
+        upsert_key='naid',
+        **batch_options,
+    )
+
+    for people in iter(queue.get, None):
+        for obj in people:
+            batch.add(obj)
+
+    batch.close()
+    stub.close()
+
+
+def stream_people(state: State, args):
+    # Byte ranges are kept small so that people start flowing to the upload
+    # workers almost immediately. The parse window and the bounded upload
+    # queue together cap how much parsed data can be waiting in memory.
+    parse_tasks = split_file(state, args.n, args.p * 64)
+
+    start = time.time()
+    parse_wait = 0.0
+    upload_args = (state.root_uid, state.batch_options())
+    uploads = UploadWorkers(upload_worker, args.w, args.queue_size, upload_args)
+    with mp.Pool(args.p) as parse_pool:
+        results = windowed_imap(parse_pool, parse_range_people, parse_tasks, args.p * 2)
+        while True:
+            wait_start = time.time()
+            result = next(results, None)
+            parse_wait += time.time() - wait_start
+            if result is None:
+                break
 
-        if index % 300 == 0:
-            txn.commit()
-            del txn
-            txn = client.txn()
+            people, field_sets, range_date_stats = result
+            state.merge_field_sets(field_sets)
+            dates.hits.update(range_date_stats)
 
-    txn.commit()
-    del txn
+            # Category vertices are created the first time a value is seen
+            create_set_v(state, field_sets)
 
-    print(f'Finishing _people/people{_index}.json')
+            chunk = state.batch_records or 1000
+            for index in range(0, len(people), chunk):
+                uploads.put([
+                    person_object(state, person)
+                    for person in people[index:index + chunk]
+                ])
 
+    uploads.close()
 
-def create_set_v(state: State):
+    print(f'Date parse paths: {dates.report()}')
+    print(f'Streamed in {time.time() - start:.2f}s '
+          f'(waited {parse_wait:.2f}s on parsing, {uploads.blocked_time:.2f}s on uploads)')
+
+
+def create_set_v(state: State, field_sets: dict):
     client, stub = get_client()
     txn = client.txn()
 
-    for field, field_set in state.field_sets.items():
+    new_uids = {field: dict() for field in state.field_keys}
+    for field, field_set in field_sets.items():
         for value in field_set:
             if value == '':
                 value = 'unknown'
+            if value in state.field_uids[field]:
+                continue
             response = txn.mutate(set_obj={
                 'uid': '_:' + str(hash(value)),
                 'dgraph.type': humps.pascalize(field),
                 field: value,
             })
-            state.add_field_uid(field, value, response.uids[str(hash(value))])
+            uid = response.uids[str(hash(value))]
+            state.add_field_uid(field, value, uid)
+            new_uids[field][value] = uid
         txn.commit()
         del txn
         txn = client.txn()
 
     for field, downname in state.root_edges:
+        if len(new_uids[field]) == 0:
+            continue
         txn.mutate(set_obj={
             'uid': state.root_uid,
             downname: [
                 {'uid': uid}
-                for uid in state.get_stored_field_uids(field)
+                for uid in new_uids[field].values()
             ],
         })
 
     txn.commit()
+    stub.close()
+
+    return new_uids
 
 
-def create_edges(state: State, txn, person_uid: str, fields: dict):
-    for field, value in fields.items():
+def person_object(state: State, person: dict) -> dict:
+    obj = {
+        key: value
+        for key, value in person.items()
+        if key not in state.field_uid_map
+    }
+    obj['uid'] = '_:' + person['naid']
+    obj['dgraph.type'] = 'Person'
+    for field, edge in state.field_uid_map.items():
+        value = person[field]
         if value == '':
             value = 'unknown'
-        txn.mutate(set_obj={
-            'uid': person_uid,
-            state.field_uid_map[field]: [{'uid': state.field_uids[field][value]}],
-        })
-    txn.mutate(set_obj={
-        'uid': state.root_uid,
-        'people': [{'uid': person_uid}]
-    })
+        obj[edge] = [{'uid': state.field_uids[field][value]}]
+    return obj
 
 
 def create_root(state: State):
@@ -233,33 +470,165 @@ def create_root(state: State):
     txn.commit()
 
 
+def ensure_root(state: State):
+    client, stub = get_client()
+    txn = client.txn(read_only=True)
+
+    response = txn.query('{ root(func: type(Root)) { uid } }')
+    roots = json.loads(response.json)['root']
+    stub.close()
+
+    if len(roots) > 0:
+        state.root_uid = roots[0]['uid']
+    else:
+        create_root(state)
+
+
+def incremental_ingest(state: State, args):
+    manifest = Manifest(args.manifest)
+    client, stub = get_client()
+    batch = UpsertBatch(state.field_uid_map, state.root_edges)
+    batch_hashes = dict()
+
+    skipped = 0
+    written = 0
+    start = time.time()
+
+    def flush():
+        batch.commit(client)
+        manifest.update(batch_hashes)
+        batch_hashes.clear()
+
+    fieldnames, byte_range_list = byte_ranges('alien.csv', 1)
+    try:
+        for range_start, range_end in byte_range_list:
+            for index, row in enumerate(read_range('alien.csv', range_start, range_end, fieldnames)):
+                # Checked first, so -n counts rows read, not just rows written
+                if args.n != 0 and index > args.n:
+                    break
+
+                # Rows are compared before parsing, so unchanged rows cost one hash
+                content_hash = row_hash(row)
+                if manifest.unchanged(row['naid'], content_hash):
+                    skipped += 1
+                    continue
+
+                batch.add(parse_row(row))
+                batch_hashes[row['naid']] = content_hash
+                written += 1
+
+                if len(batch) >= (state.batch_records or 1000):
+                    flush()
+        flush()
+    finally:
+        manifest.save()
+        stub.close()
+
+    print(f'Upserted {written} changed people and skipped {skipped} unchanged '
+          f'in {time.time() - start:.2f}s')
+
+
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument('-n', type=int, default=0, help='number of lines to parse')
     parser.add_argument('-w', type=int, default=8, help='number of workers to use')
+    parser.add_argument('-p', type=int, default=os.cpu_count(), help='number of parse workers to use')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                        help='number of people per mutation batch (0 for no limit). Without --fixed-batch '
+                             'this is the starting size, which can grow up to the larger of -b and 10000')
+    parser.add_argument('--batch-bytes', type=int, default=0,
+                        help='max encoded bytes per mutation batch (0 for no limit)')
+    parser.add_argument('--fixed-batch', action='store_true',
+                        help='always commit --batch-size people instead of adapting to aborts and latency')
+    parser.add_argument('--commit-timeout', type=float, default=30.0,
+                        help='seconds before a batch commit times out (timed out commits are retried)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream parsed people straight to upload workers instead of through shards')
+    parser.add_argument('--queue-size', type=int, default=32,
+                        help='max people batches waiting for upload in --stream mode')
+    parser.add_argument('--alphas', type=str, default=None,
+                        help='comma separated host:port of the dgraph alphas to balance across')
+    parser.add_argument('--incremental', action='store_true',
+                        help='upsert only new or changed rows instead of dropping and rebuilding')
+    parser.add_argument('--manifest', type=str, default='manifest.pickle',
+                        help='row hash manifest used by --incremental (removed by full and --bulk runs)')
+    parser.add_argument('--bulk', type=str, default=None, metavar='DIR',
+                        help='write rdf shards for dgraph bulk to DIR instead of live mutations')
+    parser.add_argument('--shard-size', type=int, default=100_000,
+                        help='number of people per rdf shard in --bulk mode')
+    parser.add_argument('--inflight', type=int, default=0,
+                        help='commit each shard from an asyncio loop with this many batches in flight')
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    initialize_dgraph()
     state = State()
 
+    if args.alphas is not None:
+        configure(args.alphas.split(','))
+
+    if args.bulk is not None:
+        # The shards are loaded into a new graph, without any of the rows
+        # earlier incremental runs wrote
+        reset_manifest(args.manifest)
+
+        print('Exporting rdf shards')
+        export_bulk(state, args.bulk, args.n, args.shard_size)
+        return
+
+    state.batch_records = args.batch_size
+    state.batch_bytes = args.batch_bytes
+    state.batch_adaptive = not args.fixed_batch
+    state.commit_timeout = args.commit_timeout
+    state.inflight = args.inflight
+
+    if args.incremental:
+        initialize_dgraph(drop=False)
+        ensure_root(state)
+
+        print('Upserting changed people')
+        incremental_ingest(state, args)
+        return
+
+    # Forgotten before the drop, so a failed drop can only cause extra writes
+    reset_manifest(args.manifest)
+    initialize_dgraph()
+
     print('Creating root')
     create_root(state)
 
+    if args.stream:
+        print('Streaming people')
+        stream_people(state, args)
+        return
+
     print('Parsing file')
-    person_file_count = parse_file(state, args.n)
+    parse_tasks = split_file(state, args.n, args.p * 4)
 
-    print('Creating set v')
-    create_set_v(state)
+    # Each parsed byte range has its vertices created as soon as it comes
+    # back, and its people shards are handed to the upload pool right away.
+    upload_pool_args = (state.root_uid, state.batch_options(), state.inflight)
+    with mp.Pool(args.p) as parse_pool, \
+            mp.Pool(args.w, init_upload_worker, upload_pool_args) as upload_pool:
+        uploads = []
+        for paths, field_sets, range_date_stats in parse_pool.imap_unordered(parse_range_task, parse_tasks):
+            state.merge_field_sets(field_sets)
+            dates.hits.update(range_date_stats)
 
-    pickle.dump(state, open('state.pickle', 'wb'))
+            print('Creating set v')
+            uid_version = state.save_uid_delta(create_set_v(state, field_sets))
+
+            print('Create people v')
+            for path in paths:
+                uploads.append(upload_pool.apply_async(create_people, (path, uid_version)))
+
+        print(f'Date parse paths: {dates.report()}')
 
-    print('Create people v')
-    with mp.Pool(args.w) as pool:
-        args = [(state, index) for index in range(person_file_count+1)]
-        pool.starmap(create_people, args)
+        for upload in uploads:
+            upload.get()
+
+    pickle.dump(state, open('state.pickle', 'wb'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from utils import async_cache
+from utils.async_cache import AsyncLayeredCache
+
+
+class Pipeline(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.commands.append((name, args))
+            return self
+        return queue
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        return [getattr(self.redis.store, name)(*args) for name, args in self.commands]
+
+
+class Store(object):
+    # Just the commands AsyncLayeredCache uses, with TTLs in milliseconds
+    def __init__(self):
+        self.values = dict()
+        self.pttls = dict()
+
+    def setex(self, key, seconds, value):
+        self.values[key] = value.encode('utf8')
+        self.pttls[key] = seconds * 1000
+
+    def set(self, key, value):
+        self.values[key] = value.encode('utf8')
+        self.pttls[key] = -1
+
+    def mget(self, keys):
+        return [self.values.get(key, None) for key in keys]
+
+    def pttl(self, key):
+        return self.pttls.get(key, -2)
+
+
+class Redis(object):
+    def __init__(self):
+        self.store = Store()
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        async def command(*args):
+            self.round_trips += 1
+            return getattr(self.store, name)(*args)
+        return command
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = Redis()
+    monkeypatch.setattr(async_cache.redis, 'from_url', lambda url: redis)
+    return redis
+
+
+def test_redis_hits_keep_their_remaining_ttl(redis):
+    async def run():
+        cache = AsyncLayeredCache('country', 10, timeout=300)
+        redis.store.setex('country-italy', 300, '0x1')
+        redis.store.setex('country-spain', 300, '0x2')
+        redis.store.pttls['country-italy'] = 2000
+        redis.store.pttls['country-spain'] = 5000
+
+        assert await cache.get('italy') == '0x1'
+        assert await cache.get_many(['spain', 'france']) == {'spain': '0x2'}
+        # Each lookup is one pipeline with the values and their TTLs
+        assert redis.round_trips == 2
+
+        assert 1.5 < cache.local_cache.remaining('country-italy') <= 2.0
+        assert 4.5 < cache.local_cache.remaining('country-spain') <= 5.0
+
+        # Writes through the cache get the full timeout
+        await cache.set('sweden', '0x3')
+        assert cache.local_cache.remaining('country-sweden') > 299
+        await cache.close()
+
+    asyncio.run(run())
+
+
+def test_without_timeout(redis):
+    async def run():
+        cache = AsyncLayeredCache('country', 10)
+        await cache.set_many({'italy': '0x1', 'spain': '0x2'})
+        cache.local_cache.clear()
+
+        assert await cache.get_many(['italy', 'spain', 'france']) == {'italy': '0x1', 'spain': '0x2'}
+        assert await cache.contains('italy')
+        assert not await cache.contains('france')
+        assert redis.store.pttls['country-italy'] == -1
+        await cache.close()
+
+    asyncio.run(run())
@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+import grpc
+import pydgraph
+import pytest
+
+from utils import batch as batch_module
+from utils.batch import AsyncMutationBatch, MutationBatch
+
+
+class RpcError(grpc.RpcError):
+    def __init__(self, code: grpc.StatusCode):
+        super(RpcError, self).__init__()
+        self._code = code
+
+    def code(self) -> grpc.StatusCode:
+        return self._code
+
+
+class Response(object):
+    def __init__(self, uids: dict):
+        self.uids = uids
+
+
+class Txn(object):
+    def __init__(self, client):
+        self.client = client
+
+    def do_request(self, request, timeout):
+        assert request.commit_now
+        if self.client.errors:
+            raise self.client.errors.pop(0)
+        mutation, = request.mutations
+        self.client.requests.append((request.query, json.loads(mutation.set_json)))
+        return Response({'n': '0x1'})
+
+    def discard(self):
+        pass
+
+
+class Client(object):
+    def __init__(self, errors: list = ()):
+        self.errors = list(errors)
+        self.requests = []
+
+    def txn(self):
+        return Txn(self)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(batch_module.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(batch_module, 'backoff', lambda attempt: 0.0)
+
+
+def _person(naid: str) -> dict:
+    return {'uid': '_:' + naid, 'naid': naid, 'name': 'p' + naid}
+
+
+def test_flushes_on_records_and_bytes():
+    client = Client()
+    batch = MutationBatch(client, max_records=2, link_to=('0x9', 'people'))
+    assert batch.add(_person('1')) == dict()
+    assert batch.add(_person('2')) == {'n': '0x1'}
+    assert len(batch) == 0
+
+    (query, objects), = client.requests
+    assert query == ''
+    assert objects == [_person('1'), _person('2'), {'uid': '0x9', 'people': [{'uid': '_:1'}, {'uid': '_:2'}]}]
+
+    batch = MutationBatch(Client(), max_records=0, max_bytes=100)
+    batch.add(_person('1'))
+    assert not batch.full()
+    batch.add(_person('22222222222222222222222222222222222222'))
+    assert len(batch) == 0
+
+
+def test_upsert_key():
+    client = Client()
+    batch = MutationBatch(client, max_records=0, link_to=('0x9', 'people'), upsert_key='naid')
+    for naid in ('1', '2', '1'):
+        batch.add(_person(naid))
+    batch.close()
+
+    (query, objects), = client.requests
+    # Each key is queried once, and records with the same key share its node
+    assert query == 'query {\nk31 as var(func: eq(naid, "1"))\nk32 as var(func: eq(naid, "2"))\n}'
+    assert [obj['uid'] for obj in objects[:3]] == ['uid(k31)', 'uid(k32)', 'uid(k31)']
+    assert objects[3] == {'uid': '0x9', 'people': [{'uid': 'uid(k31)'}, {'uid': 'uid(k32)'}, {'uid': 'uid(k31)'}]}
+
+
+@pytest.mark.parametrize('error', [pydgraph.AbortedError(), RpcError(grpc.StatusCode.ABORTED)])
+def test_retries_aborts(error):
+    client = Client([error, error])
+    batch = MutationBatch(client, adaptive=True, max_records=8)
+    for naid in range(8):
+        batch.add(_person(str(naid)))
+
+    # Each abort halves the chunk the records are retried in, and fast
+    # commits grow it again
+    assert batch.total_retries == 2
+    assert [len(objects) for _, objects in client.requests] == [2, 3, 3]
+    assert batch.total_records == 8
+
+
+@pytest.mark.parametrize('code', [grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.UNAVAILABLE])
+def test_retries_unknown_outcomes_only_for_upserts(code):
+    batch = MutationBatch(Client([RpcError(code)]))
+    batch.add(_person('1'))
+    with pytest.raises(grpc.RpcError):
+        batch.flush()
+
+    client = Client([RpcError(code)])
+    batch = MutationBatch(client, upsert_key='naid')
+    batch.add(_person('1'))
+    batch.flush()
+    assert batch.total_retries == 1
+    assert len(client.requests) == 1
+
+
+def test_gives_up_after_retries():
+    batch = MutationBatch(Client([pydgraph.AbortedError()] * 3), retries=2)
+    batch.add(_person('1'))
+    with pytest.raises(pydgraph.AbortedError):
+        batch.flush()
+    assert batch.total_retries == 2
+
+
+class AsyncTxn(Txn):
+    async def do_request(self, request, timeout):
+        self.client.running += 1
+        self.client.most_running = max(self.client.most_running, self.client.running)
+        try:
+            await asyncio.sleep(0.01)
+            return super(AsyncTxn, self).do_request(request, timeout)
+        finally:
+            self.client.running -= 1
+
+    async def discard(self):
+        pass
+
+
+class AsyncClient(Client):
+    def __init__(self, errors: list = ()):
+        super(AsyncClient, self).__init__(errors)
+        self.running = 0
+        self.most_running = 0
+
+    def txn(self):
+        return AsyncTxn(self)
+
+
+def test_async_batch():
+    async def run(client: AsyncClient) -> AsyncMutationBatch:
+        batch = AsyncMutationBatch(client, inflight=2, max_records=0, max_bytes=200,
+                                   link_to=('0x9', 'people'), upsert_key='naid')
+        for naid in range(20):
+            await batch.add(_person(str(naid)))
+        await batch.close()
+        return batch
+
+    client = AsyncClient([RpcError(grpc.StatusCode.DEADLINE_EXCEEDED)])
+    batch = asyncio.run(run(client))
+
+    # Batches are cut on bytes, committed two at a time, and the timed out
+    # upsert is retried
+    assert client.most_running == 2
+    assert batch.total_retries == 1
+    assert batch.total_records == 20
+    naids = [obj['naid'] for _, objects in client.requests for obj in objects[:-1]]
+    assert sorted(naids, key=int) == [str(naid) for naid in range(20)]
+    assert all(len(objects) - 1 <= 5 for _, objects in client.requests)
+
+
+def test_async_batch_raises():
+    async def run():
+        batch = AsyncMutationBatch(AsyncClient([RpcError(grpc.StatusCode.INVALID_ARGUMENT)]), max_records=1)
+        await batch.add(_person('1'))
+        await batch.close()
+
+    with pytest.raises(grpc.RpcError):
+        asyncio.run(run())
@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+from utils import cache
+from utils.cache import FullLayeredCache
+
+
+class Pipeline(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.commands.append((name, args))
+            return self
+        return queue
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args) for name, args in self.commands]
+
+
+class Bloom(object):
+    def __init__(self):
+        self.filters = dict()
+
+    def info(self, name):
+        if name not in self.filters:
+            raise cache.exceptions.ResponseError('not found')
+
+    def create(self, name, p, n):
+        self.filters[name] = set()
+
+    def add(self, name, item):
+        self.filters[name].add(item)
+
+    def madd(self, name, *items):
+        self.filters[name].update(items)
+
+    def exists(self, name, item):
+        return int(item in self.filters[name])
+
+    def mexists(self, name, *items):
+        return [int(item in self.filters[name]) for item in items]
+
+
+class Redis(object):
+    # Just the commands the caches use, shared by every client on a port
+    servers = dict()
+
+    def __init__(self, host='localhost', port=6379):
+        self.values, self.bloom = Redis.servers.setdefault(port, (dict(), Bloom()))
+
+    def set(self, key, value):
+        self.values[key] = str(value).encode('utf8')
+
+    def setex(self, key, seconds, value):
+        self.set(key, value)
+
+    def get(self, key):
+        return self.values.get(key, None)
+
+    def mget(self, keys):
+        return [self.values.get(key, None) for key in keys]
+
+    def pttl(self, key):
+        return 300_000 if key in self.values else -2
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    def bf(self):
+        return self.bloom
+
+    def close(self):
+        pass
+
+
+class Dgraph(object):
+    # value -> uid of the country nodes, answering the cache's three queries
+    def __init__(self, countries: dict):
+        self.countries = countries
+        self.queries = 0
+
+    def txn(self, read_only=False):
+        return self
+
+    def query(self, query, variables=None):
+        self.queries += 1
+        if 'has(' in query:
+            values = list(self.countries)
+        elif variables is not None:
+            values = [variables['$a']]
+        else:
+            values = json.loads('[' + query[query.index('[') + 1:query.index(']')] + ']')
+        nodes = [{'uid': self.countries[value], 'country': value} for value in values if value in self.countries]
+        return type('Response', (), {'json': json.dumps({'all': nodes})})
+
+
+class Stub(object):
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def dgraph(monkeypatch):
+    Redis.servers = dict()
+    dgraph = Dgraph({'italy': '0x1', 'spain': '0x2'})
+    monkeypatch.setattr(cache, 'Redis', Redis)
+    monkeypatch.setattr(cache, 'get_client', lambda: (dgraph, Stub()))
+    return dgraph
+
+
+def test_new_filter_is_warmed_up(dgraph):
+    country = FullLayeredCache('country', 10)
+    assert country.populated
+    assert country.bloom.filters['country'] == {'country-italy', 'country-spain'}
+
+    # Negatives are trusted, so a missing key never reaches dgraph
+    queries = dgraph.queries
+    country.local_cache.clear()
+    Redis.servers[6379][0].clear()
+    assert country['france'] is None
+    assert country.get_many(['italy', 'germany']) == {'italy': '0x1'}
+    assert dgraph.queries == queries + 1
+    country.close()
+
+
+def test_unpopulated_filter_falls_back_to_dgraph(dgraph):
+    # Another process created the filter, but has not finished warming it up
+    Redis(port=6378).bf().create('country', 1.0e-6, 1000)
+    country = FullLayeredCache('country', 10)
+    assert not country.populated
+
+    assert country['italy'] == '0x1'
+    assert country.get_many(['spain', 'france']) == {'spain': '0x2'}
+    assert dgraph.queries == 2
+
+    # Once the marker is set by the warm up, negatives are trusted
+    Redis(port=6378).set('country-bloom-populated', 1)
+    queries = dgraph.queries
+    assert country.get_many(['germany']) == dict()
+    assert country['portugal'] is None
+    assert dgraph.queries == queries
+    country.close()
@@ -0,0 +1,69 @@
+from utils.cache_stats import CacheStats, LatencyHistogram, prometheus_text
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(buckets=(0.001, 0.01, 0.1))
+    for seconds in (0.0005, 0.001, 0.005, 0.05, 1.0):
+        histogram.observe(seconds)
+
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.cumulative() == [2, 3, 4, 5]
+    assert histogram.quantile(0.4) == 0.001
+    assert histogram.quantile(0.8) == 0.1
+    assert histogram.quantile(1.0) == float('inf')
+    assert LatencyHistogram().quantile(0.5) == 0.0
+
+
+def test_layer_stats():
+    metrics = CacheStats('country', ('local', 'redis'))
+    metrics['local'].record(3, 1, 0.0001)
+    metrics['redis'].record(1, 0, 0.002)
+    metrics['redis'].backfills += 1
+
+    assert metrics['local'].hit_rate() == 0.75
+    assert metrics['redis'].to_dict()['round_trips'] == 1
+    assert metrics['redis'].to_dict()['backfills'] == 1
+
+
+def _stats(metrics: CacheStats) -> dict:
+    # The shape of LayeredCache.stats(histograms=True)
+    layers = dict()
+    for layer, layer_stats in metrics.layers.items():
+        layers[layer] = dict(layer_stats.to_dict(), histogram={
+            'buckets': list(layer_stats.latency.buckets),
+            'cumulative': layer_stats.latency.cumulative(),
+            'sum': layer_stats.latency.sum,
+            'count': layer_stats.latency.count,
+        })
+    return {
+        'cache': metrics.node_name,
+        'l1': {'policy': 'lru', 'size': 3, 'maxsize': 10, 'evictions': 2},
+        'layers': layers,
+    }
+
+
+def test_prometheus_text():
+    metrics = CacheStats('country', ('local', 'redis'))
+    metrics['local'].record(3, 1, 0.0001)
+    metrics['redis'].record(1, 0, 0.002)
+    text = prometheus_text([_stats(metrics), _stats(CacheStats('sex', ('local',)))])
+    lines = text.splitlines()
+
+    assert text.endswith('\n')
+    assert '# TYPE cache_hits_total counter' in lines
+    assert 'cache_hits_total{cache="country",layer="local"} 3' in lines
+    assert 'cache_misses_total{cache="country",layer="local"} 1' in lines
+    assert 'cache_hits_total{cache="sex",layer="local"} 0' in lines
+    assert 'cache_latency_seconds_bucket{cache="country",layer="redis",le="0.001"} 0' in lines
+    assert 'cache_latency_seconds_bucket{cache="country",layer="redis",le="0.002"} 1' in lines
+    assert 'cache_latency_seconds_bucket{cache="country",layer="redis",le="+Inf"} 1' in lines
+    assert 'cache_latency_seconds_count{cache="country",layer="redis"} 1' in lines
+    assert 'cache_l1_evictions_total{cache="country",policy="lru"} 2' in lines
+
+    # Every metric is declared once, before its samples
+    types = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert len(types) == len(set(types))
+    for line in lines:
+        if not line.startswith('#'):
+            name = line.split('{')[0]
+            assert any(name == declared or name.startswith(declared + '_') for declared in types)
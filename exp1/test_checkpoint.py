@@ -0,0 +1,68 @@
+import pickle
+
+import pytest
+
+from utils import checkpoint
+
+
+@pytest.fixture
+def checkpoint_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'path', str(tmp_path / 'checkpoint.log'))
+    monkeypatch.setattr(checkpoint, 'legacy_path', str(tmp_path / 'checkpoint.pickle'))
+    monkeypatch.setattr(checkpoint, '_index', set())
+    monkeypatch.setattr(checkpoint, '_offset', 0)
+    monkeypatch.setattr(checkpoint, '_loaded', False)
+    return tmp_path / 'checkpoint.log'
+
+
+def _reload():
+    # What a new process would see
+    checkpoint._index = set()
+    checkpoint._offset = 0
+    checkpoint._loaded = False
+
+
+def test_checkpoint_log(checkpoint_log):
+    assert not checkpoint.get_checkpoint('schema')
+    checkpoint.set_checkpoint('schema')
+    checkpoint.set_checkpoint('uids 3')
+
+    _reload()
+    assert checkpoint.get_checkpoint('schema')
+    assert not checkpoint.get_checkpoint('people')
+
+
+def test_checkpoint_log_skips_torn_records(checkpoint_log):
+    checkpoint.set_checkpoint('schema')
+    with open(checkpoint_log, 'ab') as f:
+        # A record with a bad checksum, then one cut short by a crash
+        f.write(b'\n00000000 "corrupt"\n')
+        f.write(checkpoint._record('torn')[:-3])
+    checkpoint.set_checkpoint('people')
+
+    _reload()
+    assert checkpoint.get_checkpoint('schema')
+    assert checkpoint.get_checkpoint('people')
+    assert not checkpoint.get_checkpoint('corrupt')
+    assert not checkpoint.get_checkpoint('torn')
+
+
+def test_checkpoint_imports_legacy_pickle(checkpoint_log, tmp_path):
+    with open(tmp_path / 'checkpoint.pickle', 'wb') as f:
+        pickle.dump({'schema', 'uids'}, f)
+
+    assert checkpoint.get_checkpoint('uids')
+    assert checkpoint_log.exists()
+
+
+def test_checkpoint_decorator(checkpoint_log):
+    calls = []
+
+    @checkpoint.checkpoint('step')
+    def step(state=None):
+        calls.append(state)
+        return 'done'
+
+    assert step('state') == 'done'
+    assert step('state') is None
+    assert calls == ['state']
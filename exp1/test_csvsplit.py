@@ -0,0 +1,38 @@
+import csv
+
+import pytest
+
+from utils.csvsplit import byte_ranges, read_header, read_range
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'people.csv'
+    with open(path, 'w', newline='', encoding='utf8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['naid', 'name', 'country'])
+        for index in range(100):
+            writer.writerow([index, f'Person, {index}' * (index % 4), 'Éire' if index % 3 else ''])
+    return str(path)
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7, 64, 500])
+def test_byte_ranges_cover_every_row_once(csv_path, n):
+    fieldnames, ranges = byte_ranges(csv_path, n)
+    _, data_start = read_header(csv_path)
+
+    assert fieldnames == ['naid', 'name', 'country']
+    assert ranges[0][0] == data_start
+    assert ranges[-1][1] == len(open(csv_path, 'rb').read())
+    assert len(ranges) <= n
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+
+    # Every range starts at the beginning of a line
+    data = open(csv_path, 'rb').read()
+    for start, _ in ranges:
+        assert data[start - 1:start] == b'\n'
+
+    rows = [row for start, end in ranges for row in read_range(csv_path, start, end, fieldnames)]
+    with open(csv_path, newline='', encoding='utf8') as f:
+        assert rows == list(csv.DictReader(f))
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from utils.dates import DateParser
+
+
+def test_dates_fast_paths():
+    parser = DateParser()
+    assert parser.parse('1943-05-02') == datetime(1943, 5, 2)
+    assert parser.parse('05/02/1943') == datetime(1943, 5, 2)
+    assert parser.parse('', default=-1) == -1
+    assert parser.parse(None) is None
+    assert parser.stats() == {'iso': 1, 'slashes': 1, 'empty': 2}
+
+
+def test_dates_memo():
+    parser = DateParser()
+    assert parser.parse('May 2, 1943') == datetime(1943, 5, 2)
+    assert parser.parse('May 2, 1943') == datetime(1943, 5, 2)
+    assert parser.parse('not a date', default=-1) == -1
+    assert parser.parse('not a date', default=-1) == -1
+    assert parser.stats() == {'dateutil': 2, 'memo': 2}
+
+    # Invalid dates in the fixed formats fall back to dateutil
+    assert parser.parse('13/45/1943', default=-1) == -1
@@ -0,0 +1,28 @@
+from utils.dgraph import match_uids, uids_query, value_key
+
+
+def test_uids_query():
+    assert uids_query('country', ['italy', 'Fr"ance']) == \
+        '{ all(func: eq(country, ["italy", "Fr\\"ance"])) { uid country } }'
+
+
+def test_match_uids():
+    nodes = [
+        {'uid': '0x1', 'age': 34},
+        {'uid': '0x2', 'age': 34},
+        {'uid': '0x3', 'age': 7},
+        {'uid': '0x4'},
+    ]
+    assert match_uids('age', ['34', '50'], nodes) == {'34': '0x1'}
+
+
+def test_value_key():
+    assert value_key('year_of_entry', '1943-01-01T00:00:00Z') == '1943'
+    assert value_key('year_of_entry', '0999-01-01T00:00:00Z') == '999'
+    assert value_key('age', 34) == '34'
+    assert value_key('country', 'italy') == 'italy'
+
+
+def test_match_uids_normalizes_years():
+    nodes = [{'uid': '0x5', 'year_of_entry': '1943-01-01T00:00:00Z'}]
+    assert match_uids('year_of_entry', ['1943', '1944'], nodes) == {'1943': '0x5'}
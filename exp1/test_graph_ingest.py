@@ -0,0 +1,64 @@
+import csv
+import gzip
+import importlib.util
+import os
+
+import pytest
+
+from utils.rdf import blank_node
+
+
+@pytest.fixture(scope='module')
+def ingest():
+    # graph-ingest.py is a script, so it is loaded from its path
+    path = os.path.join(os.path.dirname(__file__), 'graph-ingest.py')
+    spec = importlib.util.spec_from_file_location('graph_ingest', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write_csv(path, rows: list):
+    fieldnames = ['naid', 'name', 'alias', 'birth date', 'date of entry', 'naturalization date',
+                  'country', 'port of entry', 'sex']
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(dict.fromkeys(fieldnames, ''), **row))
+
+
+def _read(paths: list) -> list:
+    lines = []
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf8') as f:
+            lines.extend(f.read().splitlines())
+    return lines
+
+
+def test_export_bulk_skips_missing_entry_year(ingest, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_csv('alien.csv', [
+        {'naid': '1', 'name': 'Entered', 'birth date': '1900-01-01', 'date of entry': '1920-05-01',
+         'country': 'Italy', 'sex': 'f'},
+        {'naid': '2', 'name': 'Unknown entry', 'birth date': '1900-01-01', 'country': 'Italy', 'sex': 'm'},
+    ])
+    ingest.export_bulk(ingest.State(), 'rdf')
+
+    people = _read(sorted(str(path) for path in (tmp_path / 'rdf').glob('people-*.rdf.gz')))
+    categories = _read(sorted(str(path) for path in (tmp_path / 'rdf').glob('categories-*.rdf.gz')))
+
+    # Only the real year becomes a node, linked from the root
+    year = blank_node('year_of_entry', '1920')
+    assert f'{year} <year_of_entry> "1920" .' in categories
+    assert f'{blank_node("root", "root")} <years_of_entry> {year} .' in categories
+    assert not any('"-1"' in line for line in categories)
+    assert sum('<years_of_entry>' in line for line in categories) == 1
+
+    # The person without an entry date has every other edge, but no yoe
+    entered = blank_node('person', '1')
+    unknown = blank_node('person', '2')
+    assert f'{entered} <yoe> {year} .' in people
+    assert not any(line.startswith(f'{unknown} <yoe>') for line in people)
+    assert f'{unknown} <c> {blank_node("country", "Italy")} .' in people
+    assert f'{unknown} <poe> {blank_node("port_of_entry", "unknown")} .' in people
@@ -0,0 +1,39 @@
+import os
+
+from utils.manifest import Manifest, reset_manifest, row_hash
+
+
+def test_row_hash():
+    row = {'naid': '1', 'name': 'Jo', 'dob': '1900'}
+    assert row_hash(row) == row_hash({'dob': '1900', 'name': 'Jo', 'naid': '1'})
+    assert row_hash(row) != row_hash(dict(row, name='Joe'))
+    # Values can't run into the next field
+    assert row_hash({'a': 'x', 'b': ''}) != row_hash({'a': '', 'b': 'x'})
+
+
+def test_manifest_round_trip(tmp_path):
+    path = str(tmp_path / 'manifest.pickle')
+    manifest = Manifest(path)
+    assert not manifest.unchanged('1', 'h1')
+
+    manifest.update({'1': 'h1', '2': 'h2'})
+    assert manifest.unchanged('1', 'h1')
+    assert not manifest.unchanged('1', 'h9')
+    manifest.save()
+    assert not os.path.exists(path + '.tmp')
+
+    loaded = Manifest(path)
+    assert loaded.hashes == {'1': 'h1', '2': 'h2'}
+
+
+def test_reset_manifest(tmp_path):
+    path = str(tmp_path / 'manifest.pickle')
+    manifest = Manifest(path)
+    manifest.update({'1': 'h1'})
+    manifest.save()
+
+    reset_manifest(path)
+    assert not os.path.exists(path)
+    assert not Manifest(path).unchanged('1', 'h1')
+    # Resetting a missing manifest is fine
+    reset_manifest(path)
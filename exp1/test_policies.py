@@ -0,0 +1,91 @@
+import pytest
+
+from utils.policies import ExpiringCache, FrequencySketch, WTinyLFUCache, make_l1
+
+
+def test_frequency_sketch():
+    sketch = FrequencySketch(16)
+    for _ in range(20):
+        sketch.increment('hot')
+    sketch.increment('cold')
+    assert sketch.frequency('hot') == 15
+    assert sketch.frequency('cold') >= 1
+    assert sketch.frequency('cold') < sketch.frequency('hot')
+
+    # Counters are halved once the sketch has seen enough increments
+    for index in range(sketch.sample_size):
+        sketch.increment(index)
+    assert sketch.frequency('hot') < 15
+
+
+def test_tinylfu_keeps_hot_keys_through_a_scan():
+    cache = WTinyLFUCache(100)
+    for key in range(10):
+        cache[f'hot{key}'] = key
+
+    # Unique keys stream past while the hot keys keep being read
+    for key in range(10_000):
+        cache[f'scan{key}'] = key
+        if key % 20 == 0:
+            for hot in range(10):
+                assert cache.get(f'hot{hot}') == hot
+
+    assert len(cache) <= 100
+    assert all(f'hot{key}' in cache for key in range(10))
+    assert cache.evictions > 0
+
+
+def test_tinylfu_sized():
+    cache = WTinyLFUCache(10_000, sized=True)
+    for key in range(1000):
+        cache[str(key)] = 'x' * 100
+    assert cache.currsize <= 10_000
+    with pytest.raises(ValueError):
+        cache['big'] = 'x' * 20_000
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_expiring_cache():
+    timer = FakeTimer()
+    cache = ExpiringCache(make_l1('lru', 10), 10, timer)
+    cache['a'] = 1
+    cache.set('b', 2, 5)
+    cache.set('c', 3, 60)
+    assert cache.remaining('b') == 5
+    # Entries never outlive the cache's ttl
+    assert cache.remaining('c') == 10
+
+    timer.now = 6
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert 'b' not in cache
+
+    timer.now = 11
+    assert cache.remaining('a') is None
+    with pytest.raises(KeyError):
+        cache['a']
+
+
+@pytest.mark.parametrize('policy', ['lru', 'lfu', 'ttl', 'tinylfu'])
+def test_make_l1(policy):
+    ttl = 60 if policy == 'ttl' else None
+    cache = make_l1(policy, 10, ttl=ttl)
+    for key in range(100):
+        cache[key] = key
+    assert len(cache) <= 10
+    assert cache.evictions > 0
+    assert isinstance(cache, ExpiringCache) == (ttl is not None)
+
+
+def test_make_l1_unknown_policy():
+    with pytest.raises(ValueError):
+        make_l1('fifo')
+    with pytest.raises(ValueError):
+        make_l1('ttl')
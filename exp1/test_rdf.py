@@ -0,0 +1,37 @@
+import gzip
+
+from utils.rdf import RDFShardWriter, blank_node, escape_literal, nquad, nquad_literal
+
+
+def test_escape_literal():
+    assert escape_literal('plain') == 'plain'
+    assert escape_literal('say "hi"') == 'say \\"hi\\"'
+    assert escape_literal('back\\slash') == 'back\\\\slash'
+    assert escape_literal('a\nb\rc\td') == 'a\\nb\\rc\\td'
+    assert escape_literal(42) == '42'
+
+
+def test_nquads():
+    assert nquad('_:a', 'next', '_:b') == '_:a <next> _:b .\n'
+    assert nquad_literal('_:a', 'name', 'Jo "J"') == '_:a <name> "Jo \\"J\\"" .\n'
+
+
+def test_blank_node_is_deterministic():
+    assert blank_node('person', 12) == blank_node('person', '12')
+    assert blank_node('person', 12) != blank_node('person', 13)
+    assert blank_node('person', 12) != blank_node('country', 12)
+    assert blank_node('person', 12).startswith('_:person.')
+
+
+def test_rdf_shards(tmp_path):
+    writer = RDFShardWriter(str(tmp_path), 'people', shard_records=2)
+    for index in range(5):
+        writer.write(nquad_literal(f'_:p{index}', 'naid', index))
+    writer.close()
+
+    assert len(writer.paths) == 3
+    lines = []
+    for path in writer.paths:
+        with gzip.open(path, 'rt', encoding='utf8') as f:
+            lines.extend(f.read().splitlines())
+    assert lines == [f'_:p{index} <naid> "{index}" .' for index in range(5)]
@@ -0,0 +1,73 @@
+import grpc
+import pydgraph
+
+from utils.retry import AdaptiveBatchSize, backoff, is_aborted, is_retriable
+
+
+class RpcError(grpc.RpcError):
+    def __init__(self, code: grpc.StatusCode):
+        super(RpcError, self).__init__()
+        self._code = code
+
+    def code(self) -> grpc.StatusCode:
+        return self._code
+
+
+def test_is_aborted():
+    assert is_aborted(pydgraph.AbortedError())
+    assert is_aborted(RpcError(grpc.StatusCode.ABORTED))
+    assert not is_aborted(RpcError(grpc.StatusCode.DEADLINE_EXCEEDED))
+    assert not is_aborted(RpcError(grpc.StatusCode.UNAVAILABLE))
+    assert not is_aborted(ValueError())
+
+
+def test_is_retriable():
+    assert is_retriable(pydgraph.AbortedError())
+    assert is_retriable(RpcError(grpc.StatusCode.ABORTED))
+    assert is_retriable(RpcError(grpc.StatusCode.DEADLINE_EXCEEDED))
+    assert is_retriable(RpcError(grpc.StatusCode.UNAVAILABLE))
+    assert not is_retriable(RpcError(grpc.StatusCode.INVALID_ARGUMENT))
+    assert not is_retriable(ValueError())
+
+
+def test_backoff():
+    for attempt in range(1, 12):
+        assert 0 <= backoff(attempt) <= min(10.0, 0.1 * 2 ** attempt)
+
+
+def test_adaptive_batch_size_grows_when_fast():
+    sizer = AdaptiveBatchSize(100, maximum=150)
+    sizer.success(0.5)
+    assert sizer.size == 125
+    sizer.success(0.5)
+    sizer.success(0.5)
+    assert sizer.size == 150
+
+    # Small sizes still grow by at least one record
+    sizer = AdaptiveBatchSize(1)
+    sizer.success(0.5)
+    assert sizer.size == 2
+
+
+def test_adaptive_batch_size_shrinks_when_slow():
+    sizer = AdaptiveBatchSize(1000, target_latency=2.0)
+    sizer.success(2.0)
+    assert sizer.size == 1000
+    sizer.success(2.5)
+    assert sizer.size == 800
+    # Very slow commits shrink by at most the shrink factor
+    sizer.success(20.0)
+    assert sizer.size == 400
+
+
+def test_adaptive_batch_size_failure():
+    sizer = AdaptiveBatchSize(10, minimum=3)
+    sizer.failure()
+    assert sizer.size == 5
+    sizer.failure()
+    sizer.failure()
+    assert sizer.size == 3
+
+    # The starting size is clamped to the bounds
+    assert AdaptiveBatchSize(50_000).size == 10_000
+    assert AdaptiveBatchSize(0, minimum=2).size == 2
@@ -0,0 +1,45 @@
+from utils.shards import ShardWriter, read_shard
+
+
+def _person(index: int) -> dict:
+    return {
+        'naid': str(index),
+        'name': f'Person {index}',
+        'alias': '',
+        'age': 30 + index,
+        'age_of_entry': -1,
+        'age_of_naturalization': 25,
+        'country': 'italy',
+        'port_of_entry': 'new york',
+        'year_of_entry': str(1940 + index) if index % 2 else -1,
+        'sex': 'f',
+    }
+
+
+def test_shard_round_trip(tmp_path):
+    writer = ShardWriter(str(tmp_path / 'people'), shard_rows=3)
+    people = [_person(index) for index in range(7)]
+    for person in people:
+        writer.add(person)
+    writer.close()
+
+    assert len(writer.paths) == 3
+    read = [person for path in writer.paths for batch in read_shard(path, 2) for person in batch]
+    assert read == people
+
+
+def test_unknown_year_is_stored_as_null(tmp_path):
+    import pyarrow.parquet as pq
+
+    writer = ShardWriter(str(tmp_path / 'people'))
+    writer.add(_person(0))
+    writer.close()
+
+    assert pq.read_table(writer.paths[0]).column('year_of_entry').to_pylist() == [None]
+    assert next(read_shard(writer.paths[0]))[0]['year_of_entry'] == -1
+
+
+def test_empty_writer_writes_nothing(tmp_path):
+    writer = ShardWriter(str(tmp_path / 'people'))
+    writer.close()
+    assert writer.paths == []
@@ -0,0 +1,131 @@
+import multiprocessing as mp
+import struct
+
+import pytest
+
+from utils import shared_table
+from utils.shared_table import SharedTable
+
+
+@pytest.fixture
+def table():
+    table = SharedTable(capacity=16, key_size=16, value_size=8, max_probes=4)
+    yield table
+    table.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # time.time as seen by the table
+    now = [1000.0]
+    monkeypatch.setattr(shared_table.time, 'time', lambda: now[0])
+    return now
+
+
+def _find_slot(table: SharedTable, key: str) -> tuple:
+    # Offset and version of the slot holding a key
+    encoded = key.encode('utf8')
+    key_hash = shared_table._hash(encoded)
+    for probe in range(table.max_probes):
+        offset = table._offset((key_hash + probe) & table.mask)
+        if bytes(table.shm.buf[offset + shared_table._slot.size:][:len(encoded)]) == encoded:
+            return offset, shared_table._slot.unpack_from(table.shm.buf, offset)[0]
+    raise KeyError(key)
+
+
+def test_set_get(table):
+    assert table.capacity == 16
+    assert table.set('country-italy', '0x1')
+    assert table.set_many({'sex-f': '0x2', 'sex-m': '0x3'}) == 2
+    assert table.get('country-italy') == '0x1'
+    assert table.get_many(['sex-f', 'sex-m', 'sex-x']) == {'sex-f': '0x2', 'sex-m': '0x3'}
+    assert len(table) == 3
+
+    # Updates reuse the key's slot
+    assert table.set('sex-f', '0x9')
+    assert table.get('sex-f') == '0x9'
+    assert len(table) == 3
+
+
+def test_too_large(table):
+    assert not table.set('k' * 17, 'v')
+    assert not table.set('k', 'v' * 9)
+    assert table.set_many({'k' * 17: 'v', 'ok': 'v'}) == 1
+    assert table.get('k' * 17) is None
+
+
+def test_ttl(table, clock):
+    table.set('a', '1', ttl=10)
+    table.set_many({'b': '2', 'c': '3'}, ttl=10, ttls={'b': 2})
+    table.set('d', '4')
+
+    clock[0] += 5
+    assert table.get_many(['a', 'b', 'c', 'd']) == {'a': '1', 'c': '3', 'd': '4'}
+    clock[0] += 10
+    assert table.get_many(['a', 'b', 'c', 'd']) == {'d': '4'}
+
+
+def test_probing(table, clock, monkeypatch):
+    # Every key hashes to the same slot, so they probe the next slots in turn
+    monkeypatch.setattr(shared_table, '_hash', lambda key: 5)
+    for index in range(4):
+        assert table.set(f'k{index}', str(index), ttl=10 if index == 1 else None)
+    assert not table.set('k4', '4')
+    assert table.get('k4') is None
+    assert [table.get(f'k{index}') for index in range(4)] == ['0', '1', '2', '3']
+
+    # Expired slots are reused
+    clock[0] += 20
+    assert table.set('k4', '4')
+    assert table.get('k4') == '4'
+    assert table.get('k1') is None
+    assert len(table) == 4
+
+
+def test_versions(table):
+    table.set('a', '1')
+    offset, version = _find_slot(table, 'a')
+    assert version == 2
+    table.set('a', '2')
+    assert _find_slot(table, 'a')[1] == 4
+
+    # A reader that only ever sees the slot mid-write treats it as a miss
+    struct.pack_into('<I', table.shm.buf, offset, 5)
+    assert table.get('a') is None
+    struct.pack_into('<I', table.shm.buf, offset, 6)
+    assert table.get('a') == '2'
+
+
+def test_attach(table):
+    table.set('a', '1')
+    other = SharedTable.attach(table.name, table.lock)
+    try:
+        assert other.get('a') == '1'
+        other.set('b', '2')
+        assert table.get('b') == '2'
+    finally:
+        other.close()
+
+    # Only the owner frees the shared memory
+    assert table.get('a') == '1'
+
+
+def _child(table, queue):
+    table.set('child', 'yes')
+    queue.put(table.get('parent'))
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_shared_with_child_process(method):
+    context = mp.get_context(method)
+    table = SharedTable(capacity=16, lock=context.Lock())
+    try:
+        table.set('parent', 'yes')
+        queue = context.Queue()
+        process = context.Process(target=_child, args=(table, queue))
+        process.start()
+        assert queue.get(timeout=30) == 'yes'
+        process.join()
+        assert table.get('child') == 'yes'
+    finally:
+        table.close()
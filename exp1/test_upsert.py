@@ -0,0 +1,68 @@
+from utils.upsert import UpsertBatch
+
+field_uid_map = {'country': 'c', 'year_of_entry': 'yoe'}
+root_edges = [('country', 'countries'), ('year_of_entry', 'years_of_entry')]
+
+
+def _person(naid: str, country: str, year) -> dict:
+    return {'naid': naid, 'name': f'Person "{naid}"', 'alias': '', 'country': country, 'year_of_entry': year}
+
+
+def _batch() -> UpsertBatch:
+    batch = UpsertBatch(field_uid_map, root_edges)
+    batch.add(_person('1', 'italy', '1901'))
+    batch.add(_person('2', '', -1))
+    batch.add(_person('3', 'italy', '1901'))
+    return batch
+
+
+def test_query():
+    batch = _batch()
+    assert len(batch) == 3
+    assert batch.query() == '\n'.join([
+        'query {',
+        'root as var(func: type(Root))',
+        'p0 as var(func: eq(naid, "1"))',
+        'p1 as var(func: eq(naid, "2"))',
+        'p2 as var(func: eq(naid, "3"))',
+        'v0 as var(func: eq(country, "italy"))',
+        'v1 as var(func: eq(year_of_entry, "1901"))',
+        'v2 as var(func: eq(country, "unknown"))',
+        '}',
+    ])
+
+
+def test_del_nquads():
+    lines = _batch().del_nquads().splitlines()
+    assert lines == [
+        f'uid(p{index}) <{edge}> * .'
+        for index in range(3)
+        for edge in ('c', 'yoe')
+    ]
+
+
+def test_set_nquads():
+    lines = _batch().set_nquads().splitlines()
+
+    # Each category is written once, and linked from the root
+    assert 'uid(v0) <dgraph.type> "Country" .' in lines
+    assert 'uid(v1) <year_of_entry> "1901" .' in lines
+    assert 'uid(root) <years_of_entry> uid(v1) .' in lines
+    assert 'uid(v2) <country> "unknown" .' in lines
+    assert 'uid(p1) <name> "Person \\"2\\"" .' in lines
+    assert 'uid(root) <people> uid(p2) .' in lines
+    assert 'uid(p0) <c> uid(v0) .' in lines
+    assert 'uid(p2) <yoe> uid(v1) .' in lines
+
+    # A missing year of entry (-1) is not a valid dateTime, so that person
+    # gets no year node or edge
+    assert 'uid(p1) <c> uid(v2) .' in lines
+    assert not any(line.startswith('uid(p1) <yoe>') for line in lines)
+    assert not any('"-1"' in line for line in lines)
+
+
+def test_re_adding_a_person_replaces_it():
+    batch = _batch()
+    batch.add(_person('1', 'spain', '1901'))
+    assert len(batch) == 3
+    assert 'uid(p0) <c> uid(v3) .' in batch.set_nquads().splitlines()
@@ -0,0 +1,377 @@
+import json
+from typing import Dict, Iterable, List, Set, Union
+
+import redis.asyncio as redis
+from cachetools import TTLCache
+from redis import exceptions
+
+from utils.async_dgraph import AsyncDgraphClient
+from utils.dgraph import match_uids, uids_query
+from utils.policies import make_l1
+
+
+class AsyncLayeredCache(object):
+    """
+    Asyncio version of LayeredCache, with the same layers.
+    Layer 1: In Memory Key Value Map (LRU by default)
+    Layer 2: Redis Key Value Store
+    Coroutines can't implement [] and in, so lookups are get, set and contains.
+    """
+
+    def __init__(self, node_name: str, lru_size: int, policy: str = 'lru',
+                 max_bytes: int = 0, timeout: int = None):
+        """
+        Initialize the first two layers of a multi-layered cache
+
+        :param node_name:
+        :param lru_size: max number of entries in layer 1
+        :param policy: layer 1 eviction policy (lru, lfu, ttl or tinylfu)
+        :param max_bytes: if set, bound layer 1 by approximate bytes instead of entries
+        :param timeout: seconds before values expire from every layer (None for no expiry)
+        """
+        super(AsyncLayeredCache, self).__init__()
+
+        # Track the name of the node Type. This should be whatever
+        # unique identifier can be used in dgraph queries.
+        self.node_name = node_name
+
+        # Values expire from layer 1 and redis after the same timeout. Values
+        # read back from redis keep their remaining TTL in layer 1.
+        self.timeout = timeout
+        self.set_timeout = timeout is not None
+
+        # Initialize an in-memory cache, evicting with the given policy.
+        # layer 1
+        self.policy = policy
+        self.local_cache = make_l1(policy, lru_size, max_bytes, timeout)
+
+        # Initialize an asyncio redis client.
+        # layer 2 cache
+        self.redis = redis.from_url("redis://localhost")
+
+    def _get_key(self, key: str) -> str:
+        """
+        Get the unique key that is used at each cached layer.
+        :param key:
+        :return:
+        """
+        return f"{self.node_name}-{key}"
+
+    def _fill_local(self, local_key: str, value: str, ttl: float = None):
+        """
+        Store a value that came from redis (or below) in layer 1.
+        :param local_key:
+        :param value:
+        :param ttl: seconds the value has left in redis (None for the full timeout)
+        :return:
+        """
+        if ttl is not None and self.set_timeout:
+            self.local_cache.set(local_key, value, ttl)
+        else:
+            self.local_cache[local_key] = value
+
+    def _remaining_ttl(self, pttl: int) -> Union[float, None]:
+        """
+        Convert a redis PTTL reply to the seconds a value has left.
+        :param pttl: milliseconds left, -1 for no expiry, -2 if the key is gone
+        :return: seconds left, None for the full timeout
+        """
+        if not self.set_timeout or pttl == -1:
+            return None
+        return max(pttl, 0) / 1000
+
+    async def _get_redis(self, local_keys: List[str]) -> List[tuple]:
+        """
+        Get values from redis with one round trip. With a timeout, their
+        remaining TTLs are fetched in the same pipeline.
+        :param local_keys:
+        :return: (value, seconds left) for each key, value None if it was not found
+        """
+        if not self.set_timeout:
+            return [(value, None) for value in await self.redis.mget(local_keys)]
+
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.mget(local_keys)
+        for local_key in local_keys:
+            pipeline.pttl(local_key)
+        values, *pttls = await pipeline.execute()
+        return [
+            (value, self._remaining_ttl(pttl))
+            for value, pttl in zip(values, pttls)
+        ]
+
+    async def set(self, key: str, value: str):
+        """
+        Store a key value pair in each cache layer.
+        :param key:
+        :param value:
+        :return:
+        """
+
+        # Store in layer 1 local LRU cache
+        self.local_cache[self._get_key(key)] = value
+
+        # Store in layer 2 redis cache
+        if self.set_timeout:
+            await self.redis.setex(self._get_key(key), self.timeout, value)
+        else:
+            await self.redis.set(self._get_key(key), value)
+
+    async def set_many(self, mapping: Dict[str, str]):
+        """
+        Store many key value pairs in each cache layer, with one redis pipeline.
+        :param mapping:
+        :return:
+        """
+        if len(mapping) == 0:
+            return
+
+        for key, value in mapping.items():
+            self.local_cache[self._get_key(key)] = value
+
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            if self.set_timeout:
+                pipeline.setex(self._get_key(key), self.timeout, value)
+            else:
+                pipeline.set(self._get_key(key), value)
+        await pipeline.execute()
+
+    async def get(self, key: str) -> Union[str, None]:
+        """
+        Check each layer iteratively for the key specified. If we find the result
+        at a given layer, we update previous layers with the result.
+        If the result was not found, return None.
+        :param key:
+        :return:
+        """
+
+        # Check the layer 1 local LRU cache
+        local_result = self.local_cache.get(self._get_key(key), None)
+        if local_result is not None:
+            return local_result
+
+        # Check the layer 2 redis cache
+        (redis_result, ttl), = await self._get_redis([self._get_key(key)])
+        if redis_result is not None:
+            # Update layer 1 only, for as long as redis keeps the value
+            self._fill_local(self._get_key(key), redis_result.decode(), ttl)
+            return redis_result.decode()
+
+        # Cache miss, return None
+        return None
+
+    async def contains(self, key: str) -> bool:
+        return await self.get(key) is not None
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Look up many keys, with at most one MGET for the layer 1 misses.
+        :param keys:
+        :return: key value pairs that were found
+        """
+        result = dict()
+        misses = []
+        for key in keys:
+            local_result = self.local_cache.get(self._get_key(key), None)
+            if local_result is not None:
+                result[key] = local_result
+            else:
+                misses.append(key)
+
+        if len(misses) == 0:
+            return result
+
+        redis_results = await self._get_redis([self._get_key(key) for key in misses])
+        for key, (redis_result, ttl) in zip(misses, redis_results):
+            if redis_result is not None:
+                # Update layer 1 only, for as long as redis keeps the value
+                result[key] = redis_result.decode()
+                self._fill_local(self._get_key(key), result[key], ttl)
+
+        return result
+
+    async def contains_many(self, keys: Iterable[str]) -> Set[str]:
+        return set(await self.get_many(keys))
+
+    async def close(self):
+        """
+        Close any outstanding connections.
+        :return:
+        """
+        await self.redis.close()
+
+
+class AsyncFullLayeredCache(AsyncLayeredCache):
+    """
+    Asyncio version of FullLayeredCache, with the same layers and the same
+    bloom filter and negative caching rules.
+    Layer 1: In Memory Key Value Map (LRU by default)
+    Layer 2: Redis Key Value Store
+    Layer 3: Bloom filter
+    Layer 4: DGraph
+    Call initialize once before using it, to create the bloom filter.
+    Bloom filter negatives are only trusted once FullLayeredCache.warm_up
+    has populated the filter; until then every miss is checked in dgraph.
+    """
+
+    def __init__(self, node_name: str, lru_size: int, p=1.0e-6, n=1000000,
+                 negative_size: int = 100_000, negative_ttl: float = 60,
+                 dgraph: AsyncDgraphClient = None, policy: str = 'lru',
+                 max_bytes: int = 0, timeout: int = 300):
+        """
+        Initialize last two layers of cache
+        :param node_name:
+        :param lru_size:
+        :param negative_size: max number of missing keys to remember
+        :param negative_ttl: seconds to remember a missing key for
+        :param dgraph: client to share with other caches (a new one is opened if None)
+        :param policy: layer 1 eviction policy
+        :param max_bytes: if set, bound layer 1 by approximate bytes instead of entries
+        :param timeout: seconds before values expire from layers 1 and 2
+        """
+        super(AsyncFullLayeredCache, self).__init__(node_name, lru_size, policy, max_bytes, timeout)
+
+        # Keys known not to exist in any layer
+        self.negative_cache = TTLCache(maxsize=negative_size, ttl=negative_ttl)
+
+        # Bloom filter commands go through a plain asyncio redis client
+        self.bloom = redis.from_url("redis://localhost:6378")
+        self.p = p
+        self.n = n
+
+        # Set by FullLayeredCache.warm_up once the filter holds every key
+        self.populated_key = f"{node_name}-bloom-populated"
+        self.populated = False
+
+        # Create (or share) a dgraph client
+        self.owns_dgraph = dgraph is None
+        self.dgraph = dgraph or AsyncDgraphClient()
+
+    async def initialize(self):
+        """
+        Initialize the bloom filter (if it doesnt already exist)
+        :return:
+        """
+        try:
+            await self.bloom.execute_command('BF.INFO', self.node_name)
+        except exceptions.ResponseError:
+            await self.bloom.execute_command('BF.RESERVE', self.node_name, self.p, self.n)
+
+    async def _bloom_populated(self) -> bool:
+        """
+        Check if the bloom filter's negatives can be trusted, see
+        FullLayeredCache._bloom_populated.
+        :return:
+        """
+        if not self.populated:
+            self.populated = await self.bloom.exists(self.populated_key) == 1
+        return self.populated
+
+    async def set(self, key: str, value: str):
+        await super(AsyncFullLayeredCache, self).set(key, value)
+        self.negative_cache.pop(self._get_key(key), None)
+        await self.bloom.execute_command('BF.ADD', self.node_name, self._get_key(key))
+
+    async def set_many(self, mapping: Dict[str, str]):
+        if len(mapping) == 0:
+            return
+
+        await super(AsyncFullLayeredCache, self).set_many(mapping)
+        for key in mapping:
+            self.negative_cache.pop(self._get_key(key), None)
+        await self.bloom.execute_command('BF.MADD', self.node_name, *[self._get_key(key) for key in mapping])
+
+    async def _query_dgraph_many(self, keys: List[str]) -> Dict[str, str]:
+        """
+        Look up the uids of many keys in dgraph with a single query.
+        :param keys:
+        :return: key uid pairs for the keys that exist in dgraph
+        """
+        if len(keys) == 0:
+            return dict()
+
+        dgraph_result = await self.dgraph.txn(read_only=True).query(uids_query(self.node_name, keys))
+        return match_uids(self.node_name, keys, json.loads(dgraph_result.json)["all"])
+
+    async def get(self, key: str) -> Union[str, None]:
+        """
+        Check each layer iteratively for the key specified. If we find the result
+        at a given layer, we update previous layers with the result.
+        If the result was not found, return None.
+        :param key:
+        :return:
+        """
+        # Check layer 1 and 2
+        item = await super(AsyncFullLayeredCache, self).get(key)
+        if item is not None:
+            return item
+
+        # Check if we already know the key is missing
+        if self._get_key(key) in self.negative_cache:
+            return None
+
+        # Check layer 3 bloom filter. If it has never seen the key, neither has dgraph.
+        exists_in_bloom = await self.bloom.execute_command('BF.EXISTS', self.node_name, self._get_key(key))
+        if exists_in_bloom != 1 and await self._bloom_populated():
+            self.negative_cache[self._get_key(key)] = True
+            return None
+
+        # The bloom filter says maybe, check dgraph
+        found = await self._query_dgraph_many([key])
+        if key in found:
+            await self.set(key, found[key])
+            return found[key]
+
+        self.negative_cache[self._get_key(key)] = True
+        return None
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Batched version of get, with one round trip per layer.
+        :param keys:
+        :return: key value pairs that were found
+        """
+        keys = list(keys)
+
+        # Check layer 1 and 2
+        result = await super(AsyncFullLayeredCache, self).get_many(keys)
+        misses = [
+            key for key in keys
+            if key not in result and self._get_key(key) not in self.negative_cache
+        ]
+        if len(misses) == 0:
+            return result
+
+        # Check layer 3 bloom filter
+        exists_in_bloom = await self.bloom.execute_command(
+            'BF.MEXISTS', self.node_name, *[self._get_key(key) for key in misses])
+        maybe = [key for key, exists in zip(misses, exists_in_bloom) if exists == 1]
+        if await self._bloom_populated():
+            for key, exists in zip(misses, exists_in_bloom):
+                if exists != 1:
+                    self.negative_cache[self._get_key(key)] = True
+        else:
+            maybe = misses
+
+        # Check dgraph for every key the bloom filter may have seen at once
+        found = await self._query_dgraph_many(maybe)
+        for key in maybe:
+            if key not in found:
+                self.negative_cache[self._get_key(key)] = True
+
+        # Update previous layers
+        await self.set_many(found)
+        result.update(found)
+
+        return result
+
+    async def close(self):
+        """
+        Close all outstanding connections
+        :return:
+        """
+        await super(AsyncFullLayeredCache, self).close()
+        await self.bloom.close()
+        if self.owns_dgraph:
+            await self.dgraph.close()
@@ -0,0 +1,203 @@
+import itertools
+import json
+
+import grpc
+import pydgraph
+from pydgraph.proto import api_pb2 as api
+from pydgraph.proto import api_pb2_grpc as api_grpc
+
+from utils import dgraph
+
+
+class AsyncTxn(object):
+    """
+    Asyncio counterpart of pydgraph.Txn. Tracks the transaction context
+    returned by each request so that it can be committed or discarded.
+    """
+
+    def __init__(self, client, read_only: bool = False, best_effort: bool = False):
+        """
+        :param client: AsyncDgraphClient the transaction runs on
+        :param read_only:
+        :param best_effort:
+        """
+        super(AsyncTxn, self).__init__()
+
+        # Like pydgraph, a transaction sticks to a single alpha
+        self._stub = client.any_stub()
+        self._ctx = api.TxnContext()
+        self._read_only = read_only
+        self._best_effort = best_effort
+        self._mutated = False
+        self._finished = False
+
+    def _merge_context(self, src: api.TxnContext):
+        if src is None:
+            return
+        if self._ctx.start_ts == 0:
+            self._ctx.start_ts = src.start_ts
+        self._ctx.keys.extend(src.keys)
+        self._ctx.preds.extend(src.preds)
+
+    async def do_request(self, request: api.Request, timeout: float = None) -> api.Response:
+        """
+        Send a query and/or mutation request.
+
+        :param request:
+        :param timeout:
+        :return:
+        """
+        if self._finished:
+            raise pydgraph.TransactionError('Transaction has already been committed or discarded')
+
+        if len(request.mutations) > 0:
+            if self._read_only:
+                raise pydgraph.TransactionError('Readonly transaction cannot run mutations')
+            self._mutated = True
+
+        request.start_ts = self._ctx.start_ts
+        try:
+            response = await self._stub.Query(request, timeout=timeout)
+        except grpc.RpcError as e:
+            # Whatever went wrong, the transaction can't be used any more.
+            # Even if a failed commit_now mutation was applied (see
+            # retry.is_aborted), there is nothing left to abort.
+            self._finished = True
+            if e.code() == grpc.StatusCode.ABORTED:
+                raise pydgraph.AbortedError()
+            raise
+
+        if request.commit_now:
+            self._finished = True
+        self._merge_context(response.txn)
+        return response
+
+    async def query(self, query: str, variables: dict = None, timeout: float = None) -> api.Response:
+        """
+        Run a query in this transaction.
+
+        :param query:
+        :param variables:
+        :param timeout:
+        :return:
+        """
+        request = api.Request(
+            query=query,
+            vars=variables or {},
+            read_only=self._read_only,
+            best_effort=self._best_effort,
+        )
+        return await self.do_request(request, timeout=timeout)
+
+    async def mutate(self, set_obj=None, set_json: bytes = None, set_nquads: str = None,
+                     del_nquads: str = None, commit_now: bool = False,
+                     timeout: float = None) -> api.Response:
+        """
+        Run a single mutation in this transaction.
+
+        :param set_obj: object to json encode and set
+        :param set_json: already encoded json to set
+        :param set_nquads:
+        :param del_nquads:
+        :param commit_now:
+        :param timeout:
+        :return:
+        """
+        mutation = api.Mutation()
+        if set_obj is not None:
+            mutation.set_json = json.dumps(set_obj).encode('utf8')
+        if set_json is not None:
+            mutation.set_json = set_json
+        if set_nquads is not None:
+            mutation.set_nquads = set_nquads.encode('utf8')
+        if del_nquads is not None:
+            mutation.del_nquads = del_nquads.encode('utf8')
+
+        request = api.Request(mutations=[mutation], commit_now=commit_now)
+        return await self.do_request(request, timeout=timeout)
+
+    async def commit(self, timeout: float = None):
+        """
+        Commit the transaction.
+
+        :param timeout:
+        :return:
+        """
+        if self._finished:
+            raise pydgraph.TransactionError('Transaction has already been committed or discarded')
+        self._finished = True
+        if not self._mutated:
+            return
+
+        try:
+            await self._stub.CommitOrAbort(self._ctx, timeout=timeout)
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.ABORTED:
+                raise pydgraph.AbortedError()
+            raise
+
+    async def discard(self, timeout: float = None):
+        """
+        Discard the transaction, if it has not already finished. Like
+        pydgraph's Txn.discard, errors are ignored, so discarding in a
+        finally block never hides the error that got there.
+
+        :param timeout:
+        :return:
+        """
+        if self._finished:
+            return
+        self._finished = True
+        # Without a start timestamp dgraph has nothing to abort
+        if not self._mutated or self._ctx.start_ts == 0:
+            return
+
+        self._ctx.aborted = True
+        try:
+            await self._stub.CommitOrAbort(self._ctx, timeout=timeout)
+        except grpc.RpcError:
+            pass
+
+
+class AsyncDgraphClient(object):
+    """
+    Dgraph client built on grpc.aio channels. A single event loop can keep
+    many queries and mutations in flight on the same channels, instead of
+    using a process per concurrent request.
+    """
+
+    def __init__(self, addrs: list = None):
+        """
+        Open an aio channel to each alpha.
+
+        :param addrs: host:port of each alpha (defaults to utils.dgraph.alphas)
+        """
+        super(AsyncDgraphClient, self).__init__()
+
+        self.addrs = list(addrs or dgraph.alphas)
+        self.channels = [grpc.aio.insecure_channel(addr) for addr in self.addrs]
+        self.stubs = [api_grpc.DgraphStub(channel) for channel in self.channels]
+        self.next_index = itertools.count()
+
+    def any_stub(self) -> api_grpc.DgraphStub:
+        """
+        Pick the alpha the next transaction runs on, round robin.
+
+        :return:
+        """
+        return self.stubs[next(self.next_index) % len(self.stubs)]
+
+    def txn(self, read_only: bool = False, best_effort: bool = False) -> AsyncTxn:
+        return AsyncTxn(self, read_only=read_only, best_effort=best_effort)
+
+    async def alter(self, operation: api.Operation, timeout: float = None):
+        return await self.any_stub().Alter(operation, timeout=timeout)
+
+    async def close(self):
+        """
+        Close each alpha channel.
+
+        :return:
+        """
+        for channel in self.channels:
+            await channel.close()
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import time
+
+import pydgraph
+
+from utils.rdf import escape_literal
+from utils.retry import AdaptiveBatchSize, backoff, is_aborted, is_retriable
+
+
+def _upsert_var(key) -> str:
+    # Query variable bound to the node with this key. It is derived from
+    # the key itself, so a key added twice maps to the same node.
+    return 'k' + str(key).encode('utf8').hex()
+
+
+class _Records(object):
+    """
+    Encoded json objects waiting to be committed, with the uid each record
+    is referred to by (a blank node or an upsert variable) and its upsert key.
+    """
+
+    def __init__(self):
+        super(_Records, self).__init__()
+
+        self.objects = []
+        self.uids = []
+        self.keys = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def append(self, encoded: bytes, uid: str, key=None):
+        self.objects.append(encoded)
+        self.uids.append(uid)
+        self.keys.append(key)
+        self.size += len(encoded) + 1
+
+    def drop(self, count: int):
+        """
+        Remove the first count records, once they have been committed.
+
+        :param count:
+        :return:
+        """
+        self.size -= sum(len(encoded) + 1 for encoded in self.objects[:count])
+        del self.objects[:count]
+        del self.uids[:count]
+        del self.keys[:count]
+
+
+class MutationBatch(object):
+    """
+    Accumulates JSON mutation objects and sends them to dgraph as a single
+    JSON list payload per commit. Each object is encoded once when it is
+    added, so the batch can be bounded by either the number of records or
+    the number of encoded bytes.
+
+    With an upsert_key, each record is matched to an existing node on that
+    predicate instead of always creating a new one. Writing the same batch
+    twice then leaves the graph unchanged, so everything is_retriable is
+    retried, not just aborts.
+    """
+
+    def __init__(self, client, max_records: int = 1000, max_bytes: int = 0,
+                 link_to: tuple = None, name: str = 'batch', adaptive: bool = False,
+                 timeout: float = None, retries: int = 8, upsert_key: str = None):
+        """
+        Initialize an empty mutation batch.
+
+        :param client: dgraph client to send mutations with
+        :param max_records: flush after this many records (0 for no limit)
+        :param max_bytes: flush after this many encoded bytes (0 for no limit)
+        :param link_to: optional (uid, predicate) pair. Every record in the batch
+                        is linked to this node with one extra object per commit.
+        :param name: label used when reporting throughput
+        :param adaptive: adapt the number of records per commit, starting at
+                         max_records. It shrinks on failed or slow commits and
+                         grows when commits are fast, up to the larger of
+                         max_records and 10000.
+        :param timeout: seconds before a commit times out (None for no timeout)
+        :param retries: times a failed commit is retried
+        :param upsert_key: predicate records are matched on (None to always
+                           create new nodes from their blank uids)
+        """
+        super(MutationBatch, self).__init__()
+
+        self.client = client
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.link_to = link_to
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.upsert_key = upsert_key
+        self.can_retry = is_aborted if upsert_key is None else is_retriable
+
+        self.sizer = None
+        if adaptive:
+            self.sizer = AdaptiveBatchSize(max_records or 1000, maximum=max(max_records, 10_000))
+
+        self.records = _Records()
+
+        # Running totals for throughput reporting
+        self.total_records = 0
+        self.total_bytes = 0
+        self.total_time = 0.0
+        self.total_retries = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def full(self) -> bool:
+        """
+        Check if the batch has reached either of its limits.
+
+        :return:
+        """
+        if self.sizer is not None:
+            if len(self) >= self.sizer.size:
+                return True
+        elif self.max_records and len(self) >= self.max_records:
+            return True
+        if self.max_bytes and self.records.size >= self.max_bytes:
+            return True
+        return False
+
+    def _append(self, obj: dict):
+        """
+        Encode a record and add it to the batch.
+
+        :param obj:
+        :return:
+        """
+        key = None
+        if self.upsert_key is not None:
+            key = obj[self.upsert_key]
+            obj = dict(obj, uid=f'uid({_upsert_var(key)})')
+        self.records.append(json.dumps(obj).encode('utf8'), obj['uid'], key)
+
+    def add(self, obj: dict) -> dict:
+        """
+        Add a single record to the batch. The batch is flushed when it
+        becomes full. The uids dgraph assigned are returned if a flush happened.
+
+        :param obj:
+        :return:
+        """
+        self._append(obj)
+        if self.full():
+            return self.flush()
+        return dict()
+
+    def payload(self, records: _Records, count: int) -> bytes:
+        """
+        Build the JSON list payload for the first count records.
+
+        :param records:
+        :param count:
+        :return:
+        """
+        objects = records.objects[:count]
+        if self.link_to is not None:
+            uid, predicate = self.link_to
+            objects.append(json.dumps({
+                'uid': uid,
+                predicate: [{'uid': record_uid} for record_uid in records.uids[:count]],
+            }).encode('utf8'))
+        return b'[' + b','.join(objects) + b']'
+
+    def query(self, records: _Records, count: int) -> str:
+        """
+        Build the upsert query block that binds the first count records
+        to the nodes with their keys.
+
+        :param records:
+        :param count:
+        :return:
+        """
+        lines = [
+            f'{_upsert_var(key)} as var(func: eq({self.upsert_key}, "{escape_literal(key)}"))'
+            for key in dict.fromkeys(records.keys[:count])
+        ]
+        return 'query {\n' + '\n'.join(lines) + '\n}'
+
+    def request(self, records: _Records, count: int) -> pydgraph.Request:
+        """
+        Build the request that commits the first count records, for either
+        a pydgraph or an async transaction.
+
+        :param records:
+        :param count:
+        :return:
+        """
+        query = ''
+        if self.upsert_key is not None:
+            query = self.query(records, count)
+        return pydgraph.Request(
+            query=query,
+            mutations=[pydgraph.Mutation(set_json=self.payload(records, count))],
+            commit_now=True,
+        )
+
+    def chunk_size(self, pending: int) -> int:
+        """
+        Get the number of records to send in the next commit. With adaptive
+        sizing the records are committed in chunks of the current batch
+        size, so a failed commit is retried with a smaller chunk.
+
+        :param pending: number of records waiting
+        :return:
+        """
+        if self.sizer is not None:
+            return min(pending, self.sizer.size)
+        return pending
+
+    def committed(self, count: int, request: pydgraph.Request, elapsed: float):
+        """
+        Record a successful commit.
+
+        :param count:
+        :param request:
+        :param elapsed:
+        :return:
+        """
+        if self.sizer is not None:
+            self.sizer.success(elapsed)
+        self.report(count, len(request.mutations[0].set_json), elapsed)
+
+    def failed(self, error: Exception, attempt: int, count: int) -> float:
+        """
+        Record a failed commit. The error is raised again unless it is safe
+        to retry (aborts, or anything is_retriable with an upsert_key) and
+        there are retries left.
+
+        :param error:
+        :param attempt: number of retries of this chunk so far
+        :param count:
+        :return: seconds to back off before the retry
+        """
+        if not self.can_retry(error) or attempt >= self.retries:
+            raise error
+
+        self.total_retries += 1
+        if self.sizer is not None:
+            self.sizer.failure()
+
+        delay = backoff(attempt + 1)
+        print(f'{self.name}: commit of {count} records failed ({error!r}), '
+              f'retry {attempt + 1}/{self.retries} in {delay:.2f}s')
+        return delay
+
+    def flush(self) -> dict:
+        """
+        Commit everything in the batch, retrying failed commits with
+        jittered exponential backoff.
+
+        :return: uids assigned to new nodes
+        """
+        uids = dict()
+        attempt = 0
+        while len(self.records) > 0:
+            count = self.chunk_size(len(self.records))
+            request = self.request(self.records, count)
+
+            start = time.time()
+            txn = self.client.txn()
+            try:
+                response = txn.do_request(request, timeout=self.timeout)
+            except Exception as e:
+                time.sleep(self.failed(e, attempt, count))
+                attempt += 1
+                continue
+            finally:
+                txn.discard()
+
+            self.committed(count, request, time.time() - start)
+            self.records.drop(count)
+            uids.update(response.uids)
+            attempt = 0
+
+        return uids
+
+    def report(self, records: int, size: int, elapsed: float):
+        """
+        Print throughput for a single committed batch.
+
+        :param records:
+        :param size:
+        :param elapsed:
+        :return:
+        """
+        self.total_records += records
+        self.total_bytes += size
+        self.total_time += elapsed
+
+        rate = records / elapsed if elapsed > 0 else float('inf')
+        print(f'{self.name}: committed {records} records '
+              f'({size / 1024:.1f} KiB) in {elapsed:.2f}s, {rate:.0f} records/s')
+
+    def close(self):
+        """
+        Flush anything left in the batch.
+
+        :return:
+        """
+        self.flush()
+
+
+class AsyncMutationBatch(MutationBatch):
+    """
+    MutationBatch for an AsyncDgraphClient. A full batch is committed in
+    the background while the next one is built, with at most inflight
+    commits outstanding. Payloads, batch limits, adaptive sizing, retries
+    and reporting all work the same as in MutationBatch.
+    """
+
+    def __init__(self, client, inflight: int = 4, **kwargs):
+        """
+        :param client: AsyncDgraphClient to send mutations with
+        :param inflight: max commits outstanding at once
+        :param kwargs: passed to MutationBatch
+        """
+        super(AsyncMutationBatch, self).__init__(client, **kwargs)
+
+        self.inflight = asyncio.Semaphore(inflight)
+        self.commits = []
+
+    async def add(self, obj: dict):
+        """
+        Add a single record to the batch, and start committing it when it
+        becomes full. Waits while inflight commits are already outstanding.
+
+        :param obj:
+        :return:
+        """
+        self._append(obj)
+        if self.full():
+            await self.flush()
+
+    async def flush(self):
+        """
+        Start committing everything in the batch in the background.
+
+        :return:
+        """
+        if len(self.records) == 0:
+            return
+
+        records, self.records = self.records, _Records()
+        await self.inflight.acquire()
+
+        # Failed commits are raised as soon as they are noticed
+        for commit in self.commits:
+            if commit.done():
+                commit.result()
+        self.commits = [commit for commit in self.commits if not commit.done()]
+        self.commits.append(asyncio.ensure_future(self._commit(records)))
+
+    async def _commit(self, records: _Records):
+        """
+        Commit records in chunks, retrying failed commits like MutationBatch.flush.
+
+        :param records:
+        :return:
+        """
+        try:
+            attempt = 0
+            while len(records) > 0:
+                count = self.chunk_size(len(records))
+                request = self.request(records, count)
+
+                start = time.time()
+                txn = self.client.txn()
+                try:
+                    await txn.do_request(request, timeout=self.timeout)
+                except Exception as e:
+                    await asyncio.sleep(self.failed(e, attempt, count))
+                    attempt += 1
+                    continue
+                finally:
+                    await txn.discard()
+
+                self.committed(count, request, time.time() - start)
+                records.drop(count)
+                attempt = 0
+        finally:
+            self.inflight.release()
+
+    async def close(self):
+        """
+        Flush anything left in the batch and wait for every commit.
+
+        :return:
+        """
+        await self.flush()
+        await asyncio.gather(*self.commits)
+        self.commits = []
@@ -1,28 +1,48 @@
 import json
-from typing import Union
+import os
+import pickle
+import time
+from typing import Dict, Iterable, List, Set, Union
 
-from cachetools.lru import LRUCache
+from cachetools import TTLCache
 from redis import Redis, exceptions
-from redisbloom.client import Client as RedisBloom
 
-from utils.dgraph import get_client
+from utils.cache_stats import CacheStats
+from utils.dgraph import get_client, match_uids, uids_query, value_key
+from utils.policies import make_l1
+from utils.shared_table import SharedTable
 
 
 class LayeredCache(object):
     """
     Multi-Layered key value store.
-    Layer 1: In Memory LRU Key Value Map
+    Layer 1: In Memory Key Value Map (LRU by default)
+    Layer 1.5: Optional Shared Memory Table, shared by the processes on a host
     Layer 2: Redis Key Value Store
     This cache type is great for things that can exist in memory, either
-    locally in the LRU layer or in the redis layer.
+    locally in the first layer or in the redis layer.
+
+    Layer 1 can use any eviction policy from utils.policies. For the ingest
+    pattern of a few very hot keys mixed with long scans of unique names,
+    tinylfu keeps the hot keys cached where lru would flush them.
     """
 
-    def __init__(self, node_name: str, lru_size: int):
+    def __init__(self, node_name: str, lru_size: int, policy: str = 'lru',
+                 max_bytes: int = 0, timeout: int = None, shared: SharedTable = None,
+                 write_behind: int = 0, flush_interval: float = 1.0):
         """
         Initialize the first two layers of a multi-layered cache
 
         :param node_name:
-        :param lru_size:
+        :param lru_size: max number of entries in layer 1
+        :param policy: layer 1 eviction policy (lru, lfu, ttl or tinylfu)
+        :param max_bytes: if set, bound layer 1 by approximate bytes instead of entries
+        :param timeout: seconds before values expire from every layer (None for no expiry)
+        :param shared: shared memory table to use between layers 1 and 2
+        :param write_behind: if set, buffer layer 2 writes and flush them in one
+                             pipeline once this many are pending
+        :param flush_interval: also flush buffered writes when the last flush
+                               was longer ago than this many seconds
         """
         super(LayeredCache, self).__init__()
 
@@ -30,18 +50,37 @@ class LayeredCache(object):
         # unique identifier can be used in dgraph queries.
         self.node_name = node_name
 
-        # Initialize a Least Recently Used in-memory cache
-        # with a maximum number of elements.
+        # This should be set if values should expire from the cache. Values
+        # read back from redis keep their remaining TTL in the layers above,
+        # so they are never served after redis has expired them.
+        self.timeout = timeout
+        self.set_timeout = timeout is not None
+
+        # Initialize an in-memory cache with a maximum number of elements
+        # (or bytes), evicting with the given policy.
         # layer 1
-        self.lru_local_cache = LRUCache(maxsize=lru_size)
+        self.policy = policy
+        self.local_cache = make_l1(policy, lru_size, max_bytes, timeout)
+
+        # Shared memory table, created by the parent process and read by
+        # every pool worker on the host.
+        # layer 1.5
+        self.shared = shared
 
         # Initialize a redis client.
         # layer 2 cache
         self.redis = Redis("localhost")
 
-        # This should be set to True if we should add a timeout to the
-        # redis key value store values.
-        self.set_timeout = False
+        # Layer 2 writes waiting to be flushed, in write-behind mode. They are
+        # sent when there are write_behind of them, when a write comes in
+        # flush_interval seconds after the last flush, or on close.
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.pending = dict()
+        self.last_flush = time.monotonic()
+
+        # Per-layer hit, miss, backfill and latency counters
+        self.metrics = CacheStats(node_name, ('l1', 'shared', 'redis') if shared is not None else ('l1', 'redis'))
 
     def _get_key(self, key: str) -> str:
         """
@@ -51,6 +90,115 @@ class LayeredCache(object):
         """
         return f"{self.node_name}-{key}"
 
+    def _fill_local(self, local_key: str, value: str, ttl: float = None):
+        """
+        Store a value that came from layer 2 (or below) in the layers above
+        it, without writing it back to redis.
+        :param local_key:
+        :param value:
+        :param ttl: seconds the value has left in redis (None for the full timeout)
+        :return:
+        """
+        if ttl is not None and self.set_timeout:
+            self.local_cache.set(local_key, value, ttl)
+        else:
+            self.local_cache[local_key] = value
+        if self.shared is not None:
+            self.shared.set(local_key, value, self.timeout if ttl is None else ttl)
+
+    def _remaining_ttl(self, pttl: int) -> Union[float, None]:
+        """
+        Convert a redis PTTL reply to the seconds a value has left, so the
+        layers above expire it when redis does.
+        :param pttl: milliseconds left, -1 for no expiry, -2 if the key is gone
+        :return: seconds left, None for the full timeout
+        """
+        if not self.set_timeout or pttl == -1:
+            return None
+        return max(pttl, 0) / 1000
+
+    def _get_redis(self, local_keys: List[str]) -> List[tuple]:
+        """
+        Get values from the layer 2 redis cache with one round trip. With a
+        timeout, their remaining TTLs are fetched in the same pipeline.
+        :param local_keys:
+        :return: (value, seconds left) for each key, value None if it was not found
+        """
+        if not self.set_timeout:
+            if len(local_keys) == 1:
+                return [(self.redis.get(local_keys[0]), None)]
+            return [(value, None) for value in self.redis.mget(local_keys)]
+
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.mget(local_keys)
+        for local_key in local_keys:
+            pipeline.pttl(local_key)
+        values, *pttls = pipeline.execute()
+        return [
+            (value, self._remaining_ttl(pttl))
+            for value, pttl in zip(values, pttls)
+        ]
+
+    def _maybe_flush(self):
+        """
+        Flush buffered writes if the last flush was longer ago than
+        flush_interval. Checked on reads too, so writes don't sit in the
+        buffer of a cache that is mostly read from.
+        :return:
+        """
+        if len(self.pending) > 0 and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write(self, mapping: Dict[str, str]):
+        """
+        Write already keyed pairs to layer 2, or buffer them in write-behind mode.
+        :param mapping: local key value pairs
+        :return:
+        """
+        if not self.write_behind:
+            self._write_redis(mapping)
+            return
+
+        self.pending.update(mapping)
+        if len(self.pending) >= self.write_behind:
+            self.flush()
+        else:
+            self._maybe_flush()
+
+    def _write_redis(self, mapping: Dict[str, str]):
+        """
+        Write already keyed pairs to the layer 2 redis cache.
+        If we want to have key value pairs timeout in redis, use setex.
+        :param mapping: local key value pairs
+        :return:
+        """
+        if len(mapping) == 1:
+            (local_key, value), = mapping.items()
+            if self.set_timeout:
+                self.redis.setex(local_key, self.timeout, value)
+            else:
+                self.redis.set(local_key, value)
+            return
+
+        # More than one pair, use a single round trip
+        pipeline = self.redis.pipeline(transaction=False)
+        for local_key, value in mapping.items():
+            if self.set_timeout:
+                pipeline.setex(local_key, self.timeout, value)
+            else:
+                pipeline.set(local_key, value)
+        pipeline.execute()
+
+    def flush(self):
+        """
+        Send every buffered layer 2 write in one pipeline.
+        :return:
+        """
+        if len(self.pending) > 0:
+            pending, self.pending = self.pending, dict()
+            self._write_redis(pending)
+        self.last_flush = time.monotonic()
+
     def __setitem__(self, key: str, value: str):
         """
         Store a key value pair in each cache layer.
@@ -59,17 +207,11 @@ class LayeredCache(object):
         :return:
         """
 
-        # Store in layer 1 local LRU cache
-        self.lru_local_cache[self._get_key(key)] = value
+        # Store in layer 1 local cache and the shared memory table
+        self._fill_local(self._get_key(key), value)
 
         # Store in layer 2 redis cache
-        # If we want to have key value pairs timeout in redis, use setex with 5
-        # minutes before until timeout
-        if self.set_timeout:
-            timeout = 300
-            self.redis.setex(self._get_key(key), timeout, value)
-        else:
-            self.redis.set(self._get_key(key), value)
+        self._write({self._get_key(key): value})
 
     def __contains__(self, key: str) -> bool:
         """
@@ -81,21 +223,7 @@ class LayeredCache(object):
         :param key:
         :return:
         """
-
-        # Check the layer 1 local LRU cache
-        local_result = self.lru_local_cache.get(self._get_key(key), None)
-        if local_result is not None:
-            return True
-
-        # Check the layer 2 redis cache
-        redis_result = self.redis.get(self._get_key(key))
-        if redis_result is not None:
-            # Update the each layer with the value
-            self[key] = redis_result.decode()
-            return True
-
-        # Cache miss, return False
-        return False
+        return self[key] is not None
 
     def __getitem__(self, key: str) -> Union[str, None]:
         """
@@ -106,63 +234,404 @@ class LayeredCache(object):
         :return:
         """
 
-        # Check the layer 1 local LRU cache
-        local_result = self.lru_local_cache.get(self._get_key(key), None)
-        if local_result is not None:
+        self._maybe_flush()
+
+        # Check the layer 1 local cache
+        start = time.perf_counter()
+        local_result = self.local_cache.get(self._get_key(key), None)
+        found = local_result is not None
+        self.metrics['l1'].record(int(found), int(not found), time.perf_counter() - start)
+        if found:
             return local_result
 
+        # Check the shared memory table
+        if self.shared is not None:
+            start = time.perf_counter()
+            shared_result = self.shared.get(self._get_key(key))
+            found = shared_result is not None
+            self.metrics['shared'].record(int(found), int(not found), time.perf_counter() - start)
+            if found:
+                # Update layer 1 only, the lower layers already have it
+                self.metrics['shared'].backfills += 1
+                self.local_cache[self._get_key(key)] = shared_result
+                return shared_result
+
+        # A write still waiting to be flushed to redis
+        pending_result = self.pending.get(self._get_key(key), None)
+        if pending_result is not None:
+            self._fill_local(self._get_key(key), pending_result)
+            return pending_result
+
         # Check the layer 2 redis cache
-        redis_result = self.redis.get(self._get_key(key))
-        if redis_result is not None:
-            # Update the each layer with the value
-            self[key] = redis_result.decode()
+        start = time.perf_counter()
+        (redis_result, ttl), = self._get_redis([self._get_key(key)])
+        found = redis_result is not None
+        self.metrics['redis'].record(int(found), int(not found), time.perf_counter() - start)
+        if found:
+            # Update the layers above for as long as redis keeps the value
+            self.metrics['redis'].backfills += 1
+            self._fill_local(self._get_key(key), redis_result.decode(), ttl)
             return redis_result.decode()
 
         # Cache miss, return None
         return None
 
+    def _fill_local_many(self, mapping: Dict[str, str], ttls: Dict[str, float] = None):
+        """
+        Batched version of _fill_local.
+        :param mapping: local key value pairs
+        :param ttls: seconds each value has left in redis (missing for the full timeout)
+        :return:
+        """
+        ttls = ttls or dict()
+        for local_key, value in mapping.items():
+            ttl = ttls.get(local_key, None)
+            if ttl is not None and self.set_timeout:
+                self.local_cache.set(local_key, value, ttl)
+            else:
+                self.local_cache[local_key] = value
+
+        # Store in the shared memory table, taking its lock once
+        if self.shared is not None:
+            self.shared.set_many(mapping, self.timeout, ttls)
+
+    def set_many(self, mapping: Dict[str, str]):
+        """
+        Store many key value pairs in each cache layer. All of the layer 2
+        writes are sent to redis in a single pipeline.
+        :param mapping:
+        :return:
+        """
+        if len(mapping) == 0:
+            return
+
+        local_mapping = {
+            self._get_key(key): value
+            for key, value in mapping.items()
+        }
+
+        # Store in layer 1 local cache and the shared memory table
+        self._fill_local_many(local_mapping)
+
+        # Store in layer 2 redis cache with one round trip
+        self._write(local_mapping)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Look up many keys at once. Layer 1 is checked first, and every layer 1
+        miss is then fetched from redis with a single MGET. Keys found in
+        layer 2 are written back to each layer like __getitem__ does.
+        Keys that were not found are left out of the result.
+        :param keys:
+        :return: key value pairs that were found
+        """
+        result = dict()
+        misses = []
+
+        self._maybe_flush()
+
+        # Check the layer 1 local cache
+        start = time.perf_counter()
+        for key in keys:
+            local_result = self.local_cache.get(self._get_key(key), None)
+            if local_result is not None:
+                result[key] = local_result
+            else:
+                misses.append(key)
+        self.metrics['l1'].record(len(result), len(misses), time.perf_counter() - start)
+
+        if len(misses) == 0:
+            return result
+
+        # Check the shared memory table
+        if self.shared is not None:
+            start = time.perf_counter()
+            shared_found = dict()
+            for key in misses:
+                shared_result = self.shared.get(self._get_key(key))
+                if shared_result is not None:
+                    shared_found[key] = shared_result
+            self.metrics['shared'].record(len(shared_found), len(misses) - len(shared_found),
+                                          time.perf_counter() - start)
+
+            # Update layer 1 only, the lower layers already have them
+            self.metrics['shared'].backfills += len(shared_found)
+            for key, value in shared_found.items():
+                self.local_cache[self._get_key(key)] = value
+            result.update(shared_found)
+
+            misses = [key for key in misses if key not in shared_found]
+            if len(misses) == 0:
+                return result
+
+        # Writes still waiting to be flushed to redis
+        if len(self.pending) > 0:
+            pending_found = dict()
+            for key in misses:
+                pending_result = self.pending.get(self._get_key(key), None)
+                if pending_result is not None:
+                    pending_found[key] = pending_result
+            self._fill_local_many({self._get_key(key): value for key, value in pending_found.items()})
+            result.update(pending_found)
+
+            misses = [key for key in misses if key not in pending_found]
+            if len(misses) == 0:
+                return result
+
+        # Check the layer 2 redis cache for all the misses at once
+        start = time.perf_counter()
+        redis_results = self._get_redis([self._get_key(key) for key in misses])
+        found = dict()
+        ttls = dict()
+        for key, (redis_result, ttl) in zip(misses, redis_results):
+            if redis_result is not None:
+                found[key] = redis_result.decode()
+                if ttl is not None:
+                    ttls[self._get_key(key)] = ttl
+        self.metrics['redis'].record(len(found), len(misses) - len(found), time.perf_counter() - start)
+
+        # Update the layers above for as long as redis keeps the values
+        self.metrics['redis'].backfills += len(found)
+        self._fill_local_many({self._get_key(key): value for key, value in found.items()}, ttls)
+        result.update(found)
+
+        return result
+
+    def contains_many(self, keys: Iterable[str]) -> Set[str]:
+        """
+        Check which of many keys are in a layer of the cache, with at most
+        one redis round trip.
+        :param keys:
+        :return: the keys that were found
+        """
+        return set(self.get_many(keys))
+
+    def stats(self, histograms: bool = False) -> dict:
+        """
+        Get the counters of each layer, and the occupancy of layer 1.
+        A layer's hits are the lookups it answered, and its misses are the
+        lookups passed on to the next layer. For the negative cache and the
+        bloom filter a hit means the key is known to be missing, so dgraph
+        misses are bloom filter false positives.
+        Backfills count values written back to the layers above.
+        :param histograms: include the raw latency histogram of each layer
+        :return:
+        """
+        layers = dict()
+        for layer, layer_stats in self.metrics.layers.items():
+            layers[layer] = layer_stats.to_dict()
+            if histograms:
+                layers[layer]['histogram'] = {
+                    'buckets': list(layer_stats.latency.buckets),
+                    'cumulative': layer_stats.latency.cumulative(),
+                    'sum': layer_stats.latency.sum,
+                    'count': layer_stats.latency.count,
+                }
+
+        return {
+            'cache': self.node_name,
+            'l1': {
+                'policy': self.policy,
+                'size': self.local_cache.currsize,
+                'maxsize': self.local_cache.maxsize,
+                'evictions': self.local_cache.evictions,
+            },
+            'shared': self.shared.stats() if self.shared is not None else None,
+            'pending': len(self.pending),
+            'layers': layers,
+        }
+
+    def snapshot(self, path: str) -> int:
+        """
+        Save the contents of layer 1 to a local file, so a restarted process
+        can start warm with restore. It is written to a temporary file first
+        so an interrupted snapshot can not corrupt the previous one. With a
+        timeout, the seconds each entry has left are saved with it.
+        :param path:
+        :return: number of entries saved
+        """
+        items = []
+        for local_key in list(self.local_cache):
+            value = self.local_cache.get(local_key, None)
+            if value is not None:
+                ttl = self.local_cache.remaining(local_key) if self.set_timeout else None
+                items.append((local_key, value, ttl))
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'node_name': self.node_name,
+                'created': time.time(),
+                'items': items,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        return len(items)
+
+    def restore(self, path: str) -> int:
+        """
+        Load layer 1 from a snapshot. Each restored entry only lives for
+        the time it had left when the snapshot was taken, minus the age of
+        the snapshot, so it expires when its redis copy does. Entries that
+        have expired since are dropped, and nothing is loaded if there is
+        no snapshot.
+        :param path:
+        :return: number of entries restored
+        """
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+
+        if snapshot['node_name'] != self.node_name:
+            raise ValueError(f'{path} is a snapshot of {snapshot["node_name"]}, not {self.node_name}')
+        age = time.time() - snapshot['created']
+        restored = 0
+        for local_key, value, ttl in snapshot['items']:
+            if not self.set_timeout:
+                self.local_cache[local_key] = value
+            else:
+                # Snapshots taken without a timeout don't know how long entries have left
+                ttl = (self.timeout if ttl is None else ttl) - age
+                if ttl <= 0:
+                    continue
+                self.local_cache.set(local_key, value, ttl)
+            restored += 1
+        return restored
+
     def close(self):
         """
-        Close any outstanding connections.
+        Flush buffered writes and close any outstanding connections.
         :return:
         """
+        self.flush()
         self.redis.close()
 
 
 class FullLayeredCache(LayeredCache):
     """
     Multi-Layered key value store with bloom filter and dgraph.
-    Layer 1: In Memory LRU Key Value Map
+    Layer 1: In Memory Key Value Map (LRU by default)
     Layer 2: Redis Key Value Store
     Layer 3: Bloom filter
     Layer 4: DGraph
     The primary difference between this class and the LayeredCache class is that this
     one includes the bloom filter and DGraph.
+
+    The bloom filter is used as a filter in front of dgraph. If it says a key
+    is not there, dgraph is skipped. If it says the key may be there, the uid is
+    still looked up in dgraph. Every key stored through this cache is added to
+    the bloom filter. Keys written to dgraph some other way must be added too
+    (with set_many), or they will be reported as missing.
+
+    A negative from the bloom filter is only trusted once the filter holds
+    every key already in dgraph. warm_up loads them and then sets a marker
+    next to the filter. Until the marker is set, every miss is checked in
+    dgraph. A new filter is warmed up as soon as it is created.
+
+    Keys that turn out not to exist are remembered in an in-memory negative
+    cache for negative_ttl seconds, so repeated lookups of them are cheap.
     """
 
-    def __init__(self, node_name: str, lru_size: int, p=1.0e-6, n=1000000):
+    def __init__(self, node_name: str, lru_size: int, p=1.0e-6, n=1000000,
+                 negative_size: int = 100_000, negative_ttl: float = 60,
+                 policy: str = 'lru', max_bytes: int = 0, timeout: int = 300,
+                 shared: SharedTable = None, write_behind: int = 0, flush_interval: float = 1.0):
         """
         Initialize last two layers of cache
         :param node_name:
         :param lru_size:
+        :param negative_size: max number of missing keys to remember
+        :param negative_ttl: seconds to remember a missing key for
+        :param policy: layer 1 eviction policy
+        :param max_bytes: if set, bound layer 1 by approximate bytes instead of entries
+        :param timeout: seconds before values expire from layers 1 and 2
+        :param shared: shared memory table to use between layers 1 and 2
+        :param write_behind: buffer this many layer 2 and bloom filter writes (0 to write through)
+        :param flush_interval: max seconds between flushes of buffered writes
         """
-        super(FullLayeredCache, self).__init__(node_name, lru_size)
+        super(FullLayeredCache, self).__init__(node_name, lru_size, policy, max_bytes, timeout, shared,
+                                               write_behind, flush_interval)
 
-        # Set to true so we add a timeout to layer 2 redis key value stores
-        self.set_timeout = True
+        # Keys known not to exist in any layer
+        self.negative_cache = TTLCache(maxsize=negative_size, ttl=negative_ttl)
+        self.metrics.add_layers(('negative', 'bloom', 'dgraph'))
 
-        # Create the bloom filter client object
-        self.bloom = RedisBloom(port=6378)
+        # Create the bloom filter client object, using the RedisBloom
+        # commands built into redis-py
+        self.bloom_redis = Redis(port=6378)
+        self.bloom = self.bloom_redis.bf()
 
         # Create a dgraph client, stub, and transaction
         self.dgraph, self.stub = get_client()
         self.txn = self.dgraph.txn()
 
+        # Set once warm_up has added every existing key to the bloom filter
+        self.populated_key = f"{node_name}-bloom-populated"
+        self.populated = False
+
         # Initialize the bloom filter (if it doesnt already exist)
         try:
-            self.bloom.bfInfo(node_name)
+            self.bloom.info(node_name)
         except exceptions.ResponseError:
-            self.bloom.bfCreate(node_name, p, n)
+            self.bloom.create(node_name, p, n)
+            self.warm_up()
+
+    def _bloom_populated(self) -> bool:
+        """
+        Check if the bloom filter's negatives can be trusted. The marker is
+        never unset while the filter exists, so once it has been seen it is
+        not checked again.
+        :return:
+        """
+        if not self.populated:
+            self.populated = self.bloom_redis.exists(self.populated_key) == 1
+        return self.populated
+
+    def _write_redis(self, mapping: Dict[str, str]):
+        """
+        Write pairs to layer 2, and add their keys to the layer 3 bloom
+        filter. In write-behind mode both are deferred to the next flush.
+        :param mapping: local key value pairs
+        :return:
+        """
+        super(FullLayeredCache, self)._write_redis(mapping)
+
+        if len(mapping) == 1:
+            self.bloom.add(self.node_name, *mapping)
+        else:
+            self.bloom.madd(self.node_name, *mapping)
+
+    def __setitem__(self, key: str, value: str):
+        """
+        Store a key value pair in layers 1 and 2, and add the key to the
+        bloom filter.
+        :param key:
+        :param value:
+        :return:
+        """
+        super(FullLayeredCache, self).__setitem__(key, value)
+
+        # The key exists now, forget that it was missing
+        self.negative_cache.pop(self._get_key(key), None)
+
+    def set_many(self, mapping: Dict[str, str]):
+        """
+        Store many key value pairs in layers 1 and 2, and add the keys to
+        the bloom filter with one BF.MADD.
+        :param mapping:
+        :return:
+        """
+        if len(mapping) == 0:
+            return
+
+        super(FullLayeredCache, self).set_many(mapping)
+
+        for key in mapping:
+            self.negative_cache.pop(self._get_key(key), None)
 
     def __contains__(self, key: str) -> bool:
         """
@@ -174,29 +643,7 @@ class FullLayeredCache(LayeredCache):
         :param key:
         :return:
         """
-
-        # Check layer 1 and 2
-        if super(FullLayeredCache, self).__contains__(key):
-            return True
-
-        # Check the layer 3 bloom filter
-        exists_in_bloom = self.bloom.bfExists(self.node_name, self._get_key(key))
-        if exists_in_bloom == 1:
-            # Unfortunately, we can't store the actual value in the bloom filter.
-            # For this, we can't update previous layers with the value for this key.
-            return True
-
-        # All else has failed, we must now check dgraph. This is super super slow.
-        query = """query all($a: string) { all(func: eq(%s, $a)) { uid } }""" % self.node_name
-        dgraph_result = self.txn.query(query, variables={"$a": str(key)})
-        thing = json.loads(dgraph_result.json)
-        if len(thing["all"]) > 0:
-            # Update previous layers
-            self[key] = thing["all"][0]["uid"]
-            return True
-
-        # Cache miss, return False
-        return False
+        return self[key] is not None
 
     def __getitem__(self, key: str) -> Union[str, None]:
         """
@@ -211,34 +658,162 @@ class FullLayeredCache(LayeredCache):
         if item is not None:
             return item
 
-        # Check layer 3 bloom filter
-        exists_in_bloom = self.bloom.bfExists(self.node_name, self._get_key(key))
-        if exists_in_bloom == 1:
-            return True
-
-        # All else has failed, we must now check dgraph. This is super super slow.
+        # Check if we already know the key is missing
+        start = time.perf_counter()
+        missing = self._get_key(key) in self.negative_cache
+        self.metrics['negative'].record(int(missing), int(not missing), time.perf_counter() - start)
+        if missing:
+            return None
+
+        # Check layer 3 bloom filter. If it has never seen the key, neither has dgraph.
+        start = time.perf_counter()
+        exists_in_bloom = self.bloom.exists(self.node_name, self._get_key(key))
+        missing = exists_in_bloom != 1
+        self.metrics['bloom'].record(int(missing), int(not missing), time.perf_counter() - start)
+        if missing and self._bloom_populated():
+            self.negative_cache[self._get_key(key)] = True
+            return None
+
+        # The bloom filter says maybe, we must now check dgraph. This is super super slow.
+        start = time.perf_counter()
         query = """query all($a: string) { all(func: eq(%s, $a)) { uid } }""" % self.node_name
         dgraph_result = self.txn.query(query, variables={"$a": str(key)})
         thing = json.loads(dgraph_result.json)
-        if len(thing["all"]) > 0:
+        found = len(thing["all"]) > 0
+        self.metrics['dgraph'].record(int(found), int(not found), time.perf_counter() - start)
+        if found:
             # Update previous layers
+            self.metrics['dgraph'].backfills += 1
             self[key] = thing["all"][0]["uid"]
             return thing["all"][0]["uid"]
 
-        # Cache miss, return None
+        # Cache miss (a bloom filter false positive, or an unpopulated
+        # filter), remember it and return None
+        self.negative_cache[self._get_key(key)] = True
         return None
 
+    def warm_up(self, page_size: int = 10_000) -> int:
+        """
+        Preload every value -> uid pair of this node type from dgraph, a page
+        at a time, into layers 1 and 2 and the bloom filter. Pages are read
+        with first/after on uid, all in the same read transaction. Layer 1
+        only keeps what fits in it, but redis and the bloom filter get
+        everything. Once it is done the bloom filter's negatives are trusted.
+        :param page_size: number of nodes per query
+        :return: number of pairs loaded
+        """
+        query = """{ all(func: has(%s), first: %d%s) { uid %s } }"""
+        txn = self.dgraph.txn(read_only=True)
+        after = ''
+        total = 0
+        while True:
+            dgraph_result = txn.query(query % (self.node_name, page_size, after, self.node_name))
+            nodes = json.loads(dgraph_result.json)["all"]
+
+            self.set_many({
+                value_key(self.node_name, node[self.node_name]): node["uid"]
+                for node in nodes
+                if self.node_name in node
+            })
+            total += len(nodes)
+
+            if len(nodes) < page_size:
+                break
+            after = f', after: {nodes[-1]["uid"]}'
+
+        # Buffered bloom filter writes must land before the marker is set
+        self.flush()
+        self.bloom_redis.set(self.populated_key, 1)
+        self.populated = True
+        return total
+
+    def _query_dgraph_many(self, keys: List[str]) -> Dict[str, str]:
+        """
+        Look up the uids of many keys in dgraph with a single query.
+        :param keys:
+        :return: key uid pairs for the keys that exist in dgraph
+        """
+        if len(keys) == 0:
+            return dict()
+
+        dgraph_result = self.txn.query(uids_query(self.node_name, keys))
+        return match_uids(self.node_name, keys, json.loads(dgraph_result.json)["all"])
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Batched version of __getitem__. Layers 1 and 2 are checked with at
+        most one redis round trip, the bloom filter is checked for all the
+        remaining keys with one BF.MEXISTS, and the keys it may have seen
+        are looked up in dgraph with one query. Results from dgraph are
+        written back to layers 1 and 2 in one pipeline.
+        :param keys:
+        :return: key value pairs that were found
+        """
+        keys = list(keys)
+
+        # Check layer 1 and 2
+        result = super(FullLayeredCache, self).get_many(keys)
+
+        start = time.perf_counter()
+        unresolved = [key for key in keys if key not in result]
+        misses = [
+            key for key in unresolved
+            if self._get_key(key) not in self.negative_cache
+        ]
+        if len(unresolved) > 0:
+            self.metrics['negative'].record(len(unresolved) - len(misses), len(misses), time.perf_counter() - start)
+        if len(misses) == 0:
+            return result
+
+        # Check layer 3 bloom filter. Only keys it may have seen can be in dgraph.
+        start = time.perf_counter()
+        exists_in_bloom = self.bloom.mexists(self.node_name, *[self._get_key(key) for key in misses])
+        maybe = [key for key, exists in zip(misses, exists_in_bloom) if exists == 1]
+        self.metrics['bloom'].record(len(misses) - len(maybe), len(maybe), time.perf_counter() - start)
+        if self._bloom_populated():
+            for key, exists in zip(misses, exists_in_bloom):
+                if exists != 1:
+                    self.negative_cache[self._get_key(key)] = True
+        else:
+            maybe = misses
+
+        if len(maybe) == 0:
+            return result
+
+        # Check dgraph for every key the bloom filter may have seen at once
+        start = time.perf_counter()
+        found = self._query_dgraph_many(maybe)
+        self.metrics['dgraph'].record(len(found), len(maybe) - len(found), time.perf_counter() - start)
+        for key in maybe:
+            if key not in found:
+                self.negative_cache[self._get_key(key)] = True
+
+        # Update previous layers
+        self.metrics['dgraph'].backfills += len(found)
+        self.set_many(found)
+        result.update(found)
+
+        return result
+
+    def contains_many(self, keys: Iterable[str]) -> Set[str]:
+        """
+        Batched version of __contains__.
+        :param keys:
+        :return: the keys that were found
+        """
+        return set(self.get_many(keys))
+
     def close(self):
         """
         Close all outstanding connections
         :return:
         """
 
-        # Close the layer 2 redis connection
+        # Flush buffered writes and close the layer 2 redis connection
         super(FullLayeredCache, self).close()
 
         # Close layer 3 bloom filter connection
-        self.bloom.close()
+        self.bloom_redis.close()
 
         # Close layer 4 dgraph connections
         self.stub.close()
\ No newline at end of file
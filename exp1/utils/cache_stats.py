@@ -0,0 +1,208 @@
+import json
+from bisect import bisect_left
+from typing import Dict, Iterable, List
+
+# Upper bounds (seconds) of the latency histogram buckets. They go from
+# an in-memory lookup up to a slow dgraph query.
+latency_buckets = (
+    0.000_01, 0.000_05,
+    0.000_1, 0.000_5,
+    0.001, 0.002, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5,
+)
+
+
+class LatencyHistogram(object):
+    """
+    Fixed bucket latency histogram. Observing a value is a bisect and two
+    additions, so it is cheap enough to leave on for every lookup.
+    """
+
+    def __init__(self, buckets: tuple = latency_buckets):
+        super(LatencyHistogram, self).__init__()
+
+        self.buckets = buckets
+        # One count per bucket, plus one for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        """
+        Record a single latency.
+
+        :param seconds:
+        :return:
+        """
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self) -> List[int]:
+        """
+        Get the number of observations at or below each bucket bound,
+        followed by the total count (the +Inf bucket).
+
+        :return:
+        """
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        :param q: between 0 and 1
+        :return:
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class LayerStats(object):
+    """
+    Counters for a single cache layer.
+    hits: lookups the layer answered
+    misses: lookups passed on to the next layer
+    backfills: values found in this layer and written back to the layers above it
+    """
+
+    def __init__(self):
+        super(LayerStats, self).__init__()
+
+        self.hits = 0
+        self.misses = 0
+        self.backfills = 0
+        self.latency = LatencyHistogram()
+
+    def record(self, hits: int, misses: int, elapsed: float):
+        """
+        Record one round trip to the layer, which may cover many keys.
+
+        :param hits:
+        :param misses:
+        :param elapsed: seconds the round trip took
+        :return:
+        """
+        self.hits += hits
+        self.misses += misses
+        self.latency.observe(elapsed)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'backfills': self.backfills,
+            'hit_rate': self.hit_rate(),
+            'round_trips': self.latency.count,
+            'latency_sum': self.latency.sum,
+            'latency_p50': self.latency.quantile(0.5),
+            'latency_p99': self.latency.quantile(0.99),
+        }
+
+
+class CacheStats(object):
+    """
+    Per-layer counters for one layered cache.
+    """
+
+    def __init__(self, node_name: str, layers: Iterable[str]):
+        """
+        :param node_name: name of the cache, used as a label when exporting
+        :param layers: names of the layers, in lookup order
+        """
+        super(CacheStats, self).__init__()
+
+        self.node_name = node_name
+        self.layers: Dict[str, LayerStats] = {
+            layer: LayerStats()
+            for layer in layers
+        }
+
+    def add_layers(self, layers: Iterable[str]):
+        for layer in layers:
+            self.layers.setdefault(layer, LayerStats())
+
+    def __getitem__(self, layer: str) -> LayerStats:
+        return self.layers[layer]
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def prometheus_text(stats: Iterable[dict]) -> str:
+    """
+    Render the stats() of one or more caches in the Prometheus text
+    exposition format.
+
+    :param stats: results of cache.stats()
+    :return:
+    """
+    stats = list(stats)
+    lines = []
+
+    for metric, key, kind in (
+            ('cache_hits_total', 'hits', 'counter'),
+            ('cache_misses_total', 'misses', 'counter'),
+            ('cache_backfills_total', 'backfills', 'counter'),
+    ):
+        lines.append(f'# TYPE {metric} {kind}')
+        for cache in stats:
+            for layer, layer_stats in cache['layers'].items():
+                lines.append(f'{metric}{_labels(cache=cache["cache"], layer=layer)} {layer_stats[key]}')
+
+    lines.append('# TYPE cache_latency_seconds histogram')
+    for cache in stats:
+        for layer, layer_stats in cache['layers'].items():
+            histogram = layer_stats['histogram']
+            bounds = [str(bound) for bound in histogram['buckets']] + ['+Inf']
+            for bound, total in zip(bounds, histogram['cumulative']):
+                labels = _labels(cache=cache['cache'], layer=layer, le=bound)
+                lines.append(f'cache_latency_seconds_bucket{labels} {total}')
+            labels = _labels(cache=cache['cache'], layer=layer)
+            lines.append(f'cache_latency_seconds_sum{labels} {histogram["sum"]}')
+            lines.append(f'cache_latency_seconds_count{labels} {histogram["count"]}')
+
+    for metric, key, kind in (
+            ('cache_l1_size', 'size', 'gauge'),
+            ('cache_l1_max_size', 'maxsize', 'gauge'),
+            ('cache_l1_evictions_total', 'evictions', 'counter'),
+    ):
+        lines.append(f'# TYPE {metric} {kind}')
+        for cache in stats:
+            labels = _labels(cache=cache['cache'], policy=cache['l1']['policy'])
+            lines.append(f'{metric}{labels} {cache["l1"][key]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def dump_stats(caches: Iterable, fmt: str = 'json') -> str:
+    """
+    Dump the stats of one or more caches as json or Prometheus text.
+
+    :param caches: LayeredCache objects
+    :param fmt: json or prometheus
+    :return:
+    """
+    stats = [cache.stats(histograms=True) for cache in caches]
+    if fmt == 'prometheus':
+        return prometheus_text(stats)
+    if fmt == 'json':
+        return json.dumps(stats, indent=2)
+    raise ValueError(f'unknown stats format {fmt}')
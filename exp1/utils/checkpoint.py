@@ -1,16 +1,33 @@
 import multiprocessing as mp
 import os
+import json
 import pickle
+import zlib
 import functools
 
+# Append-only log of reached checkpoints, one record per line:
+#   <crc32 of the name, 8 hex digits> <json encoded name>
+# Each record also starts with a newline, so a record appended after one
+# torn by a crash still starts on its own line.
+path = 'checkpoint.log'
+
+# Checkpoint file used before the log, imported once by init_checkpoints
+legacy_path = 'checkpoint.pickle'
+
+# Names reached so far, and how far into the log they were read from.
+# Loaded once per process, then only new records are read.
+_index = set()
+_offset = 0
+_loaded = False
+
 lock: mp.Lock = None
 
 
 def set_checkpoint_lock(l: mp.Lock):
     """
-    When we are using the checkpoint functions in the processing pools, we
-    need to have a resource lock on the checkpoint.pickle file.
-    This is called to initialize the process with the RLock
+    Checkpoint records are appended with a single O_APPEND write, so
+    processes no longer need to share a lock. This is kept so existing
+    pool initializers still work.
     :param l:
     :return:
     """
@@ -18,29 +35,86 @@ def set_checkpoint_lock(l: mp.Lock):
     lock = l
 
 
+def _record(name: str) -> bytes:
+    encoded = json.dumps(name)
+    return f'\n{zlib.crc32(encoded.encode("utf8")):08x} {encoded}\n'.encode('utf8')
+
+
+def _parse(line: bytes):
+    """
+    Parse a single log record, returning None if it is torn or corrupt.
+    """
+    try:
+        crc, encoded = line.decode('utf8').rstrip('\n').split(' ', 1)
+        if int(crc, 16) != zlib.crc32(encoded.encode('utf8')):
+            return None
+        return json.loads(encoded)
+    except ValueError:
+        return None
+
+
+def _refresh():
+    """
+    Read any records other processes appended since the last read. A
+    record cut short by a crash has no newline, and is left for later.
+    :return:
+    """
+    global _offset
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(_offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            _offset += len(line)
+            name = _parse(line)
+            if name is not None:
+                _index.add(name)
+
+
+def _append(names):
+    """
+    Append records with one write and fsync them before returning.
+    :param names:
+    :return:
+    """
+    data = b''.join(_record(name) for name in names)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def init_checkpoints():
-    if not os.path.exists('checkpoint.pickle'):
-        pickle.dump(set(), open('checkpoint.pickle', 'wb'))
+    global _loaded
+    _loaded = True
+    if not os.path.exists(path):
+        # Carry over checkpoints from the old pickle file
+        names = set()
+        if os.path.exists(legacy_path):
+            names = pickle.load(open(legacy_path, 'rb'))
+        _append(sorted(names))
+    _refresh()
 
 
 def set_checkpoint(name):
-    if lock is not None:
-        lock.acquire()
-    _checkpoint: set = pickle.load(open('checkpoint.pickle', 'rb'))
-    _checkpoint.add(name)
-    pickle.dump(_checkpoint, open('checkpoint.pickle', 'wb'))
+    _append([name])
+    _index.add(name)
     print(f'reached checkpoint {name}')
-    if lock is not None:
-        lock.release()
 
 
 def get_checkpoint(name):
-    if lock is not None:
-        lock.acquire()
-    contains = name in pickle.load(open('checkpoint.pickle', 'rb'))
-    if lock is not None:
-        lock.release()
-    return contains
+    if name in _index:
+        return True
+    if not _loaded:
+        init_checkpoints()
+    else:
+        _refresh()
+    return name in _index
 
 
 def checkpoint(checkpoint_name: str):
@@ -56,4 +130,4 @@ def checkpoint(checkpoint_name: str):
 
             return res
         return _wrapper
-    return _decorator
\ No newline at end of file
+    return _decorator
@@ -0,0 +1,87 @@
+import csv
+import os
+
+from typing import Iterator, List, Tuple
+
+
+def read_header(path: str) -> Tuple[List[str], int]:
+    """
+    Read the header line of a csv file.
+
+    :param path:
+    :return: field names, byte offset of the first data line
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        offset = f.tell()
+
+    fieldnames = next(csv.reader([header.decode('utf8')], delimiter=',', quotechar='"'))
+    return fieldnames, offset
+
+
+def byte_ranges(path: str, n: int) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """
+    Split a csv file into n byte ranges that each start and end on a line
+    boundary. Each range can then be parsed by a separate process.
+
+    This assumes records do not contain quoted newlines. A newline inside a
+    quoted field would make a range start in the middle of a record.
+
+    :param path:
+    :param n:
+    :return: field names, list of (start, end) byte offsets
+    """
+    fieldnames, data_start = read_header(path)
+    size = os.path.getsize(path)
+    step = max((size - data_start) // max(n, 1), 1)
+
+    boundaries = [data_start]
+    with open(path, 'rb') as f:
+        for index in range(1, n):
+            position = data_start + index * step
+            if position <= boundaries[-1]:
+                continue
+            if position >= size:
+                break
+
+            # Move forward to the start of the next line
+            f.seek(position - 1)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    boundaries.append(size)
+
+    return fieldnames, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _read_lines(path: str, start: int, end: int) -> Iterator[str]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf8')
+
+
+def read_range(path: str, start: int, end: int, fieldnames: List[str]) -> Iterator[dict]:
+    """
+    Iterate over the csv rows in a byte range returned by byte_ranges.
+
+    :param path:
+    :param start:
+    :param end:
+    :param fieldnames:
+    :return:
+    """
+    return csv.DictReader(
+        _read_lines(path, start, end),
+        fieldnames=fieldnames,
+        delimiter=',',
+        quotechar='"',
+    )
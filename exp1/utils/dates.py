@@ -0,0 +1,120 @@
+from collections import Counter
+from datetime import datetime
+from typing import Any, Union
+
+from cachetools import LRUCache
+from dateutil.parser import parse as _date_parse, ParserError
+
+# Marker stored in the memo cache for strings dateutil could not parse
+_FAILED = object()
+
+
+class DateParser(object):
+    """
+    Date parser with fast paths for the fixed formats that make up almost
+    all of the data, and a bounded memo cache in front of dateutil for
+    everything else.
+    Path 1: empty string
+    Path 2: YYYY-MM-DD (and other ISO 8601 strings)
+    Path 3: MM/DD/YYYY
+    Path 4: memo cache of earlier dateutil results
+    Path 5: dateutil
+    """
+
+    def __init__(self, cache_size: int = 100_000):
+        """
+        :param cache_size: maximum number of dateutil results to remember
+        """
+        super(DateParser, self).__init__()
+
+        self.cache = LRUCache(maxsize=cache_size)
+
+        # Number of times each path answered a lookup
+        self.hits = Counter()
+
+    @staticmethod
+    def _parse_slashes(date_str: str) -> Union[datetime, None]:
+        """
+        Parse a MM/DD/YYYY formatted string.
+
+        :param date_str:
+        :return:
+        """
+        if len(date_str) != 10 or date_str[2] != '/' or date_str[5] != '/':
+            return None
+        try:
+            return datetime(int(date_str[6:]), int(date_str[:2]), int(date_str[3:5]))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse_iso(date_str: str) -> Union[datetime, None]:
+        """
+        Parse an ISO 8601 formatted string like YYYY-MM-DD.
+
+        :param date_str:
+        :return:
+        """
+        if len(date_str) < 10 or date_str[4] != '-' or date_str[7] != '-':
+            return None
+        try:
+            return datetime.fromisoformat(date_str)
+        except ValueError:
+            return None
+
+    def parse(self, date_str: str, default: Any = None) -> datetime:
+        """
+        Parse a date string, returning default if it is empty or
+        can not be parsed.
+
+        :param date_str:
+        :param default:
+        :return:
+        """
+        if date_str == '' or date_str is None:
+            self.hits['empty'] += 1
+            return default
+
+        result = self._parse_iso(date_str)
+        if result is not None:
+            self.hits['iso'] += 1
+            return result
+
+        result = self._parse_slashes(date_str)
+        if result is not None:
+            self.hits['slashes'] += 1
+            return result
+
+        result = self.cache.get(date_str, None)
+        if result is not None:
+            self.hits['memo'] += 1
+            return default if result is _FAILED else result
+
+        self.hits['dateutil'] += 1
+        try:
+            result = _date_parse(date_str)
+        except (ParserError, OverflowError):
+            result = _FAILED
+        self.cache[date_str] = result
+
+        return default if result is _FAILED else result
+
+    def stats(self) -> dict:
+        """
+        Get the number of times each path answered a lookup.
+
+        :return:
+        """
+        return dict(self.hits)
+
+    def report(self) -> str:
+        """
+        Format the path hit counts as a single line.
+
+        :return:
+        """
+        total = sum(self.hits.values()) or 1
+        return ', '.join(
+            f'{path}: {count} ({100 * count / total:.1f}%)'
+            for path, count in self.hits.most_common()
+        )
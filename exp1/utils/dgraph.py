@@ -1,10 +1,15 @@
-import random
+import itertools
+import os
+import threading
+import time
 
+import grpc
 import pydgraph
 from utils.checkpoint import checkpoint
+from utils.rdf import escape_literal
 
 schema = """
-naid: int .
+naid: int @index(int) @upsert .
 name: string @index(term) .
 alias: string .
 
@@ -30,37 +35,37 @@ type Person {
     s
 }
 
-age: int @index(int)  .
+age: int @index(int) @upsert .
 type Age {
     age
 }
 
-age_of_entry: int @index(int) .
+age_of_entry: int @index(int) @upsert .
 type AgeOfEntry {
     age_of_entry
 }
 
-age_of_naturalization: int @index(int) .
+age_of_naturalization: int @index(int) @upsert .
 type AgeOfNaturalization {
     age_of_naturalization
 }
 
-port_of_entry: string @index(exact, term) .
+port_of_entry: string @index(exact, term) @upsert .
 type PortOfEntry {
     port_of_entry
 }
 
-country: string @index(exact, term) .
+country: string @index(exact, term) @upsert .
 type Country {
     country
 }
 
-sex: string @index(exact) .
+sex: string @index(exact) @upsert .
 type Sex {
     sex
 }
 
-year_of_entry: dateTime @index(year) .
+year_of_entry: dateTime @index(year) @upsert .
 type YearOfEntry {
     year_of_entry
 }
@@ -81,51 +86,356 @@ type Root {
 """
 
 
-class StubWrapper:
+def _year(value) -> str:
+    # dateTime values come back in full, e.g. 2001-01-01T00:00:00Z
+    return str(int(str(value).split('-')[0]))
+
+
+# Predicates whose values dgraph returns in a different form than the
+# keys they were written from
+_key_formats = {
+    'year_of_entry': _year,
+}
+
+
+def value_key(predicate: str, value) -> str:
     """
-    Very simple class for initializing and tracking DGraph connection stubs
+    Convert a value of a predicate returned by dgraph back to the key it
+    was written from, e.g. the year_of_entry 2001-01-01T00:00:00Z to 2001.
+    Ages come back as ints, and are turned back into strings.
+
+    :param predicate:
+    :param value:
+    :return:
+    """
+    return _key_formats.get(predicate, str)(value)
+
+
+def uids_query(predicate: str, keys: list) -> str:
     """
+    Build a query for the uids of the nodes with any of the given values.
 
-    def __init__(self, n: int):
+    :param predicate:
+    :param keys:
+    :return:
+    """
+    values = ', '.join(f'"{escape_literal(str(key))}"' for key in keys)
+    return """{ all(func: eq(%s, [%s])) { uid %s } }""" % (predicate, values, predicate)
+
+
+def match_uids(predicate: str, keys: list, nodes: list) -> dict:
+    """
+    Match the nodes returned by a uids_query up with the keys asked for.
+    Values come back typed (ints for ages, full dates for years), so they
+    are converted back to keys with value_key first.
+
+    :param predicate:
+    :param keys:
+    :param nodes:
+    :return: key uid pairs for the keys that exist
+    """
+    by_value = {str(key): key for key in keys}
+    found = dict()
+    for node in nodes:
+        if predicate not in node:
+            continue
+        key = by_value.get(value_key(predicate, node[predicate]), None)
+        if key is not None and key not in found:
+            found[key] = node["uid"]
+    return found
+
+
+# Addresses of the dgraph alpha nodes clients are balanced across. This matches
+# the six alphas in exp1/docker-compose.yml, and can be overridden with a comma
+# separated DGRAPH_ALPHAS environment variable or with configure().
+alphas = os.environ.get(
+    'DGRAPH_ALPHAS',
+    ','.join(f'localhost:{9080 + i}' for i in range(6)),
+).split(',')
+
+# Either 'least-outstanding' or 'round-robin'
+routing = 'least-outstanding'
+
+# Status codes that mean an alpha is unhealthy, as opposed to a request
+# that failed on its own merits (like an aborted transaction).
+_unhealthy_codes = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+}
+
+
+class AlphaStub(pydgraph.DgraphClientStub):
+    """
+    Dgraph client stub that tracks the health of the alpha it is connected to.
+    It keeps count of outstanding requests, a moving average of request
+    latency, and consecutive connection failures.
+    """
+
+    def __init__(self, addr: str):
+        """
+        :param addr: host:port of the alpha
         """
-        Initialize random stubs to ensure relatively balanced load on dgraph
-        alpha nodes.
+        super(AlphaStub, self).__init__(addr)
+
+        self.addr = addr
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.requests = 0
+        self.latency = 0.0
+        self.failures = 0
 
-        :param n:
+        # Time until which this alpha should not be picked
+        self.evicted_until = 0.0
+
+    def _track(self, func, *args, **kwargs):
+        """
+        Call a stub method while recording outstanding requests, latency
+        and failures.
+
+        :param func:
+        :return:
         """
+        with self.lock:
+            self.outstanding += 1
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except grpc.RpcError as e:
+            if e.code() in _unhealthy_codes:
+                with self.lock:
+                    self.failures += 1
+            raise
+        else:
+            with self.lock:
+                self.failures = 0
+            return result
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                self.outstanding -= 1
+                self.requests += 1
+
+                # Exponentially weighted moving average of request latency
+                if self.requests == 1:
+                    self.latency = elapsed
+                else:
+                    self.latency = 0.9 * self.latency + 0.1 * elapsed
+
+    def alter(self, *args, **kwargs):
+        return self._track(super(AlphaStub, self).alter, *args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._track(super(AlphaStub, self).query, *args, **kwargs)
+
+    def commit_or_abort(self, *args, **kwargs):
+        return self._track(super(AlphaStub, self).commit_or_abort, *args, **kwargs)
+
+    def check_version(self, *args, **kwargs):
+        return self._track(super(AlphaStub, self).check_version, *args, **kwargs)
+
+
+class ClientPool:
+    """
+    Process wide pool of long lived connections to every dgraph alpha.
+    Requests are routed to the alpha with the fewest outstanding requests
+    (or round robin), skipping alphas that have been evicted for being
+    unavailable or much slower than the rest.
+    """
 
-        i = random.randint(0, n)
+    def __init__(self, addrs: list, routing: str = 'least-outstanding',
+                 max_failures: int = 3, slow_factor: float = 5.0,
+                 min_requests: int = 20, cooldown: float = 30.0):
+        """
+        Open a connection to each alpha.
+
+        :param addrs: host:port of each alpha
+        :param routing: 'least-outstanding' or 'round-robin'
+        :param max_failures: consecutive failures before an alpha is evicted
+        :param slow_factor: evict alphas slower than this many times the median latency
+        :param min_requests: requests an alpha must have served before it can be called slow
+        :param cooldown: seconds an evicted alpha is left alone
+        """
+        if routing not in ('least-outstanding', 'round-robin'):
+            raise ValueError(f'unknown routing {routing}')
+
+        self.stubs = [AlphaStub(addr) for addr in addrs]
+        self.routing = routing
+        self.max_failures = max_failures
+        self.slow_factor = slow_factor
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.next_index = itertools.count()
+
+    def _evict_unhealthy(self, now: float):
+        """
+        Evict alphas that keep failing or are much slower than the median.
 
-        # Pick 2 random stubs from those available
-        self.stubs = [
-            pydgraph.DgraphClientStub(f"localhost:{9080 + (i % n)}"),
-            pydgraph.DgraphClientStub(f"localhost:{9080 + ((i + 1) % n)}"),
-            pydgraph.DgraphClientStub(f"localhost:{9080 + ((i + 2) % n)}"),
-        ]
+        :param now:
+        :return:
+        """
+        latencies = sorted(
+            stub.latency for stub in self.stubs
+            if stub.requests >= self.min_requests
+        )
+        median = latencies[len(latencies) // 2] if latencies else 0.0
 
-    def close(self):
+        for stub in self.stubs:
+            if stub.evicted_until > now:
+                continue
+
+            failing = stub.failures >= self.max_failures
+            slow = (
+                len(latencies) > 1
+                and stub.requests >= self.min_requests
+                and stub.latency > self.slow_factor * median
+            )
+            if failing or slow:
+                print(f'Evicting dgraph alpha {stub.addr} for {self.cooldown}s '
+                      f'(failures: {stub.failures}, latency: {stub.latency:.3f}s)')
+                stub.evicted_until = now + self.cooldown
+
+                # Give the alpha a fresh start when it comes back
+                stub.failures = 0
+                stub.requests = 0
+
+    def healthy(self) -> list:
+        """
+        Get the alphas that are not currently evicted. If every alpha has
+        been evicted they are all returned, since something has to be used.
+
+        :return:
+        """
+        now = time.time()
+        self._evict_unhealthy(now)
+
+        stubs = [stub for stub in self.stubs if stub.evicted_until <= now]
+        return stubs or self.stubs
+
+    def pick(self) -> AlphaStub:
         """
-        Close each stub connection.
+        Pick the alpha the next request should go to.
 
         :return:
         """
+        stubs = self.healthy()
+        if self.routing == 'round-robin':
+            return stubs[next(self.next_index) % len(stubs)]
+
+        # Break ties round robin so idle alphas share the load
+        offset = next(self.next_index)
+        return min(
+            (stubs[(offset + i) % len(stubs)] for i in range(len(stubs))),
+            key=lambda stub: stub.outstanding,
+        )
+
+    def close(self):
+        """
+        Close each alpha connection.
 
+        :return:
+        """
         for stub in self.stubs:
             stub.close()
 
 
+class PooledDgraphClient(pydgraph.DgraphClient):
+    """
+    DgraphClient that routes each transaction and alter through a ClientPool
+    instead of picking a random stub.
+    """
+
+    def __init__(self, pool: ClientPool):
+        super(PooledDgraphClient, self).__init__(*pool.stubs)
+        self.pool = pool
+
+    def any_client(self):
+        return self.pool.pick()
+
+
+class StubWrapper:
+    """
+    Handle on the shared client pool returned by get_client. The pooled
+    connections are long lived, so closing the handle leaves them open.
+    Use close_pool to actually close them.
+    """
+
+    def __init__(self, pool: ClientPool):
+        self.stubs = pool.stubs
+
+    def close(self):
+        """
+        Release the handle. The pooled connections stay open.
+
+        :return:
+        """
+        pass
+
+
+_pool: ClientPool = None
+_pool_pid: int = None
+
+
+def configure(addrs: list = None, routing_mode: str = None):
+    """
+    Change the alphas and routing used by the client pool. This closes the
+    current pool, the next get_client call opens a new one.
+
+    :param addrs: host:port of each alpha
+    :param routing_mode: 'least-outstanding' or 'round-robin'
+    :return:
+    """
+    global alphas, routing
+
+    if addrs is not None:
+        alphas = list(addrs)
+    if routing_mode is not None:
+        routing = routing_mode
+
+    close_pool()
+
+
+def get_pool() -> ClientPool:
+    """
+    Get the client pool for this process. gRPC channels can not be shared
+    across a fork, so a forked worker process opens its own pool.
+
+    :return:
+    """
+    global _pool, _pool_pid
+
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ClientPool(alphas, routing)
+        _pool_pid = os.getpid()
+
+    return _pool
+
+
+def close_pool():
+    """
+    Close the connections of this process's client pool.
+
+    :return:
+    """
+    global _pool, _pool_pid
+
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    _pool = None
+    _pool_pid = None
+
+
 def get_client():
     """
-    Get a new dgraph client and stub wrapper
+    Get a dgraph client backed by the process wide client pool and a
+    stub wrapper handle
 
     :return: client, stubs
     """
 
-    # Initialize stub wrapper
-    client_stub = StubWrapper(6)
+    pool = get_pool()
 
     # Pass back client and stubs
-    return pydgraph.DgraphClient(*client_stub.stubs), client_stub
+    return PooledDgraphClient(pool), StubWrapper(pool)
 
 
 def drop_all(client):
@@ -154,12 +464,21 @@ def set_schema(client):
     return client.alter(pydgraph.Operation(schema=schema))
 
 
-def initialize_dgraph():
+def initialize_dgraph(drop: bool = True):
+    """
+    Prepare DGraph for an ingest.
+
+    :param drop: drop all existing data first. Incremental ingests pass
+                 False and only (re)apply the schema.
+    :return:
+    """
+
     # Get DGraph client and stub
     client, stub = get_client()
 
     # Drop any and all data and schema
-    drop_all(client)
+    if drop:
+        drop_all(client)
 
     # Setup schema in DGraph
     set_schema(client)
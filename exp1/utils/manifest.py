@@ -0,0 +1,81 @@
+import hashlib
+import os
+import pickle
+
+
+def row_hash(row: dict) -> str:
+    """
+    Get a content hash of a raw csv row. The hash is taken over the raw
+    values, not the parsed person, since ages depend on the current date.
+
+    :param row:
+    :return:
+    """
+    content = '\x1f'.join(f'{key}={row[key]}' for key in sorted(row, key=str))
+    return hashlib.sha1(content.encode('utf8')).hexdigest()
+
+
+def reset_manifest(path: str = 'manifest.pickle'):
+    """
+    Forget every row hash, for when the graph the rows were written to is
+    dropped or replaced. Otherwise the next incremental ingest would skip
+    rows that are no longer in the graph.
+
+    :param path:
+    :return:
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class Manifest(object):
+    """
+    Tracks the content hash of every row written by an incremental ingest,
+    so that a later run can skip the rows that have not changed.
+    """
+
+    def __init__(self, path: str = 'manifest.pickle'):
+        """
+        Load the manifest from path if it exists.
+
+        :param path:
+        """
+        super(Manifest, self).__init__()
+
+        self.path = path
+        self.hashes = dict()
+        if os.path.exists(path):
+            self.hashes = pickle.load(open(path, 'rb'))
+
+    def unchanged(self, naid: str, content_hash: str) -> bool:
+        """
+        Check if a row was already written with the same content.
+
+        :param naid:
+        :param content_hash:
+        :return:
+        """
+        return self.hashes.get(naid, None) == content_hash
+
+    def update(self, hashes: dict):
+        """
+        Record the hashes of rows that were successfully written.
+
+        :param hashes: naid -> content hash
+        :return:
+        """
+        self.hashes.update(hashes)
+
+    def save(self):
+        """
+        Write the manifest out. It is written to a temporary file first so
+        an interrupted save can not corrupt the previous manifest.
+
+        :return:
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.hashes, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,121 @@
+import collections
+import multiprocessing as mp
+import queue
+import time
+
+from typing import Callable, Iterable, Iterator
+
+
+def windowed_imap(pool: mp.Pool, func: Callable, iterable: Iterable, window: int) -> Iterator:
+    """
+    Like pool.imap, but with at most window tasks submitted and not yet
+    consumed at any time. Pool.imap hands every task to the workers straight
+    away and buffers all of the results, so a slow consumer would let the
+    results pile up in memory. Here a new task is only submitted when a
+    result has been taken.
+
+    :param pool:
+    :param func:
+    :param iterable:
+    :param window:
+    :return:
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+class UploadWorkers(object):
+    """
+    A group of worker processes fed through one bounded queue. Putting an
+    item blocks while the queue is full, which pushes back on whatever is
+    producing the items and keeps memory flat.
+    """
+
+    def __init__(self, target: Callable, n: int, queue_size: int, args: tuple = (),
+                 poll_interval: float = 1.0):
+        """
+        Start n worker processes. Each one is called as target(queue, *args)
+        and should read items from the queue until it gets None.
+
+        :param target:
+        :param n:
+        :param queue_size: maximum number of items waiting in the queue
+        :param args:
+        :param poll_interval: seconds between checks that the workers are alive
+                              while waiting for room in the queue
+        """
+        super(UploadWorkers, self).__init__()
+
+        self.poll_interval = poll_interval
+        self.queue = mp.Queue(maxsize=queue_size)
+        self.processes = [
+            mp.Process(target=target, args=(self.queue, *args), daemon=True)
+            for _ in range(n)
+        ]
+        for process in self.processes:
+            process.start()
+
+        # Time spent blocked on a full queue
+        self.blocked_time = 0.0
+
+    def check(self):
+        """
+        Raise if a worker has exited. Workers only exit after close, so
+        any exit before that means a worker died, and nothing would ever
+        drain its share of the queue.
+
+        :return:
+        """
+        dead = [process.pid for process in self.processes if process.exitcode is not None]
+        if dead:
+            raise RuntimeError(f'upload workers {dead} exited early')
+
+    def put(self, item):
+        """
+        Add an item to the queue, waiting for room if it is full. While
+        waiting the workers are checked every poll_interval seconds, so a
+        dead worker raises instead of blocking forever.
+
+        :param item:
+        :return:
+        """
+        start = time.time()
+        while True:
+            self.check()
+            try:
+                self.queue.put(item, timeout=self.poll_interval)
+                break
+            except queue.Full:
+                pass
+        self.blocked_time += time.time() - start
+
+    def close(self):
+        """
+        Tell every worker to stop once the queue is drained, and wait
+        for them to finish.
+
+        :return:
+        """
+        # Workers that already got their None exit normally, so only stop
+        # waiting for room if none of them are left to drain the queue
+        for _ in self.processes:
+            while True:
+                try:
+                    self.queue.put(None, timeout=self.poll_interval)
+                    break
+                except queue.Full:
+                    if all(process.exitcode is not None for process in self.processes):
+                        break
+
+        for process in self.processes:
+            process.join()
+
+        failed = [process.pid for process in self.processes if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f'upload workers {failed} exited with an error')
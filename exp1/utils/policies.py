@@ -0,0 +1,426 @@
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from cachetools import LFUCache, LRUCache, TTLCache
+
+# Eviction policies that can be used for the layer 1 cache
+policies = ('lru', 'lfu', 'ttl', 'tinylfu')
+
+
+def entry_size(key, value) -> int:
+    """
+    Approximate number of bytes a cached key value pair keeps alive.
+
+    :param key:
+    :param value:
+    :return:
+    """
+    # Unwrap values stored by ExpiringCache
+    value = getattr(value, 'value', value)
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class _Counting(object):
+    """
+    Mixin for cachetools caches. It counts evictions, and can bound the
+    cache by entry_size instead of by number of entries.
+    """
+    evictions = 0
+    _sized = False
+    _setting = None
+
+    def __setitem__(self, key, value):
+        # cachetools only passes the value to getsizeof
+        self._setting = key
+        super(_Counting, self).__setitem__(key, value)
+
+    def getsizeof(self, value):
+        if self._sized:
+            return entry_size(self._setting, value)
+        return 1
+
+    def popitem(self):
+        # cachetools only calls popitem to make room for a new item
+        item = super(_Counting, self).popitem()
+        self.evictions += 1
+        return item
+
+
+class CountingLRUCache(_Counting, LRUCache):
+    def __init__(self, maxsize, sized: bool = False):
+        LRUCache.__init__(self, maxsize)
+        self._sized = sized
+
+
+class CountingLFUCache(_Counting, LFUCache):
+    def __init__(self, maxsize, sized: bool = False):
+        LFUCache.__init__(self, maxsize)
+        self._sized = sized
+
+
+class CountingTTLCache(_Counting, TTLCache):
+    def __init__(self, maxsize, ttl, sized: bool = False):
+        TTLCache.__init__(self, maxsize, ttl)
+        self._sized = sized
+
+
+# Odd 64 bit multipliers, one per sketch row
+_sketch_seeds = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+)
+_mask64 = 0xFFFFFFFFFFFFFFFF
+# Maps each counter to half of its value, to age all counters with bytearray.translate
+_halve = bytes(i >> 1 for i in range(256))
+
+
+class FrequencySketch(object):
+    """
+    Count-min sketch of how often keys were accessed recently, with
+    counters capped at 15. Every counter is halved once the sketch has seen
+    10 increments per counter, so old popularity fades away.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: expected number of entries in the cache
+        """
+        super(FrequencySketch, self).__init__()
+
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self.shift = 64 - (width.bit_length() - 1)
+        self.rows = [bytearray(width) for _ in _sketch_seeds]
+        self.sample_size = 10 * width
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = hash(key) & _mask64
+        return [((h * seed) & _mask64) >> self.shift for seed in _sketch_seeds]
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for row in self.rows:
+                row[:] = row.translate(_halve)
+            self.additions //= 2
+
+    def frequency(self, key) -> int:
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class WTinyLFUCache(MutableMapping):
+    """
+    Scan resistant cache using the W-TinyLFU policy.
+
+    New keys go into a small LRU window. When a key leaves the window it is
+    only admitted to the main space if the frequency sketch says it is
+    accessed more often than the entry it would evict. The main space is a
+    segmented LRU: keys hit a second time move from probation to protected.
+    A few hot keys (large countries and ports) stay cached, while a long
+    scan of unique names only churns the window.
+    """
+
+    def __init__(self, maxsize: int, sized: bool = False, window: float = 0.01, protected: float = 0.8):
+        """
+        :param maxsize: max entries, or max bytes if sized
+        :param sized: bound the cache by entry_size instead of number of entries
+        :param window: fraction of maxsize used for the admission window
+        :param protected: fraction of the main space used for protected entries
+        """
+        super(WTinyLFUCache, self).__init__()
+
+        self.maxsize = maxsize
+        self.sized = sized
+        self.window_max = max(1, int(maxsize * window))
+        self.main_max = maxsize - self.window_max
+        self.protected_max = int(self.main_max * protected)
+        self.evictions = 0
+
+        # Assume about 64 bytes per entry when sizing the sketch by bytes
+        self.sketch = FrequencySketch(maxsize // 64 if sized else maxsize)
+
+        self._data = dict()
+        self._weights = dict()
+        self._window = OrderedDict()
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._window_weight = 0
+        self._probation_weight = 0
+        self._protected_weight = 0
+
+    @property
+    def currsize(self) -> int:
+        return self._window_weight + self._probation_weight + self._protected_weight
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __getitem__(self, key):
+        self.sketch.increment(key)
+        value = self._data[key]
+        self._touch(key)
+        return value
+
+    def get(self, key, default=None):
+        self.sketch.increment(key)
+        if key not in self._data:
+            return default
+        self._touch(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        weight = entry_size(key, value) if self.sized else 1
+        if weight > self.maxsize:
+            raise ValueError('value too large')
+
+        self.sketch.increment(key)
+        if key in self._data:
+            self._data[key] = value
+            self._reweight(key, weight)
+            self._touch(key)
+        else:
+            self._data[key] = value
+            self._weights[key] = weight
+            self._window[key] = None
+            self._window_weight += weight
+
+        # Move keys out of the window into the main space
+        while self._window_weight > self.window_max:
+            candidate, _ = self._window.popitem(last=False)
+            self._window_weight -= self._weights[candidate]
+            self._admit(candidate)
+
+    def __delitem__(self, key):
+        weight = self._weights.pop(key)
+        del self._data[key]
+        if key in self._window:
+            del self._window[key]
+            self._window_weight -= weight
+        elif key in self._probation:
+            del self._probation[key]
+            self._probation_weight -= weight
+        else:
+            del self._protected[key]
+            self._protected_weight -= weight
+
+    def clear(self):
+        self._data.clear()
+        self._weights.clear()
+        self._window.clear()
+        self._probation.clear()
+        self._protected.clear()
+        self._window_weight = 0
+        self._probation_weight = 0
+        self._protected_weight = 0
+
+    def _reweight(self, key, weight):
+        diff = weight - self._weights[key]
+        self._weights[key] = weight
+        if key in self._window:
+            self._window_weight += diff
+        elif key in self._probation:
+            self._probation_weight += diff
+        else:
+            self._protected_weight += diff
+
+    def _touch(self, key):
+        if key in self._window:
+            self._window.move_to_end(key)
+        elif key in self._protected:
+            self._protected.move_to_end(key)
+        else:
+            # Second hit in probation, promote it
+            weight = self._weights[key]
+            del self._probation[key]
+            self._probation_weight -= weight
+            self._protected[key] = None
+            self._protected_weight += weight
+
+            # Demote the least recently used protected keys back to probation
+            while self._protected_weight > self.protected_max and len(self._protected) > 1:
+                demoted, _ = self._protected.popitem(last=False)
+                self._protected_weight -= self._weights[demoted]
+                self._probation[demoted] = None
+                self._probation_weight += self._weights[demoted]
+
+    def _victim(self):
+        if len(self._probation) > 0:
+            return next(iter(self._probation))
+        if len(self._protected) > 0:
+            return next(iter(self._protected))
+        return None
+
+    def _evict(self, key):
+        self.evictions += 1
+        del self[key]
+
+    def _admit(self, candidate):
+        """
+        Admit a key that left the window into probation, evicting main space
+        entries to make room. If the candidate is accessed less often than
+        the entry it would replace, the candidate is evicted instead.
+
+        :param candidate:
+        :return:
+        """
+        weight = self._weights[candidate]
+        self._probation[candidate] = None
+        self._probation_weight += weight
+
+        while self._probation_weight + self._protected_weight > self.main_max:
+            victim = self._victim()
+            if victim == candidate or \
+                    self.sketch.frequency(candidate) <= self.sketch.frequency(victim):
+                self._evict(candidate)
+                return
+            self._evict(victim)
+
+
+class _Expiring(object):
+    __slots__ = ('value', 'expires')
+
+    def __init__(self, value, expires: float):
+        self.value = value
+        self.expires = expires
+
+
+class ExpiringCache(MutableMapping):
+    """
+    Adds a per-entry time to live to any cache. Expired entries are
+    dropped lazily when they are looked up, and otherwise age out through
+    the wrapped cache's own policy.
+    """
+
+    def __init__(self, cache, ttl: float, timer=time.monotonic):
+        """
+        :param cache: cache to store entries in
+        :param ttl: seconds an entry lives for
+        :param timer:
+        """
+        super(ExpiringCache, self).__init__()
+
+        self.cache = cache
+        self.ttl = ttl
+        self.timer = timer
+
+    @property
+    def maxsize(self):
+        return self.cache.maxsize
+
+    @property
+    def currsize(self):
+        return self.cache.currsize
+
+    @property
+    def evictions(self):
+        return self.cache.evictions
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def __iter__(self):
+        return iter(self.cache)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, None) is not None
+
+    def __getitem__(self, key):
+        entry = self.cache[key]
+        if entry.expires < self.timer():
+            del self.cache[key]
+            raise KeyError(key)
+        return entry.value
+
+    def get(self, key, default=None):
+        entry = self.cache.get(key, None)
+        if entry is None:
+            return default
+        if entry.expires < self.timer():
+            del self.cache[key]
+            return default
+        return entry.value
+
+    def __setitem__(self, key, value):
+        self.cache[key] = _Expiring(value, self.timer() + self.ttl)
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Store an entry that expires sooner than the cache's ttl, e.g. a
+        value read back from redis with only part of its lifetime left.
+
+        :param key:
+        :param value:
+        :param ttl: seconds the entry lives for (at most the cache's ttl)
+        :return:
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.cache[key] = _Expiring(value, self.timer() + ttl)
+
+    def remaining(self, key):
+        """
+        Get the seconds an entry has left to live.
+
+        :param key:
+        :return: seconds left, None if the entry is missing or expired
+        """
+        entry = self.cache.get(key, None)
+        if entry is None:
+            return None
+        left = entry.expires - self.timer()
+        return left if left >= 0 else None
+
+    def __delitem__(self, key):
+        del self.cache[key]
+
+    def clear(self):
+        self.cache.clear()
+
+
+def make_l1(policy: str = 'lru', maxsize: int = 1000, max_bytes: int = 0, ttl: float = None):
+    """
+    Create a layer 1 cache.
+
+    :param policy: one of lru, lfu, ttl or tinylfu (W-TinyLFU)
+    :param maxsize: max number of entries
+    :param max_bytes: if set, bound the cache by approximate bytes instead of entries
+    :param ttl: seconds an entry lives for (None for no expiry)
+    :return:
+    """
+    sized = max_bytes > 0
+    size = max_bytes if sized else maxsize
+
+    # TTLCache is already an LRU cache with expiry, that also purges
+    # expired entries eagerly
+    if policy == 'ttl' or (policy == 'lru' and ttl is not None):
+        if ttl is None:
+            raise ValueError('the ttl policy needs a ttl')
+        cache = CountingTTLCache(size, ttl, sized)
+    elif policy == 'lru':
+        cache = CountingLRUCache(size, sized)
+    elif policy == 'lfu':
+        cache = CountingLFUCache(size, sized)
+    elif policy == 'tinylfu':
+        cache = WTinyLFUCache(size, sized)
+    else:
+        raise ValueError(f'unknown l1 policy {policy}')
+
+    # Entries can also expire before the ttl, with ExpiringCache.set
+    if ttl is not None:
+        cache = ExpiringCache(cache, ttl)
+    return cache
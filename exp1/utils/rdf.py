@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import os
+
+from typing import Any
+
+
+def escape_literal(value: Any) -> str:
+    """
+    Escape a value so that it can be used as an RDF string literal.
+
+    :param value:
+    :return:
+    """
+    value = str(value)
+    return (
+        value
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+        .replace('\t', '\\t')
+    )
+
+
+def blank_node(kind: str, key: Any) -> str:
+    """
+    Get a deterministic blank node name for a node. The same kind and key
+    will always produce the same name, across runs and across processes,
+    so separately written shards can reference each others nodes.
+
+    :param kind:
+    :param key:
+    :return:
+    """
+    digest = hashlib.sha1(str(key).encode('utf8')).hexdigest()[:16]
+    return f'_:{kind}.{digest}'
+
+
+def nquad(subject: str, predicate: str, obj: str) -> str:
+    """
+    Format a single N-Quad line where the object is another node.
+
+    :param subject:
+    :param predicate:
+    :param obj:
+    :return:
+    """
+    return f'{subject} <{predicate}> {obj} .\n'
+
+
+def nquad_literal(subject: str, predicate: str, value: Any) -> str:
+    """
+    Format a single N-Quad line where the object is a literal value.
+
+    :param subject:
+    :param predicate:
+    :param value:
+    :return:
+    """
+    return f'{subject} <{predicate}> "{escape_literal(value)}" .\n'
+
+
+class RDFShardWriter(object):
+    """
+    Writes N-Quads into a sequence of gzipped shard files. A new shard is
+    started every time the current one has received shard_records records.
+    """
+
+    def __init__(self, directory: str, prefix: str, shard_records: int = 100_000):
+        """
+        :param directory: output directory for the shards
+        :param prefix: file name prefix for each shard
+        :param shard_records: records per shard (0 for a single shard)
+        """
+        super(RDFShardWriter, self).__init__()
+
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_records = shard_records
+
+        self.shard_index = 0
+        self.shard_size = 0
+        self.paths = []
+        self.file = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        path = os.path.join(self.directory, f'{self.prefix}-{self.shard_index:05d}.rdf.gz')
+        self.paths.append(path)
+        self.file = gzip.open(path, 'wt', encoding='utf8')
+
+    def write(self, lines: str):
+        """
+        Write all the N-Quads for a single record.
+
+        :param lines:
+        :return:
+        """
+        if self.file is None:
+            self._open()
+
+        self.file.write(lines)
+        self.shard_size += 1
+
+        if self.shard_records and self.shard_size >= self.shard_records:
+            self.file.close()
+            self.file = None
+            self.shard_size = 0
+            self.shard_index += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,112 @@
+import random
+
+import grpc
+import pydgraph
+
+# gRPC status codes of commits that may or may not have been applied
+_unknown_outcome_codes = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+}
+
+def is_aborted(error: Exception) -> bool:
+    """
+    Check if a dgraph request failed because its transaction was aborted
+    (usually a conflict with another worker). An aborted transaction wrote
+    nothing, so it is always safe to retry. A commit that timed out or hit
+    an unavailable alpha may still have been applied, and retrying a
+    mutation of blank nodes would then create every node twice. Those are
+    only safe to retry for idempotent writes, see is_retriable.
+
+    :param error:
+    :return:
+    """
+    if isinstance(error, pydgraph.AbortedError):
+        return True
+    return isinstance(error, grpc.RpcError) and error.code() == grpc.StatusCode.ABORTED
+
+
+def is_retriable(error: Exception) -> bool:
+    """
+    Check if a failed idempotent write (an upsert) can be retried. Besides
+    aborts, this includes the commits with an unknown outcome described in
+    is_aborted.
+
+    :param error:
+    :return:
+    """
+    if is_aborted(error) or isinstance(error, pydgraph.RetriableError):
+        return True
+    return isinstance(error, grpc.RpcError) and error.code() in _unknown_outcome_codes
+
+
+def backoff(attempt: int, base: float = 0.1, cap: float = 10.0) -> float:
+    """
+    Get a jittered exponential backoff delay for a retry attempt. The delay
+    is drawn uniformly up to base * 2^attempt (capped), so workers that
+    conflicted with each other do not all retry at the same moment.
+
+    :param attempt: number of the retry, starting at 1
+    :param base:
+    :param cap:
+    :return:
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveBatchSize(object):
+    """
+    Batch size that adapts to how the cluster is coping. The size is
+    halved on a failed commit, grows a little after each commit that
+    finishes faster than the target latency, and shrinks in proportion
+    to how much slower than the target a commit was. Over time it settles
+    around the largest batch the cluster can commit within the target.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 10_000,
+                 target_latency: float = 2.0, grow: float = 1.25, shrink: float = 0.5):
+        """
+        :param initial: starting batch size
+        :param minimum: smallest batch size
+        :param maximum: largest batch size
+        :param target_latency: commits faster than this many seconds grow the
+                               size, and slower ones shrink it
+        :param grow: factor the size grows by after a fast commit
+        :param shrink: factor the size shrinks by after a failed commit, and
+                       the most it shrinks by after a slow one
+        """
+        super(AdaptiveBatchSize, self).__init__()
+
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.target_latency = target_latency
+        self.grow = grow
+        self.shrink = shrink
+        self._size = float(min(max(initial, minimum), self.maximum))
+
+    @property
+    def size(self) -> int:
+        return int(self._size)
+
+    def success(self, latency: float):
+        """
+        Record a successful commit.
+
+        :param latency: seconds the commit took
+        :return:
+        """
+        if latency < self.target_latency:
+            self._size = min(self.maximum, max(self._size * self.grow, self._size + 1))
+        elif latency > self.target_latency:
+            # A commit twice as slow as the target halves the size
+            factor = max(self.shrink, self.target_latency / latency)
+            self._size = max(self.minimum, self._size * factor)
+
+    def failure(self):
+        """
+        Record a failed commit.
+
+        :return:
+        """
+        self._size = max(self.minimum, self._size * self.shrink)
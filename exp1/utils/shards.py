@@ -0,0 +1,108 @@
+from typing import Iterator, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Typed columns of a people shard. The uid and dgraph.type of each person are
+# derived from naid when the shard is read back, so they are not stored.
+people_schema = pa.schema([
+    ('naid', pa.string()),
+    ('name', pa.string()),
+    ('alias', pa.string()),
+    ('age', pa.int64()),
+    ('age_of_entry', pa.int64()),
+    ('age_of_naturalization', pa.int64()),
+    ('country', pa.string()),
+    ('port_of_entry', pa.string()),
+    ('year_of_entry', pa.string()),
+    ('sex', pa.string()),
+])
+
+# year_of_entry is -1 when the date of entry is unknown. That placeholder is
+# stored as a null in the string column and restored when read back.
+_unknown_year = -1
+
+
+class ShardWriter(object):
+    """
+    Writes people into a sequence of Parquet shards with typed columns.
+    Rows are buffered column by column, and a shard is written out each
+    time shard_rows people have been added.
+    """
+
+    def __init__(self, prefix: str, shard_rows: int = 10_000):
+        """
+        :param prefix: path prefix for each shard, the shard index and
+                       .parquet are appended to it
+        :param shard_rows: number of people per shard
+        """
+        super(ShardWriter, self).__init__()
+
+        self.prefix = prefix
+        self.shard_rows = shard_rows
+        self.paths = []
+        self.columns = self._empty_columns()
+
+    @staticmethod
+    def _empty_columns() -> dict:
+        return {name: [] for name in people_schema.names}
+
+    def add(self, person: dict):
+        """
+        Add a single person to the current shard.
+
+        :param person:
+        :return:
+        """
+        for name, column in self.columns.items():
+            value = person[name]
+            if name == 'year_of_entry':
+                value = None if value == _unknown_year else str(value)
+            column.append(value)
+
+        if len(self.columns['naid']) >= self.shard_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write out everything buffered as a new shard.
+
+        :return:
+        """
+        if len(self.columns['naid']) == 0:
+            return
+
+        path = f'{self.prefix}-{len(self.paths)}.parquet'
+        table = pa.Table.from_pydict(self.columns, schema=people_schema)
+        pq.write_table(table, path)
+
+        self.paths.append(path)
+        self.columns = self._empty_columns()
+
+    def close(self):
+        self.flush()
+
+
+def read_shard(path: str, batch_size: int = 10_000) -> Iterator[List[dict]]:
+    """
+    Read a people shard back in record batches. The file is memory mapped,
+    so workers only page in the columns they are decoding.
+
+    :param path:
+    :param batch_size:
+    :return: lists of people
+    """
+    shard = pq.ParquetFile(path, memory_map=True)
+    for batch in shard.iter_batches(batch_size=batch_size):
+        columns = batch.to_pydict()
+        years = columns['year_of_entry']
+        columns['year_of_entry'] = [
+            _unknown_year if year is None else year
+            for year in years
+        ]
+
+        names = list(columns.keys())
+        yield [
+            dict(zip(names, row))
+            for row in zip(*columns.values())
+        ]
@@ -0,0 +1,277 @@
+import hashlib
+import multiprocessing as mp
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Union
+
+# Header: magic, capacity, key size, value size, max probes, live entries
+_header = struct.Struct('<4sIHHHxxQ')
+_magic = b'SHT1'
+
+# Slot: version, key length, value length, key hash, expiry (0 for never)
+_slot = struct.Struct('<IBBxxQd')
+
+
+def _hash(key: bytes) -> int:
+    # Python's hash() is salted per interpreter, so use a stable 64 bit hash
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+class SharedTable(object):
+    """
+    Fixed size open-addressing hash table in shared memory, used as a tier
+    between each process' layer 1 cache and redis. Every pool worker on the
+    host reads the same table, so a hot uid is stored once per host instead
+    of once per worker.
+
+    Keys and values are short strings. They are stored inline in fixed size
+    slots, and keys or values that don't fit are simply not cached here.
+    There are no deletes. A write that finds no free (or expired) slot
+    within max_probes slots is dropped, like an eviction.
+
+    Writers take a lock. Readers don't: each slot has a version counter
+    that is odd while the slot is being written, and a read is retried if
+    the version changed underneath it.
+
+    Create the table in the parent before starting the pool. Forked workers
+    inherit it. Otherwise pass it through Pool(initializer=..., initargs=...)
+    or as an mp.Process argument. Its lock can only be shared by
+    inheritance, so passing the table as a Pool task argument (apply_async,
+    imap, ...) raises a RuntimeError.
+    """
+
+    def __init__(self, capacity: int = 1 << 16, key_size: int = 64, value_size: int = 16,
+                 max_probes: int = 8, name: str = None, lock=None):
+        """
+        Create a new shared table.
+
+        :param capacity: number of slots (rounded up to a power of 2)
+        :param key_size: max encoded key length
+        :param value_size: max encoded value length
+        :param max_probes: slots checked per lookup before giving up
+        :param name: shared memory name (generated if None)
+        :param lock: multiprocessing lock shared by writers (created if None)
+        """
+        super(SharedTable, self).__init__()
+
+        size = 1
+        while size < capacity:
+            size <<= 1
+        key_size = min(key_size, 255)
+        value_size = min(value_size, 255)
+
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=True,
+            size=_header.size + size * self._slot_size(key_size, value_size),
+        )
+        _header.pack_into(self.shm.buf, 0, _magic, size, key_size, value_size, max_probes, 0)
+        self._load(lock or mp.Lock())
+        self.owner = True
+
+    @classmethod
+    def attach(cls, name: str, lock) -> 'SharedTable':
+        """
+        Attach to a table created by another process.
+
+        :param name: shared memory name of the table
+        :param lock: the lock the table was created with
+        :return:
+        """
+        table = cls.__new__(cls)
+        table.shm = shared_memory.SharedMemory(name=name)
+        table._load(lock)
+        table.owner = False
+        return table
+
+    def __reduce__(self):
+        # Only works while a child process is being started, see above
+        return SharedTable.attach, (self.name, self.lock)
+
+    @staticmethod
+    def _slot_size(key_size: int, value_size: int) -> int:
+        # Keep slots 8 byte aligned
+        return (_slot.size + key_size + value_size + 7) & ~7
+
+    def _load(self, lock):
+        magic, capacity, key_size, value_size, max_probes, _ = _header.unpack_from(self.shm.buf, 0)
+        if magic != _magic:
+            raise ValueError(f'{self.shm.name} is not a shared table')
+
+        self.lock = lock
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.key_size = key_size
+        self.value_size = value_size
+        self.max_probes = max_probes
+        self.slot_size = self._slot_size(key_size, value_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def __len__(self) -> int:
+        return _header.unpack_from(self.shm.buf, 0)[5]
+
+    def _offset(self, index: int) -> int:
+        return _header.size + index * self.slot_size
+
+    def _read(self, offset: int, key_hash: int, encoded: bytes, now: float) -> Union[str, None]:
+        """
+        Read a slot, returning its value if it holds the key.
+        Returns False if the slot is empty, which ends the probe sequence.
+        """
+        buf = self.shm.buf
+        for _ in range(4):
+            version, key_len, value_len, slot_hash, expires = _slot.unpack_from(buf, offset)
+            if version & 1:
+                continue
+            if key_len == 0:
+                return False
+            if slot_hash != key_hash or key_len != len(encoded):
+                return None
+
+            start = offset + _slot.size
+            slot_key = bytes(buf[start:start + key_len])
+            value = bytes(buf[start + self.key_size:start + self.key_size + value_len])
+            if _slot.unpack_from(buf, offset)[0] != version:
+                continue
+
+            if slot_key != encoded or (expires and expires < now):
+                return None
+            return value.decode()
+
+        # The slot kept changing, treat it as a miss
+        return None
+
+    def get(self, key: str) -> Union[str, None]:
+        """
+        Look up a key without taking the lock.
+
+        :param key:
+        :return: the value, or None if it is not in the table
+        """
+        encoded = key.encode('utf8')
+        if len(encoded) > self.key_size:
+            return None
+
+        key_hash = _hash(encoded)
+        now = time.time()
+        for probe in range(self.max_probes):
+            value = self._read(self._offset((key_hash + probe) & self.mask), key_hash, encoded, now)
+            if value is False:
+                return None
+            if value is not None:
+                return value
+        return None
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        result = dict()
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set(self, key: str, value: str, ttl: float = None) -> bool:
+        """
+        Store a key value pair.
+
+        :param key:
+        :param value:
+        :param ttl: seconds the pair lives for (None for no expiry)
+        :return: False if the pair was too large, or there was no room for it
+        """
+        encoded = key.encode('utf8')
+        encoded_value = value.encode('utf8')
+        if len(encoded) > self.key_size or len(encoded_value) > self.value_size:
+            return False
+
+        key_hash = _hash(encoded)
+        expires = time.time() + ttl if ttl is not None else 0.0
+        with self.lock:
+            return self._write(key_hash, encoded, encoded_value, expires)
+
+    def set_many(self, mapping: Dict[str, str], ttl: float = None, ttls: Dict[str, float] = None) -> int:
+        """
+        Store many key value pairs, taking the lock once.
+
+        :param mapping:
+        :param ttl: seconds the pairs live for (None for no expiry)
+        :param ttls: seconds each pair lives for, if it differs from ttl
+        :return: number of pairs stored
+        """
+        now = time.time()
+        items = []
+        for key, value in mapping.items():
+            encoded = key.encode('utf8')
+            encoded_value = value.encode('utf8')
+            if len(encoded) <= self.key_size and len(encoded_value) <= self.value_size:
+                key_ttl = ttls.get(key, ttl) if ttls is not None else ttl
+                expires = now + key_ttl if key_ttl is not None else 0.0
+                items.append((_hash(encoded), encoded, encoded_value, expires))
+
+        stored = 0
+        with self.lock:
+            for key_hash, encoded, encoded_value, expires in items:
+                stored += self._write(key_hash, encoded, encoded_value, expires)
+        return stored
+
+    def _write(self, key_hash: int, encoded: bytes, encoded_value: bytes, expires: float) -> bool:
+        """
+        Write a pair into the slot that already holds the key, or else the
+        first empty or expired slot. Must be called with the lock held.
+        """
+        buf = self.shm.buf
+        now = time.time()
+        target = None
+        for probe in range(self.max_probes):
+            offset = self._offset((key_hash + probe) & self.mask)
+            version, key_len, _, slot_hash, slot_expires = _slot.unpack_from(buf, offset)
+
+            if key_len == 0:
+                if target is None:
+                    target = offset
+                break
+
+            start = offset + _slot.size
+            if slot_hash == key_hash and bytes(buf[start:start + key_len]) == encoded:
+                target = offset
+                break
+            if target is None and slot_expires and slot_expires < now:
+                target = offset
+
+        if target is None:
+            return False
+
+        version, key_len = _slot.unpack_from(buf, target)[:2]
+        start = target + _slot.size
+
+        # Odd version while the slot is being written
+        struct.pack_into('<I', buf, target, (version + 1) & 0xFFFFFFFF)
+        buf[start:start + len(encoded)] = encoded
+        buf[start + self.key_size:start + self.key_size + len(encoded_value)] = encoded_value
+        _slot.pack_into(buf, target, (version + 2) & 0xFFFFFFFF,
+                        len(encoded), len(encoded_value), key_hash, expires)
+
+        if key_len == 0:
+            magic, capacity, key_size, value_size, max_probes, count = _header.unpack_from(buf, 0)
+            _header.pack_into(buf, 0, magic, capacity, key_size, value_size, max_probes, count + 1)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self),
+            'maxsize': self.capacity,
+            'bytes': self.shm.size,
+        }
+
+    def close(self):
+        """
+        Detach from the table. The owner also frees the shared memory.
+
+        :return:
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,151 @@
+import humps
+
+from utils.rdf import escape_literal, nquad, nquad_literal
+
+# Placeholder values that can not be converted to the type of their predicate
+# (-1 is not a valid dateTime), so they can not be matched with eq(). People
+# with one of these values are left without an edge for that field.
+_unlinked_values = {('year_of_entry', -1)}
+
+
+def is_unlinked(field: str, value) -> bool:
+    """
+    Check if a category value is a placeholder that gets no node or edge.
+
+    :param field:
+    :param value:
+    :return:
+    """
+    return (field, value) in _unlinked_values
+
+
+class UpsertBatch(object):
+    """
+    Builds a single dgraph upsert block for a batch of people. People are
+    matched on naid and category nodes on their value, so running the same
+    batch twice leaves the graph unchanged. The outgoing category edges of
+    people that already exist are deleted first, so changed rows do not
+    keep their old edges.
+    """
+
+    def __init__(self, field_uid_map: dict, root_edges: list):
+        """
+        :param field_uid_map: category field -> person edge predicate
+        :param root_edges: (category field, root predicate) pairs
+        """
+        super(UpsertBatch, self).__init__()
+
+        self.field_uid_map = field_uid_map
+        self.root_edges = dict(root_edges)
+
+        # naid -> person, and (field, value) -> query variable name
+        self.people = dict()
+        self.categories = dict()
+
+    def __len__(self) -> int:
+        return len(self.people)
+
+    def add(self, person: dict):
+        """
+        Add a parsed person to the batch.
+
+        :param person:
+        :return:
+        """
+        self.people[person['naid']] = person
+
+        for field in self.field_uid_map:
+            key = (field, self._value(person, field))
+            if is_unlinked(*key):
+                continue
+            if key not in self.categories:
+                self.categories[key] = f'v{len(self.categories)}'
+
+    @staticmethod
+    def _value(person: dict, field: str):
+        value = person[field]
+        if value == '':
+            value = 'unknown'
+        return value
+
+    def query(self) -> str:
+        """
+        Build the query block that binds every person and category node
+        in the batch to a variable.
+
+        :return:
+        """
+        lines = ['root as var(func: type(Root))']
+        for index, naid in enumerate(self.people):
+            lines.append(f'p{index} as var(func: eq(naid, "{escape_literal(naid)}"))')
+        for (field, value), var in self.categories.items():
+            lines.append(f'{var} as var(func: eq({field}, "{escape_literal(value)}"))')
+        return 'query {\n' + '\n'.join(lines) + '\n}'
+
+    def del_nquads(self) -> str:
+        """
+        Build the deletions of the existing category edges of each person.
+
+        :return:
+        """
+        return ''.join(
+            nquad(f'uid(p{index})', edge, '*')
+            for index in range(len(self.people))
+            for edge in self.field_uid_map.values()
+        )
+
+    def set_nquads(self) -> str:
+        """
+        Build the nquads that create or update every node and edge.
+
+        :return:
+        """
+        lines = []
+        for (field, value), var in self.categories.items():
+            subject = f'uid({var})'
+            lines.append(nquad_literal(subject, 'dgraph.type', humps.pascalize(field)))
+            lines.append(nquad_literal(subject, field, value))
+            if field in self.root_edges:
+                lines.append(nquad('uid(root)', self.root_edges[field], subject))
+
+        for index, person in enumerate(self.people.values()):
+            subject = f'uid(p{index})'
+            lines.append(nquad_literal(subject, 'dgraph.type', 'Person'))
+            lines.append(nquad_literal(subject, 'naid', person['naid']))
+            lines.append(nquad_literal(subject, 'name', person['name']))
+            lines.append(nquad_literal(subject, 'alias', person['alias']))
+            lines.append(nquad('uid(root)', 'people', subject))
+            for field, edge in self.field_uid_map.items():
+                key = (field, self._value(person, field))
+                if is_unlinked(*key):
+                    continue
+                lines.append(nquad(subject, edge, f'uid({self.categories[key]})'))
+
+        return ''.join(lines)
+
+    def commit(self, client):
+        """
+        Send the whole batch as one upsert request and commit it.
+
+        :param client:
+        :return:
+        """
+        if len(self) == 0:
+            return
+
+        txn = client.txn()
+        try:
+            request = txn.create_request(
+                query=self.query(),
+                mutations=[
+                    txn.create_mutation(del_nquads=self.del_nquads()),
+                    txn.create_mutation(set_nquads=self.set_nquads()),
+                ],
+                commit_now=True,
+            )
+            txn.do_request(request)
+        finally:
+            txn.discard()
+
+        self.people = dict()
+        self.categories = dict()
@@ -0,0 +1,229 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Column names in fuller_data.parquet
+anum_column = 'anum'
+location_column = 'naturalization location'
+
+
+def normalize_locations(locations: pd.Series) -> pd.Series:
+    """
+    Normalize location names the way the notebooks do, e.g.
+    ' New York, NY' -> 'new york'.
+
+    :param locations:
+    :return:
+    """
+    return (
+        locations.fillna('').astype(str)
+        .str.lower().str.strip()
+        .str.split(',').str[0].str.strip()
+    )
+
+
+class AnumGraph(object):
+    """
+    Graph of people linked to the person with the next anum, and to the
+    location they were naturalized at, as a sparse adjacency matrix.
+
+    Nodes 0 to len(anums) - 1 are people, in anum order, and the nodes
+    after them are locations, in name order.
+    """
+
+    def __init__(self, anums: np.ndarray, locations: np.ndarray, adjacency: sp.csr_matrix, directed: bool):
+        """
+        :param anums: anum of each person node, sorted
+        :param locations: name of each location node, sorted
+        :param adjacency: weighted adjacency matrix over all the nodes
+        :param directed: if False the adjacency is symmetric
+        """
+        super(AnumGraph, self).__init__()
+
+        self.anums = anums
+        self.locations = locations
+        self.adjacency = adjacency
+        self.directed = directed
+
+    @property
+    def num_people(self) -> int:
+        return len(self.anums)
+
+    @property
+    def num_nodes(self) -> int:
+        return self.adjacency.shape[0]
+
+    @property
+    def num_edges(self) -> int:
+        if self.directed:
+            return self.adjacency.nnz
+        # Each undirected edge is stored in both directions
+        return (self.adjacency.nnz + self.adjacency.diagonal().astype(bool).sum()) // 2
+
+    def label(self, node: int) -> Union[int, str]:
+        """
+        Get the anum or location name of a node, as used by the notebooks.
+
+        :param node:
+        :return:
+        """
+        if node < self.num_people:
+            return int(self.anums[node])
+        return str(self.locations[node - self.num_people])
+
+    def labels(self) -> list:
+        return [int(anum) for anum in self.anums] + [str(loc) for loc in self.locations]
+
+    def edges(self):
+        """
+        Get the edges as arrays of sources, targets and weights. Undirected
+        edges are only listed once.
+
+        :return:
+        """
+        coo = self.adjacency.tocoo()
+        if self.directed:
+            return coo.row, coo.col, coo.data
+        mask = coo.row <= coo.col
+        return coo.row[mask], coo.col[mask], coo.data[mask]
+
+    def to_networkx(self):
+        """
+        Convert to a networkx graph with anums and location names as nodes.
+        networkx is only imported here, as building a large graph with it is
+        slow.
+
+        :return:
+        """
+        import networkx as nx
+
+        g = nx.DiGraph() if self.directed else nx.Graph()
+        labels = self.labels()
+        g.add_nodes_from(labels)
+        sources, targets, weights = self.edges()
+        g.add_weighted_edges_from(
+            (labels[source], labels[target], float(weight))
+            for source, target, weight in zip(sources.tolist(), targets.tolist(), weights.tolist())
+        )
+        return g
+
+
+def _dedup(sources: np.ndarray, targets: np.ndarray, num_targets: int) -> tuple:
+    # Adding the same edge twice in networkx keeps one edge, not a sum.
+    # Sorting one int64 key is much faster than np.unique on rows of pairs.
+    if len(sources) == 0:
+        return sources, targets
+    keys = np.sort(sources.astype(np.int64) * max(num_targets, 1) + targets)
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    return keys // max(num_targets, 1), keys % max(num_targets, 1)
+
+
+def build(anums: np.ndarray, locations: np.ndarray = None, max_gap: Union[int, None] = 100,
+          sequence_weight: float = 1.0, location_weight: float = 0.1, directed: bool = False) -> AnumGraph:
+    """
+    Build the anum graph without a python loop over the rows. The anums are
+    sorted, and each person is linked to the person with the next anum if
+    they are less than max_gap apart. Each person is also linked to their
+    (already normalized) location, unless it is empty.
+
+    The defaults match analysis.ipynb. For the graph in exp2/detect.ipynb
+    use max_gap=None, sequence_weight=0.1, location_weight=1, directed=True.
+    That notebook links people to their raw 'port of entry' instead of the
+    naturalization location, without normalizing it, so call build
+    directly rather than from_frame (which always normalizes):
+    build(df['anum'], df['port of entry'].fillna(''), max_gap=None, ...).
+
+    :param anums: anum of each row, rows with anum <= 0 are skipped
+    :param locations: location of each row (None for no location edges)
+    :param max_gap: link consecutive anums closer than this (None to link all of them)
+    :param sequence_weight: weight of anum -> next anum edges
+    :param location_weight: weight of anum -> location edges
+    :param directed: build a directed graph
+    :return:
+    """
+    anums = np.asarray(anums, dtype=np.int64)
+    valid = anums > 0
+    anums = anums[valid]
+
+    # Person nodes: the unique anums, in order
+    people, person_index = np.unique(anums, return_inverse=True)
+    num_people = len(people)
+
+    # Consecutive anums are neighbours in the sorted unique array
+    gaps = np.diff(people)
+    step = np.ones(len(gaps), dtype=bool) if max_gap is None else gaps < max_gap
+    seq_sources = np.flatnonzero(step)
+    seq_targets = seq_sources + 1
+
+    loc_names = np.array([], dtype=object)
+    loc_sources = loc_targets = np.array([], dtype=np.int64)
+    if locations is not None:
+        # Hashing is much faster than sorting millions of strings
+        loc_index, loc_names = pd.factorize(np.asarray(locations, dtype=object)[valid], sort=True)
+        loc_names = np.asarray(loc_names, dtype=object)
+        empty = np.flatnonzero(loc_names == '')
+        has_location = loc_index >= 0
+        if len(empty) > 0:
+            # '' sorts first, so drop it and shift the others down
+            has_location &= loc_index != empty[0]
+            loc_index = loc_index - 1
+            loc_names = loc_names[1:]
+        loc_sources, loc_targets = _dedup(person_index[has_location], loc_index[has_location], len(loc_names))
+        loc_targets = loc_targets + num_people
+
+    sources = np.concatenate([seq_sources, loc_sources])
+    targets = np.concatenate([seq_targets, loc_targets])
+    weights = np.concatenate([
+        np.full(len(seq_sources), sequence_weight),
+        np.full(len(loc_sources), location_weight),
+    ])
+    if not directed:
+        sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+        weights = np.concatenate([weights, weights])
+
+    size = num_people + len(loc_names)
+    adjacency = sp.coo_matrix((weights, (sources, targets)), shape=(size, size)).tocsr()
+    return AnumGraph(people, loc_names, adjacency, directed)
+
+
+def from_frame(df: pd.DataFrame, anum: str = anum_column, location: Union[str, None] = location_column,
+               **kwargs) -> AnumGraph:
+    """
+    Build the anum graph from a data frame of fuller_data.parquet rows.
+
+    :param df:
+    :param anum: anum column
+    :param location: location column, normalized before use (None for no location edges)
+    :param kwargs: passed to build
+    :return:
+    """
+    anums = pd.to_numeric(df[anum], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    locations = None
+    if location is not None:
+        # There are far fewer distinct locations than rows, so only
+        # normalize each distinct name once. Missing values have code -1,
+        # which picks the '' added at the end.
+        codes, names = pd.factorize(df[location])
+        names = np.append(normalize_locations(pd.Series(names, dtype=object)).to_numpy(dtype=object), '')
+        locations = names[codes]
+    return build(anums, locations, **kwargs)
+
+
+def from_parquet(path: str, anum: str = anum_column, location: Union[str, None] = location_column,
+                 **kwargs) -> AnumGraph:
+    """
+    Build the anum graph from a parquet file, reading only the columns it needs.
+
+    :param path:
+    :param anum: anum column
+    :param location: location column (None for no location edges)
+    :param kwargs: passed to build
+    :return:
+    """
+    import pyarrow.parquet as pq
+
+    columns = [anum] if location is None else [anum, location]
+    df = pq.read_table(path, columns=columns).to_pandas()
+    return from_frame(df, anum, location, **kwargs)
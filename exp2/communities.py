@@ -0,0 +1,434 @@
+import argparse
+import contextlib
+import time
+from typing import Dict, List
+
+import numpy as np
+import scipy.sparse as sp
+
+import anum_graph
+
+
+class Timings(object):
+    """
+    Wall clock time of each stage of a run, in the order they ran.
+    """
+
+    def __init__(self):
+        super(Timings, self).__init__()
+
+        self.stages: Dict[str, float] = dict()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.time() - start
+
+    @property
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+    def __str__(self) -> str:
+        width = max([len(name) for name in self.stages] + [len('total')])
+        lines = [f'{name:<{width}} {elapsed:8.2f}s' for name, elapsed in self.stages.items()]
+        lines.append(f'{"total":<{width}} {self.total:8.2f}s')
+        return '\n'.join(lines)
+
+
+def _undirected(adjacency: sp.spmatrix) -> sp.csr_matrix:
+    """
+    Community detection treats edges as undirected. Symmetrize a directed
+    adjacency by adding it to its transpose.
+    """
+    adjacency = sp.csr_matrix(adjacency)
+    if (adjacency != adjacency.T).nnz > 0:
+        adjacency = (adjacency + adjacency.T).tocsr()
+    return adjacency
+
+
+def _relabel(labels: np.ndarray) -> np.ndarray:
+    # Number communities 0..k-1, by their smallest node
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return order[inverse]
+
+
+def connected_components(adjacency: sp.spmatrix) -> np.ndarray:
+    """
+    Label the connected components with a vectorized union-find. Every
+    round hooks the root of each edge's larger end under the root of its
+    smaller end, then compresses paths until every node points at a root.
+    It takes a few rounds on any graph, and each round is linear in the
+    number of edges.
+
+    :param adjacency: adjacency matrix, treated as undirected
+    :return: component of each node, numbered by smallest node
+    """
+    coo = sp.coo_matrix(adjacency)
+    n = coo.shape[0]
+    mask = coo.row != coo.col
+    u, v = coo.row[mask].astype(np.int64), coo.col[mask].astype(np.int64)
+
+    parent = np.arange(n)
+    while len(u) > 0:
+        ru, rv = parent[u], parent[v]
+        differ = ru != rv
+        if not differ.any():
+            break
+        # Hook, always towards the smaller root so there are no cycles
+        low, high = np.minimum(ru, rv)[differ], np.maximum(ru, rv)[differ]
+        np.minimum.at(parent, high, low)
+
+        # Compress, until every node points at its root
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+        # Edges inside one component are done
+        u, v = u[differ], v[differ]
+
+    return _relabel(parent)
+
+
+def _without_loops(adjacency: sp.csr_matrix) -> tuple:
+    """
+    Split an adjacency into the edges between different nodes and the
+    weight of each node's self loop.
+    """
+    loops = adjacency.diagonal()
+    adjacency = (adjacency - sp.diags(loops)).tocsr()
+    adjacency.eliminate_zeros()
+    return adjacency, loops
+
+
+def _members(labels: np.ndarray) -> sp.csr_matrix:
+    # Node to community matrix, with a single 1 in each row
+    n = len(labels)
+    return sp.csr_matrix((np.ones(n), labels, np.arange(n + 1)), shape=(n, n))
+
+
+def _neighbour_weights(adjacency: sp.csr_matrix, labels: np.ndarray, active: np.ndarray) -> tuple:
+    """
+    Sum the edge weight from some nodes to each community next to them, as
+    the product of their rows of the adjacency (without self loops) and a
+    node to community matrix.
+
+    :param active: the nodes to look at
+    :return: positions in active, communities and weights, grouped by node
+    """
+    weights = (adjacency[active] @ _members(labels)).tocsr()
+    local = np.repeat(np.arange(len(active)), np.diff(weights.indptr))
+    return local, weights.indices, weights.data
+
+
+def _group_starts(nodes: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.concatenate([[True], nodes[1:] != nodes[:-1]]))
+
+
+def _first_max(values: np.ndarray, nodes: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Get the index of the first largest value in each node's group.
+    """
+    best = np.maximum.reduceat(values, starts)
+    winners = np.flatnonzero(values == np.repeat(best, np.diff(np.append(starts, len(values)))))
+    return winners[_group_starts(nodes[winners])]
+
+
+def _vote(adjacency: sp.csr_matrix, labels: np.ndarray, active: np.ndarray, rng: np.random.Generator) -> tuple:
+    """
+    Get the label with the highest total edge weight among each node's
+    neighbours. A node keeps its label if it is one of the heaviest, so
+    ties don't flip forever, and other ties are broken at random.
+
+    :param active: the nodes to vote for
+    :return: the nodes that have neighbours, and their new labels
+    """
+    local, candidates, weights = _neighbour_weights(adjacency, labels, active)
+    if len(local) == 0:
+        return local, local
+    nodes = active[local]
+    starts = _group_starts(local)
+
+    # Among the heaviest labels of each node, the current label first,
+    # then the others in random order
+    heaviest = weights == np.repeat(np.maximum.reduceat(weights, starts), np.diff(np.append(starts, len(nodes))))
+    order = rng.random(len(nodes))
+    order[candidates == labels[nodes]] = 2.0
+    order[~heaviest] = -1.0
+    best = _first_max(order, local, starts)
+    return nodes[best], candidates[best]
+
+
+def label_propagation(adjacency: sp.spmatrix, max_iter: int = 100, update_fraction: float = 0.5,
+                      seed: int = None) -> np.ndarray:
+    """
+    Find communities by weighted label propagation. Each node starts in its
+    own community, then repeatedly takes the label most of its neighbours
+    (by edge weight) have, until no label changes. Each iteration is a
+    sparse matrix product and a few passes over its result, and only looks
+    at the nodes next to a label that changed.
+
+    Updating every node at once can make labels flip back and forth between
+    the two sides of a bipartite part of the graph, like people and their
+    location, so only a random fraction of the nodes is updated each
+    iteration.
+
+    Label propagation is cheap, but it stops at the first stable labelling,
+    which on the anum graph is many short runs of anums. louvain finds far
+    better communities.
+
+    :param adjacency: weighted adjacency matrix, treated as undirected
+    :param max_iter: give up after this many iterations
+    :param update_fraction: fraction of the nodes updated each iteration
+    :param seed: random seed, for repeatable results
+    :return: community of each node, numbered by smallest node
+    """
+    rng = np.random.default_rng(seed)
+    adjacency, _ = _without_loops(_undirected(adjacency))
+    n = adjacency.shape[0]
+    labels = np.arange(n)
+
+    active = np.arange(n)
+    for _ in range(max_iter):
+        nodes, proposed = _vote(adjacency, labels, active, rng)
+        changed = proposed != labels[nodes]
+        if not changed.any():
+            break
+        update = changed & (rng.random(len(nodes)) < update_fraction)
+        labels[nodes[update]] = proposed[update]
+
+        # Vote again next to the changed labels, and for the nodes that
+        # wanted to change but didn't get to
+        active = np.zeros(n, dtype=bool)
+        active[adjacency[nodes[update]].indices] = active[nodes[changed & ~update]] = True
+        active = np.flatnonzero(active)
+
+    return _relabel(labels)
+
+
+def _local_moving(adjacency: sp.csr_matrix, loops: np.ndarray, resolution: float, max_iter: int,
+                  update_fraction: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Move nodes to the neighbouring community with the best modularity gain,
+    until no move improves modularity. All nodes pick their move at once,
+    then a random fraction of them make it, so that neighbours don't keep
+    swapping communities with each other. After the first round only the
+    nodes next to a move (and the nodes still waiting to move) are looked
+    at again.
+
+    Moves made at once are each chosen without knowing about the others,
+    so around big communities they can undo each other round after round.
+    Moving stops at the first round that doesn't improve modularity, and
+    that round is undone.
+
+    :param adjacency: adjacency without self loops
+    :param loops: self loop weight of each node
+    """
+    n = adjacency.shape[0]
+    labels = np.arange(n)
+
+    # Self loops count once towards degrees here. That keeps the degrees
+    # and total weight the same after communities are merged into nodes.
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel() + loops
+    total = degrees.sum()
+    if n == 0 or total == 0:
+        return labels
+    scale = resolution / total
+
+    # Modularity is kept up to date from the weight inside communities and
+    # the squared community degrees, which only change around moved nodes
+    community_degrees = degrees.copy()
+    inside = loops.sum()
+    squares = np.sum(community_degrees ** 2)
+    current = inside / total - resolution * squares / total ** 2
+    moved = np.zeros(n, dtype=bool)
+
+    def inside_change(nodes: np.ndarray, rows: np.ndarray, edges: sp.csr_matrix) -> float:
+        # Weight inside communities on edges of the nodes. Edges between two
+        # of the nodes are seen from both ends, other edges from one end and
+        # stand for both directions.
+        same = labels[nodes[rows]] == labels[edges.indices]
+        return 2 * edges.data[same].sum() - edges.data[same & moved[edges.indices]].sum()
+
+    active = np.arange(n)
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        local, candidates, weights = _neighbour_weights(adjacency, labels, active)
+        if len(local) == 0:
+            break
+        nodes = active[local]
+        starts = _group_starts(local)
+
+        # Gain of staying, with the node taken out of its own community
+        own = candidates == labels[nodes]
+        own_weights = np.bincount(local[own], weights=weights[own], minlength=len(active))
+        active_degrees = degrees[active]
+        stay = own_weights - scale * active_degrees * (community_degrees[labels[active]] - active_degrees)
+
+        # Gain of joining each neighbouring community, and the best of them
+        gains = weights - scale * degrees[nodes] * community_degrees[candidates]
+        gains[own] = -np.inf
+        best = _first_max(gains, local, starts)
+        wanting = gains[best] > stay[local[best]] + 1e-12 * total
+        if not wanting.any():
+            break
+        moves = wanting & (rng.random(len(best)) < update_fraction)
+        movers, targets = nodes[best[moves]], candidates[best[moves]]
+        sources = labels[movers]
+
+        # Make the moves, and undo them if modularity didn't go up
+        edges = adjacency[movers]
+        rows = np.repeat(np.arange(len(movers)), np.diff(edges.indptr))
+        touched = np.zeros(n, dtype=bool)
+        touched[sources] = touched[targets] = True
+        moved[movers] = True
+        before = inside_change(movers, rows, edges)
+        labels[movers] = targets
+        after = inside_change(movers, rows, edges)
+        moved[movers] = False
+
+        old_squares = np.sum(community_degrees[touched] ** 2)
+        np.add.at(community_degrees, sources, -degrees[movers])
+        np.add.at(community_degrees, targets, degrees[movers])
+        new_inside = inside + after - before
+        new_squares = squares - old_squares + np.sum(community_degrees[touched] ** 2)
+        quality = new_inside / total - resolution * new_squares / total ** 2
+        if quality <= current + 1e-12:
+            labels[movers] = sources
+            np.add.at(community_degrees, targets, -degrees[movers])
+            np.add.at(community_degrees, sources, degrees[movers])
+            break
+        inside, squares, current = new_inside, new_squares, quality
+
+        # Look again at the moved nodes, their neighbours, and the nodes
+        # that wanted to move but didn't get to
+        active = np.zeros(n, dtype=bool)
+        active[movers] = active[edges.indices] = active[nodes[best[wanting & ~moves]]] = True
+        active = np.flatnonzero(active)
+
+    return labels
+
+
+def louvain(adjacency: sp.spmatrix, resolution: float = 1.0, max_levels: int = 20, max_iter: int = 100,
+            update_fraction: float = 0.5, seed: int = None) -> np.ndarray:
+    """
+    Find communities by maximizing modularity, Louvain style. Nodes first
+    move between neighbouring communities while that improves modularity.
+    Then every community becomes a single node of a smaller graph, and the
+    moves are repeated on it, until no more communities merge.
+
+    The moves of each round are made in parallel with array operations,
+    instead of one node at a time. Both finding the moves and building the
+    smaller graph are sparse matrix products.
+
+    :param adjacency: weighted adjacency matrix, treated as undirected
+    :param resolution: higher for more, smaller communities
+    :param max_levels: most times to merge communities into nodes
+    :param max_iter: most rounds of moves on each level
+    :param update_fraction: fraction of the wanted moves made each round
+    :param seed: random seed, for repeatable results
+    :return: community of each node, numbered by smallest node
+    """
+    rng = np.random.default_rng(seed)
+    adjacency = _undirected(adjacency)
+    labels = np.arange(adjacency.shape[0])
+
+    for _ in range(max_levels):
+        edges, loops = _without_loops(adjacency)
+        level = _relabel(_local_moving(edges, loops, resolution, max_iter, update_fraction, rng))
+        size = level.max() + 1 if len(level) else 0
+        if size == adjacency.shape[0]:
+            break
+
+        labels = level[labels]
+        merge = sp.csr_matrix((np.ones(len(level)), (np.arange(len(level)), level)),
+                              shape=(len(level), size))
+        adjacency = (merge.T @ adjacency @ merge).tocsr()
+
+    return _relabel(labels)
+
+
+def modularity(adjacency: sp.spmatrix, labels: np.ndarray, resolution: float = 1.0) -> float:
+    """
+    Weighted modularity of a partition, the same value as
+    networkx.algorithms.community.modularity.
+
+    :param adjacency: weighted adjacency matrix, treated as undirected
+    :param labels: community of each node
+    :param resolution:
+    :return:
+    """
+    adjacency = _undirected(adjacency)
+    # Edges are stored in both directions, except self loops, which
+    # count twice towards the degree of their node
+    loops = adjacency.diagonal()
+    total = adjacency.sum() + loops.sum()
+    if total == 0:
+        return 0.0
+
+    coo = adjacency.tocoo()
+    inside = coo.data[labels[coo.row] == labels[coo.col]].sum() + loops.sum()
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel() + loops
+    community_degrees = np.bincount(labels, weights=degrees)
+    return float(inside / total - resolution * np.sum((community_degrees / total) ** 2))
+
+
+def communities(labels: np.ndarray) -> List[np.ndarray]:
+    """
+    Group nodes by community, largest community first.
+
+    :param labels: community of each node
+    :return: the nodes of each community
+    """
+    order = np.argsort(labels, kind='stable')
+    sizes = np.bincount(labels)
+    groups = np.split(order, np.cumsum(sizes)[:-1])
+    return sorted(groups, key=len, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Community detection over the anum graph')
+    parser.add_argument('path', nargs='?', default='fuller_data.parquet', help='parquet file of people')
+    parser.add_argument('--method', choices=['louvain', 'label_propagation', 'components'], default='louvain')
+    parser.add_argument('--max-gap', type=int, default=100, help='link consecutive anums closer than this')
+    parser.add_argument('--min-size', type=int, default=5, help='smallest community to print')
+    parser.add_argument('--top', type=int, default=10, help='communities to print')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    timings = Timings()
+    with timings.stage('build graph'):
+        graph = anum_graph.from_parquet(args.path, max_gap=args.max_gap)
+    print(f'{graph.num_nodes} nodes ({graph.num_people} people), {graph.num_edges} edges')
+
+    with timings.stage(args.method):
+        if args.method == 'louvain':
+            labels = louvain(graph.adjacency, seed=args.seed)
+        elif args.method == 'label_propagation':
+            labels = label_propagation(graph.adjacency, seed=args.seed)
+        else:
+            labels = connected_components(graph.adjacency)
+
+    with timings.stage('modularity'):
+        score = modularity(graph.adjacency, labels)
+
+    with timings.stage('group'):
+        groups = [group for group in communities(labels) if len(group) >= args.min_size]
+
+    print(f'{labels.max() + 1 if len(labels) else 0} communities, '
+          f'{len(groups)} with at least {args.min_size} nodes, modularity {score:.4f}')
+    for group in groups[:args.top]:
+        members = sorted((graph.label(node) for node in group), key=lambda x: x if isinstance(x, int) else -1)
+        print(f'{len(group)}: {members[:20]}{" ..." if len(members) > 20 else ""}')
+
+    print(timings)
+
+
+if __name__ == '__main__':
+    main()
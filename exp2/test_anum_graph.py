@@ -0,0 +1,98 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+
+import anum_graph
+
+
+def _frame(n: int, seed: int = 0) -> pd.DataFrame:
+    # Shuffled rows with repeated anums, anums <= 0 and messy locations
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'anum': np.cumsum(rng.integers(0, 150, n)) - 3,
+        'naturalization location': rng.choice([' New York, NY', 'boston', '', 'Chicago,IL', None], n),
+        'port of entry': rng.choice(['New York', 'boston', None], n),
+    })
+    return df.sample(frac=1, random_state=seed)
+
+
+def _analysis_graph(df: pd.DataFrame) -> nx.Graph:
+    # The loop in analysis.ipynb
+    df = df.copy()
+    df['naturalization location'] = df['naturalization location'].fillna('')
+    df = df.sort_values('anum')
+    df = df[df['anum'] > 0]
+    graph = nx.Graph()
+    last = None
+    for loc, anum in zip(df['naturalization location'], df['anum']):
+        anum = int(anum)
+        loc = loc.lower().strip().split(',')[0].strip()
+        graph.add_node(anum)
+        if last is not None and last != anum and abs(anum - last) < 100:
+            graph.add_edge(last, anum, weight=1.0)
+        if loc != '':
+            graph.add_edge(anum, loc, weight=0.1)
+        last = anum
+    return graph
+
+
+def _detect_graph(df: pd.DataFrame) -> nx.DiGraph:
+    # The loop in detect.ipynb
+    df = df.copy()
+    df['port of entry'] = df['port of entry'].fillna('')
+    df = df.sort_values('anum')
+    df = df[df['anum'] > 0]
+    graph = nx.DiGraph()
+    last = None
+    for loc, anum in zip(df['port of entry'], df['anum']):
+        anum = int(anum)
+        graph.add_node(anum)
+        if last is not None and last != anum:
+            graph.add_edge(last, anum, weight=0.1)
+        if loc != '':
+            graph.add_edge(anum, loc, weight=1.0)
+        last = anum
+    return graph
+
+
+def _undirected_edges(graph: nx.Graph) -> dict:
+    return {frozenset((source, target)): weight for source, target, weight in graph.edges(data='weight')}
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_analysis_loop(seed):
+    df = _frame(2000, seed)
+    expected = _analysis_graph(df)
+    graph = anum_graph.from_frame(df)
+    actual = graph.to_networkx()
+
+    assert set(actual.nodes) == set(expected.nodes)
+    assert _undirected_edges(actual) == _undirected_edges(expected)
+    assert graph.num_nodes == expected.number_of_nodes()
+    assert graph.num_edges == expected.number_of_edges()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_detect_loop(seed):
+    df = _frame(2000, seed)
+    expected = _detect_graph(df)
+    graph = anum_graph.build(df['anum'], df['port of entry'].fillna(''), max_gap=None,
+                             sequence_weight=0.1, location_weight=1, directed=True)
+    actual = graph.to_networkx()
+
+    assert set(actual.nodes) == set(expected.nodes)
+    assert set(actual.edges(data='weight')) == set(expected.edges(data='weight'))
+    assert graph.num_edges == expected.number_of_edges()
+
+
+def test_normalize_locations():
+    locations = pd.Series([' New York, NY', 'Chicago,IL', None, 'boston'])
+    assert anum_graph.normalize_locations(locations).tolist() == ['new york', 'chicago', '', 'boston']
+
+
+def test_without_locations():
+    graph = anum_graph.build(np.array([5, 1, 300, 2, 0, -1]))
+    assert list(graph.anums) == [1, 2, 5, 300]
+    assert graph.labels() == [1, 2, 5, 300]
+    assert _undirected_edges(graph.to_networkx()) == {frozenset((1, 2)): 1.0, frozenset((2, 5)): 1.0}
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+import anum_graph
+import communities
+
+
+def _graph(n: int, edges: list, directed: bool = False) -> sp.csr_matrix:
+    sources, targets = np.array(edges, dtype=np.int64).reshape(-1, 2).T
+    weights = np.ones(len(sources))
+    if not directed:
+        sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+        weights = np.concatenate([weights, weights])
+    return sp.coo_matrix((weights, (sources, targets)), shape=(n, n)).tocsr()
+
+
+def _cliques(count: int, size: int) -> sp.csr_matrix:
+    # Cliques joined in a ring by a single edge each
+    edges = []
+    for clique in range(count):
+        nodes = range(clique * size, (clique + 1) * size)
+        edges.extend((a, b) for a in nodes for b in nodes if a < b)
+        edges.append((clique * size, ((clique + 1) % count) * size + 1))
+    return _graph(count * size, edges)
+
+
+def test_connected_components():
+    adjacency = _graph(7, [(0, 1), (1, 2), (4, 3), (5, 5)], directed=True)
+    labels = communities.connected_components(adjacency)
+    assert labels.tolist() == [0, 0, 0, 1, 1, 2, 3]
+
+
+def test_connected_components_matches_scipy():
+    rng = np.random.default_rng(0)
+    n = 500
+    adjacency = _graph(n, rng.integers(0, n, size=(400, 2)).tolist())
+    labels = communities.connected_components(adjacency)
+    count, expected = sp.csgraph.connected_components(adjacency, directed=False)
+    assert labels.max() + 1 == count
+    # Same partition, whatever the numbering
+    pairs = set(zip(labels.tolist(), expected.tolist()))
+    assert len(pairs) == count
+
+
+def test_louvain_finds_cliques():
+    adjacency = _cliques(6, 5)
+    labels = communities.louvain(adjacency, seed=0)
+    assert labels.tolist() == np.repeat(np.arange(6), 5).tolist()
+
+
+def test_label_propagation_splits_cliques():
+    adjacency = _cliques(4, 6)
+    labels = communities.label_propagation(adjacency, seed=0)
+    # Every clique ends up in a single community
+    for clique in range(4):
+        assert len(set(labels[clique * 6:(clique + 1) * 6].tolist())) == 1
+
+
+def test_empty_graph():
+    adjacency = sp.csr_matrix((0, 0))
+    assert len(communities.connected_components(adjacency)) == 0
+    assert len(communities.louvain(adjacency)) == 0
+    assert len(communities.label_propagation(adjacency)) == 0
+    assert communities.modularity(adjacency, np.array([], dtype=np.int64)) == 0.0
+
+
+@pytest.mark.parametrize('resolution', [0.5, 1.0, 2.0])
+def test_modularity_matches_networkx(resolution):
+    nx = pytest.importorskip('networkx')
+    from networkx.algorithms.community import modularity
+
+    rng = np.random.default_rng(1)
+    n = 60
+    edges = rng.integers(0, n, size=(150, 2))
+    adjacency = sp.coo_matrix((rng.random(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+    adjacency = (adjacency + adjacency.T).tocsr()
+    labels = rng.integers(0, 5, size=n)
+
+    g = nx.from_scipy_sparse_array(adjacency) if hasattr(nx, 'from_scipy_sparse_array') \
+        else nx.from_scipy_sparse_matrix(adjacency)
+    groups = [set(np.flatnonzero(labels == label).tolist()) for label in np.unique(labels)]
+    expected = modularity(g, groups, weight='weight', resolution=resolution)
+    assert communities.modularity(adjacency, labels, resolution) == pytest.approx(expected)
+
+
+def test_louvain_improves_modularity():
+    rng = np.random.default_rng(2)
+    anums = np.cumsum(rng.integers(1, 200, size=2000))
+    locations = rng.choice(['boston', 'new york', 'chicago', ''], size=2000)
+    graph = anum_graph.build(anums, locations)
+
+    labels = communities.louvain(graph.adjacency, seed=0)
+    singletons = np.arange(graph.num_nodes)
+    assert communities.modularity(graph.adjacency, labels) > communities.modularity(graph.adjacency, singletons)
+
+
+def test_communities_largest_first():
+    groups = communities.communities(np.array([1, 0, 1, 2, 1, 0]))
+    assert [group.tolist() for group in groups] == [[0, 2, 4], [1, 5], [3]]
@@ -0,0 +1,149 @@
+import json
+import tempfile
+
+from graph_export import export_graph
+
+
+class GraphBuilder(object):
+    """
+    Builds one graph from pages of people as the query runner streams them
+    in. Nodes and links are written to temporary files as they are made,
+    and only joined into the json and binary exports in finish.
+
+    Everything needed for the link and clean variants (included anums,
+    person locations, people that no link points at yet) is kept up to
+    date as nodes and links are added, so each person is only looked at a
+    constant number of times.
+
+    Several builders can consume the same stream. A builder with a location
+    only keeps that location's branch, so every variant of the report can
+    be built in a single pass over one query.
+    """
+
+    def __init__(self, name: str, root: bool, link: bool, clean: bool, location: str = None,
+                 path: str = None, export: str = None):
+        """
+        :param name: name of the graph in the exported files
+        :param root: include the root node and its links to every location
+        :param link: only include people with next links (or linked to), and link them
+        :param clean: link a person to its location only if nothing else links to it
+        :param location: only build the branch of this location (None for all)
+        :param path: json file to write (None to skip it)
+        :param export: binary summary and detail levels are written to this directory (None to skip them)
+        """
+        self.name = name
+        self.path = path
+        self.root = root
+        self.link = link
+        self.clean = clean
+        self.location = location
+        self.export = export
+
+        self.nodes = tempfile.TemporaryFile('w+')
+        self.links = tempfile.TemporaryFile('w+')
+        self.include_anums = set()
+
+        # Anums seen at the current location. Whether a person is included
+        # can depend on links from later pages, so their nodes are only
+        # added once the whole location has been read.
+        self.location_anums = []
+
+        # Where each person is (for clean mode and the exported summary),
+        # and for clean mode every link target and the person nodes no
+        # link points at yet
+        self.people_location = dict()
+        self.targets = set()
+        self.untargeted = set()
+
+        if root:
+            self.add_node({'id': 'root', 'type': 'root'})
+
+    def wants(self, loc: str) -> bool:
+        return self.location is None or loc == self.location
+
+    def add_node(self, node: dict):
+        self.nodes.write(json.dumps(node) + '\n')
+
+    def add_person(self, anum: int):
+        self.add_node({'id': anum, 'anumber': anum, 'type': 'person'})
+        if self.clean and anum not in self.targets:
+            self.untargeted.add(anum)
+
+    def add_link(self, source, target):
+        self.links.write(json.dumps({'source': source, 'target': target}) + '\n')
+        if self.clean:
+            self.targets.add(target)
+            self.untargeted.discard(target)
+
+    def start_location(self, loc: str):
+        if not self.wants(loc):
+            return
+        self.add_node({'id': loc, 'name': loc, 'type': 'location'})
+        if self.root:
+            self.add_link('root', loc)
+
+    def add_people(self, loc: str, people: list):
+        if not self.wants(loc):
+            return
+        for person in people:
+            self.location_anums.append(person['anum'])
+            if self.clean or self.export is not None:
+                self.people_location[person['anum']] = loc
+            if self.link:
+                if 'next' not in person:
+                    continue
+                for n in person['next']:
+                    self.include_anums.add(person['anum'])
+                    self.include_anums.add(n['anum'])
+                    self.add_link(person['anum'], n['anum'])
+            else:
+                self.include_anums.add(person['anum'])
+
+    def end_location(self, loc: str):
+        if not self.wants(loc):
+            return
+        for anum in self.location_anums:
+            if anum not in self.include_anums: continue
+            self.add_person(anum)
+            if not self.clean:
+                self.add_link(loc, anum)
+        self.location_anums = []
+
+        # Link every person nothing points at yet to its location
+        if self.clean:
+            for source in list(self.untargeted):
+                self.add_link(self.people_location[source], source)
+
+    def finish(self):
+        if self.path is not None:
+            with open(self.path, 'w') as f:
+                f.write('{"nodes": [')
+                self._copy(self.nodes, f)
+                f.write('], "links": [')
+                self._copy(self.links, f)
+                f.write(']}')
+
+        if self.export is not None:
+            export_graph(self.export, self.name, self._node_ids, self._link_pairs, self.people_location)
+
+        self.nodes.close()
+        self.links.close()
+
+    def _node_ids(self):
+        self.nodes.seek(0)
+        for line in self.nodes:
+            yield json.loads(line)['id']
+
+    def _link_pairs(self):
+        self.links.seek(0)
+        for line in self.links:
+            link = json.loads(line)
+            yield link['source'], link['target']
+
+    @staticmethod
+    def _copy(lines, f):
+        lines.seek(0)
+        for i, line in enumerate(lines):
+            if i > 0:
+                f.write(', ')
+            f.write(line.rstrip('\n'))
@@ -0,0 +1,192 @@
+import gzip
+import json
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Binary graph format, all little endian:
+#   magic        4 bytes, b'GRF1'
+#   header size  uint32
+#   header       utf8 json, padded with spaces to a multiple of 4 bytes
+#   columns      one typed array per column listed in the header, in order,
+#                each padded with zeros to a multiple of 4 bytes
+# Node ids are a uint32 column. Person ids are their anum, and the string
+# ids of other nodes (root, locations) are indexes into header['labels'].
+# Links are pairs of node indexes.
+magic = b'GRF1'
+node_types = ['root', 'location', 'person']
+
+# array typecodes for each column dtype
+_typecodes = {
+    'uint8': 'B',
+    'uint32': 'I',
+}
+
+
+def _pad(size: int) -> int:
+    return (4 - size % 4) % 4
+
+
+def encode(header: dict, columns: list) -> bytes:
+    """
+    Encode a graph as a header and typed columns.
+
+    :param header: json header, columns are added to it
+    :param columns: (name, dtype, values) triples
+    :return:
+    """
+    arrays = []
+    header = dict(header, columns=[])
+    for name, dtype, values in columns:
+        values = array(_typecodes[dtype], values)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        arrays.append(values.tobytes())
+        header['columns'].append({'name': name, 'dtype': dtype, 'length': len(values)})
+
+    encoded_header = json.dumps(header, separators=(',', ':')).encode('utf8')
+    encoded_header += b' ' * _pad(len(encoded_header))
+
+    parts = [magic, struct.pack('<I', len(encoded_header)), encoded_header]
+    for data in arrays:
+        parts.append(data)
+        parts.append(b'\0' * _pad(len(data)))
+    return b''.join(parts)
+
+
+def write(path: str, data: bytes):
+    """
+    Write a file along with gzip (and brotli, if installed) precompressed
+    copies, for static servers that serve them directly.
+
+    :param path:
+    :param data:
+    :return:
+    """
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+
+
+def _node_type(node_id) -> str:
+    if node_id == 'root':
+        return 'root'
+    if isinstance(node_id, int):
+        return 'person'
+    return 'location'
+
+
+def detail(nodes, links) -> bytes:
+    """
+    Encode the full graph.
+
+    :param nodes: node ids, in order
+    :param links: (source, target) node id pairs
+    :return:
+    """
+    labels = []
+    label_index = dict()
+    index = dict()
+    ids = array('I')
+    types = array('B')
+    for node_id in nodes:
+        if node_id in index:
+            continue
+        index[node_id] = len(ids)
+        node_type = _node_type(node_id)
+        if node_type != 'person':
+            if node_id not in label_index:
+                label_index[node_id] = len(labels)
+                labels.append(node_id)
+            node_id = label_index[node_id]
+        ids.append(node_id)
+        types.append(node_types.index(node_type))
+
+    sources = array('I')
+    targets = array('I')
+    for source, target in links:
+        # Links to people outside the selection are dropped, like d3 would
+        if source in index and target in index:
+            sources.append(index[source])
+            targets.append(index[target])
+
+    return encode({'version': 1, 'lod': 'detail', 'types': node_types, 'labels': labels}, [
+        ('id', 'uint32', ids),
+        ('type', 'uint8', types),
+        ('source', 'uint32', sources),
+        ('target', 'uint32', targets),
+    ])
+
+
+def summary(nodes, links, people_location: dict) -> bytes:
+    """
+    Encode a coarse level of detail with every person folded into its
+    location. Each location has the number of people it stands for, and
+    links between people become weighted links between their locations.
+
+    :param nodes: node ids, in order
+    :param links: (source, target) node id pairs
+    :param people_location: person id -> location
+    :return:
+    """
+    def fold(node_id):
+        if isinstance(node_id, int):
+            return people_location.get(node_id, None)
+        return node_id
+
+    labels = []
+    index = dict()
+    counts = []
+    for node_id in nodes:
+        folded = fold(node_id)
+        if folded is None:
+            continue
+        if folded not in index:
+            index[folded] = len(labels)
+            labels.append(folded)
+            counts.append(0)
+        if isinstance(node_id, int):
+            counts[index[folded]] += 1
+
+    weights = dict()
+    for source, target in links:
+        pair = (fold(source), fold(target))
+        if pair[0] in index and pair[1] in index and pair[0] != pair[1]:
+            weights[pair] = weights.get(pair, 0) + 1
+
+    return encode({'version': 1, 'lod': 'summary', 'types': node_types, 'labels': labels}, [
+        ('id', 'uint32', range(len(labels))),
+        ('type', 'uint8', [node_types.index(_node_type(label)) for label in labels]),
+        ('people', 'uint32', counts),
+        ('source', 'uint32', [index[source] for source, _ in weights]),
+        ('target', 'uint32', [index[target] for _, target in weights]),
+        ('weight', 'uint32', list(weights.values())),
+    ])
+
+
+def export_graph(directory: str, name: str, nodes, links, people_location: dict):
+    """
+    Write the summary and detail levels of a graph, with precompressed copies.
+    The report can load name.summary.graph first and fetch name.detail.graph
+    when it is needed.
+
+    :param directory:
+    :param name:
+    :param nodes: callable returning an iterator over node ids
+    :param links: callable returning an iterator over (source, target) pairs
+    :param people_location: person id -> location
+    :return:
+    """
+    os.makedirs(directory, exist_ok=True)
+    write(os.path.join(directory, f'{name}.summary.graph'), summary(nodes(), links(), people_location))
+    write(os.path.join(directory, f'{name}.detail.graph'), detail(nodes(), links()))
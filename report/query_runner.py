@@ -0,0 +1,185 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Locations under the root, with an optional filter on nat_loc
+location_query = """
+{
+  root(func: type(Root)) {
+    nat_loc %(filter)s {
+      uid
+      name
+    }
+  }
+}
+"""
+
+# One page of the people at a single location
+people_query = """
+{
+  loc(func: uid(%(uid)s)) {
+    people(first: %(first)d%(after)s) {
+      uid
+      %(fields)s
+    }
+  }
+}
+"""
+
+
+class QueryRunner(object):
+    """
+    Runs report queries against the dgraph http endpoint.
+
+    Queries are described by the nat_loc filter and the people fields they
+    select, instead of as one big query. Identical queries are only run
+    once, and distinct ones run concurrently. The people at each location
+    are paged through with first/after, and up to workers locations are
+    fetched at once. Each location's pages are handed to every consumer of
+    the query in location order, so no response ever holds the whole tree,
+    and at most workers locations are held in memory.
+
+    A consumer is any object with start_location(loc), add_people(loc, people),
+    end_location(loc) and finish() methods. All of the consumers of a query
+    are called from the same thread.
+    """
+
+    def __init__(self, url: str = 'http://localhost:8080/query', timeout: str = '20s',
+                 page_size: int = 1000, workers: int = 4, request_timeout: float = 30.0):
+        """
+        :param url: dgraph alpha http query endpoint
+        :param timeout: dgraph timeout for each request
+        :param page_size: people per page
+        :param workers: max queries to run at once, and max locations each
+                        query fetches at once
+        :param request_timeout: seconds to wait for a response. Longer than
+                                timeout, so dgraph's own error comes first.
+        """
+        super(QueryRunner, self).__init__()
+
+        self.url = f'{url}?timeout={timeout}'
+        self.request_timeout = request_timeout
+        self.page_size = page_size
+        self.workers = workers
+        self._local = threading.local()
+
+    def post(self, query: str) -> dict:
+        """
+        Send a single query, reusing a keep-alive session per thread.
+
+        :param query:
+        :return: the data of the response
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+
+        r = session.post(self.url, json={'query': query, 'variables': {}}, timeout=self.request_timeout)
+        r.raise_for_status()
+        body = r.json()
+        if body.get('errors'):
+            raise RuntimeError(f'query failed: {body["errors"]}')
+        return body['data']
+
+    def locations(self, spec: dict) -> list:
+        """
+        Get the uid and name of every location matching the query.
+
+        :param spec:
+        :return:
+        """
+        data = self.post(location_query % {'filter': spec.get('filter', '')})
+        return [
+            (loc['uid'], loc['name'])
+            for root in data['root']
+            for loc in root.get('nat_loc', [])
+        ]
+
+    def people(self, uid: str, spec: dict):
+        """
+        Page through the people at a location.
+
+        :param uid: uid of the location
+        :param spec:
+        :return: lists of people, page_size at a time
+        """
+        after = ''
+        while True:
+            data = self.post(people_query % {
+                'uid': uid,
+                'first': self.page_size,
+                'after': after,
+                'fields': spec['people'],
+            })
+            page = [
+                person
+                for loc in data['loc']
+                for person in loc.get('people', [])
+            ]
+            if len(page) > 0:
+                yield page
+            if len(page) < self.page_size:
+                return
+            after = f', after: {page[-1]["uid"]}'
+
+    def stream(self, spec: dict, consumers: list):
+        """
+        Run a single query, feeding every page to each consumer. Locations
+        are fetched concurrently, up to workers ahead of the one being
+        consumed.
+
+        :param spec:
+        :param consumers:
+        :return:
+        """
+        locations = iter(self.locations(spec))
+        fetches = deque()
+        with ThreadPoolExecutor(self.workers) as pool:
+            def fetch():
+                location = next(locations, None)
+                if location is not None:
+                    uid, loc = location
+                    fetches.append((loc, pool.submit(lambda: list(self.people(uid, spec)))))
+
+            for _ in range(self.workers):
+                fetch()
+
+            while len(fetches) > 0:
+                loc, pages = fetches.popleft()
+                fetch()
+
+                for consumer in consumers:
+                    consumer.start_location(loc)
+                for page in pages.result():
+                    for consumer in consumers:
+                        consumer.add_people(loc, page)
+                for consumer in consumers:
+                    consumer.end_location(loc)
+
+        for consumer in consumers:
+            consumer.finish()
+
+    def run(self, jobs: list):
+        """
+        Run many queries. Jobs with identical queries share one run.
+
+        :param jobs: (spec, consumer) pairs. A spec is a dict with the nat_loc
+                     filter (may be empty) and the people fields to select.
+        :return:
+        """
+        groups = dict()
+        specs = dict()
+        for spec, consumer in jobs:
+            key = ' '.join(f'{spec.get("filter", "")} | {spec["people"]}'.split())
+            groups.setdefault(key, []).append(consumer)
+            specs[key] = spec
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [
+                pool.submit(self.stream, specs[key], consumers)
+                for key, consumers in groups.items()
+            ]
+            for future in futures:
+                future.result()
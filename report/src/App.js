@@ -10,9 +10,6 @@ import {DataGrid} from '@material-ui/data-grid';
 import Paper from '@material-ui/core/Paper';
 
 import filtered_data from './filtered_data.json';
-import new_york_graph_branch from './new_york_graph_branch.json';
-import new_york_graph_branch_link from './new_york_graph_branch_link.json';
-import new_york_graph_branch_link_clean from './new_york_graph_branch_link_clean.json';
 
 import GitHubIcon from '@material-ui/icons/GitHub';
 import LinkIcon from '@material-ui/icons/Link';
@@ -267,7 +264,7 @@ function App() {
           </Body>
           <Graph
             title={'New York Branch Graph'}
-            data={new_york_graph_branch}
+            name={'new_york_graph_branch'}
           />
 
           <Body>
@@ -276,7 +273,7 @@ function App() {
           </Body>
           <Graph
             title={'New York Branch & Link Graph'}
-            data={new_york_graph_branch_link}
+            name={'new_york_graph_branch_link'}
           />
 
           <Body>
@@ -293,7 +290,7 @@ function App() {
           </Body>
           <Graph
             title={'New York Branch, Link & Clean Graph'}
-            data={new_york_graph_branch_link_clean}
+            name={'new_york_graph_branch_link_clean'}
             h={500}
           />
 
@@ -3,6 +3,7 @@ import Paper from '@material-ui/core/Paper';
 import Typography from '@material-ui/core/Typography';
 import {makeStyles} from '@material-ui/core/styles';
 import * as d3 from 'd3';
+import {loadGraph} from './graphFormat';
 
 export const height = 250;
 export const width = 500;
@@ -77,7 +78,7 @@ const graphIt = (data, w, h) => (svg) => {
       .data(nodes)
       .join('circle')
       .attr('id', (d) => d.id)
-      .attr('r', 5)
+      .attr('r', (d) => d.people ? 5 + Math.sqrt(d.people) : 5)
       .attr('class', 'graph-node')
       .attr('fill', color)
       .call(drag(simulation));
@@ -115,19 +116,45 @@ const graphIt = (data, w, h) => (svg) => {
       .attr("cy", d => d.y);
   });
 
-  return svg.node()
+  // Stop the old simulation when the graph is drawn again
+  return () => simulation.stop();
 }
 
 function useD3(renderChartFn, rerenderDeps) {
   const ref = React.useRef();
 
-  React.useEffect(() => {
-    renderChartFn(d3.select(ref.current));
-  }, rerenderDeps);
+  React.useEffect(() => renderChartFn(d3.select(ref.current)), rerenderDeps);
 
   return ref;
 }
 
+const empty = {nodes: [], links: []};
+
+// Fetch an exported graph by name. The small summary level is shown
+// first, and replaced by the detail level once it has loaded.
+function useGraph(name, data) {
+  const [graph, setGraph] = React.useState(data || empty);
+
+  React.useEffect(() => {
+    if (!name) return;
+    let cancelled = false;
+    loadGraph(name, 'summary')
+      .then((summary) => {
+        if (!cancelled) setGraph(summary);
+        return loadGraph(name, 'detail');
+      })
+      .then((detail) => {
+        if (!cancelled) setGraph(detail);
+      })
+      .catch((error) => console.error(error));
+    return () => {
+      cancelled = true;
+    };
+  }, [name]);
+
+  return graph;
+}
+
 
 const useStyles = makeStyles((theme) => ({
   paper: {
@@ -139,9 +166,10 @@ const useStyles = makeStyles((theme) => ({
   },
 }));
 
-export default function Graph({title = null, data, w = width, h = height}) {
+export default function Graph({title = null, name = null, data = null, w = width, h = height}) {
   const classes = useStyles();
-  const ref = useD3(graphIt(data, w, h), []);
+  const graph = useGraph(name, data);
+  const ref = useD3(graphIt(graph, w, h), [graph]);
 
   return (
     <Paper className={classes.paper}>
@@ -0,0 +1,66 @@
+// Decoder for the binary graphs written by graph_export.py.
+// See the format description at the top of that file.
+
+const typedArrays = {
+  uint8: Uint8Array,
+  uint32: Uint32Array,
+};
+
+const pad = (size) => (4 - size % 4) % 4;
+
+export function decodeGraph(buffer) {
+  const view = new DataView(buffer);
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+  if (magic !== 'GRF1') {
+    throw new Error('not a graph file');
+  }
+
+  const headerSize = view.getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerSize)));
+
+  // Columns are 4 byte aligned, so they can be viewed without copying
+  const columns = {};
+  let offset = 8 + headerSize;
+  for (const column of header.columns) {
+    const TypedArray = typedArrays[column.dtype];
+    columns[column.name] = new TypedArray(buffer, offset, column.length);
+    const size = column.length * TypedArray.BYTES_PER_ELEMENT;
+    offset += size + pad(size);
+  }
+
+  return {header, columns};
+}
+
+// Turn a decoded graph into the {nodes, links} shape Graph expects
+export function toGraphData({header, columns}) {
+  const ids = Array.from(columns.id, (id, i) => {
+    const type = header.types[columns.type[i]];
+    return type === 'person' ? id : header.labels[id];
+  });
+
+  const nodes = ids.map((id, i) => {
+    const type = header.types[columns.type[i]];
+    const node = {id, type};
+    if (type === 'location') node.name = id;
+    if (type === 'person') node.anumber = id;
+    if (columns.people) node.people = columns.people[i];
+    return node;
+  });
+
+  const links = Array.from(columns.source, (source, i) => {
+    const link = {source: ids[source], target: ids[columns.target[i]]};
+    if (columns.weight) link.weight = columns.weight[i];
+    return link;
+  });
+
+  return {nodes, links};
+}
+
+// Fetch a level of detail ('summary' or 'detail') of an exported graph
+export async function loadGraph(name, lod = 'summary') {
+  const response = await fetch(`${process.env.PUBLIC_URL}/graphs/${name}.${lod}.graph`);
+  if (!response.ok) {
+    throw new Error(`failed to load ${name}: ${response.status}`);
+  }
+  return toGraphData(decodeGraph(await response.arrayBuffer()));
+}
@@ -0,0 +1,117 @@
+import json
+import random
+from collections import Counter
+
+import pytest
+
+from graph_builder import GraphBuilder
+
+
+def _locations(seed: int) -> list:
+    # A few locations of people, some pointing at the next anum (possibly
+    # at another location)
+    rng = random.Random(seed)
+    locations = []
+    anum = 1000
+    for name in ('new york', 'boston', 'chicago'):
+        people = []
+        for _ in range(rng.randint(0, 40)):
+            anum += rng.randint(1, 3)
+            people.append({'name': 'p', 'anum': anum, 'nat_date': ''})
+        locations.append((name, people))
+
+    everyone = [person for _, people in locations for person in people]
+    for person in everyone:
+        if rng.random() < 0.3:
+            person['next'] = [{'anum': rng.choice(everyone)['anum']} for _ in range(rng.randint(0, 2))]
+    return locations
+
+
+def _old_graph(locations: list, root: bool, link: bool, clean: bool) -> dict:
+    # The loop gen_graph_data.py used before GraphBuilder, over one response
+    graph = {'nodes': [], 'links': []}
+    include_anums = set()
+    people_location = dict()
+    if root:
+        graph['nodes'].append({'id': 'root', 'type': 'root'})
+    for loc, people in locations:
+        graph['nodes'].append({'id': loc, 'name': loc, 'type': 'location'})
+        if root:
+            graph['links'].append({'source': 'root', 'target': loc})
+        for person in people:
+            people_location[person['anum']] = loc
+            if link:
+                if 'next' not in person:
+                    continue
+                for n in person['next']:
+                    include_anums.add(person['anum'])
+                    include_anums.add(n['anum'])
+                    graph['links'].append({'source': person['anum'], 'target': n['anum']})
+            else:
+                include_anums.add(person['anum'])
+        for person in people:
+            if person['anum'] not in include_anums:
+                continue
+            graph['nodes'].append({'id': person['anum'], 'anumber': person['anum'], 'type': 'person'})
+            if not clean:
+                graph['links'].append({'source': loc, 'target': person['anum']})
+
+        if clean:
+            all_ids = set(node['id'] for node in graph['nodes'] if isinstance(node['id'], int))
+            targets = set(link['target'] for link in graph['links'])
+            for source in all_ids.difference(targets):
+                graph['links'].append({'source': people_location[source], 'target': source})
+    return graph
+
+
+def _build(path, locations: list, page_size: int, **options) -> dict:
+    builder = GraphBuilder('g', path=str(path), **options)
+    for loc, people in locations:
+        builder.start_location(loc)
+        for start in range(0, len(people), page_size):
+            builder.add_people(loc, people[start:start + page_size])
+        builder.end_location(loc)
+    builder.finish()
+    with open(path) as f:
+        return json.load(f)
+
+
+def _items(items: list) -> Counter:
+    return Counter(json.dumps(item, sort_keys=True) for item in items)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('page_size', [1, 7, 1000])
+@pytest.mark.parametrize('root, link, clean', [
+    (True, False, False),
+    (False, False, False),
+    (False, True, False),
+    (False, True, True),
+    (True, True, True),
+])
+def test_matches_old_loop(tmp_path, seed, page_size, root, link, clean):
+    locations = _locations(seed)
+    new = _build(tmp_path / 'graph.json', locations, page_size, root=root, link=link, clean=clean)
+    old = _old_graph(locations, root, link, clean)
+    assert _items(new['nodes']) == _items(old['nodes'])
+    assert _items(new['links']) == _items(old['links'])
+
+
+def test_location_branch(tmp_path):
+    locations = _locations(0)
+    new = _build(tmp_path / 'graph.json', locations, 10, root=False, link=True, clean=True, location='boston')
+    old = _old_graph([(loc, people) for loc, people in locations if loc == 'boston'], False, True, True)
+    assert _items(new['nodes']) == _items(old['nodes'])
+    assert _items(new['links']) == _items(old['links'])
+
+
+def test_export_only(tmp_path):
+    builder = GraphBuilder('g', root=False, link=False, clean=False, export=str(tmp_path))
+    for loc, people in _locations(0):
+        builder.start_location(loc)
+        builder.add_people(loc, people)
+        builder.end_location(loc)
+    builder.finish()
+    assert sorted(path.name for path in tmp_path.iterdir() if not path.name.endswith('.gz')) == [
+        'g.detail.graph', 'g.summary.graph',
+    ]
@@ -0,0 +1,88 @@
+import gzip
+import json
+import struct
+from array import array
+
+import graph_export
+
+
+def _decode(data: bytes) -> tuple:
+    # Parse the binary format the same way the report does
+    assert data[:4] == graph_export.magic
+    header_size, = struct.unpack_from('<I', data, 4)
+    assert header_size % 4 == 0
+    header = json.loads(data[8:8 + header_size].decode('utf8'))
+    offset = 8 + header_size
+    columns = dict()
+    for column in header['columns']:
+        values = array(graph_export._typecodes[column['dtype']])
+        size = values.itemsize * column['length']
+        values.frombytes(data[offset:offset + size])
+        columns[column['name']] = list(values)
+        offset += size + graph_export._pad(size)
+    assert offset == len(data)
+    return header, columns
+
+
+def _labelled(header: dict, columns: dict) -> list:
+    # Node ids back to what GraphBuilder wrote: anums for people, labels otherwise
+    nodes = []
+    for node_id, node_type in zip(columns['id'], columns['type']):
+        if header['types'][node_type] == 'person':
+            nodes.append(node_id)
+        else:
+            nodes.append(header['labels'][node_id])
+    return nodes
+
+
+def test_encode_pads_header_and_columns():
+    data = graph_export.encode({'version': 1}, [
+        ('a', 'uint8', [1, 2, 3]),
+        ('b', 'uint32', [7, 2 ** 32 - 1]),
+        ('c', 'uint8', []),
+    ])
+    assert len(data) % 4 == 0
+    header, columns = _decode(data)
+    assert header['version'] == 1
+    assert [column['length'] for column in header['columns']] == [3, 2, 0]
+    assert columns == {'a': [1, 2, 3], 'b': [7, 2 ** 32 - 1], 'c': []}
+
+
+nodes = ['root', 'new york', 101, 102, 'boston', 201, 102]
+links = [('root', 'new york'), ('root', 'boston'), ('new york', 101), (101, 102), (101, 201), (201, 102), (102, 999)]
+people_location = {101: 'new york', 102: 'new york', 201: 'boston'}
+
+
+def test_detail():
+    header, columns = _decode(graph_export.detail(nodes, links))
+    assert header['lod'] == 'detail'
+    # Duplicate nodes are kept once, and the link to an unknown person is dropped
+    decoded = _labelled(header, columns)
+    assert decoded == ['root', 'new york', 101, 102, 'boston', 201]
+    assert [header['types'][node_type] for node_type in columns['type']] == [
+        'root', 'location', 'person', 'person', 'location', 'person']
+    pairs = [(decoded[source], decoded[target]) for source, target in zip(columns['source'], columns['target'])]
+    assert pairs == links[:-1]
+
+
+def test_summary():
+    header, columns = _decode(graph_export.summary(nodes, links, people_location))
+    assert header['lod'] == 'summary'
+    assert header['labels'] == ['root', 'new york', 'boston']
+    assert columns['id'] == [0, 1, 2]
+    assert columns['people'] == [0, 3, 1]
+    weights = {
+        (header['labels'][source], header['labels'][target]): weight
+        for source, target, weight in zip(columns['source'], columns['target'], columns['weight'])
+    }
+    # Links within a location fold away, links between people become location links
+    assert weights == {('root', 'new york'): 1, ('root', 'boston'): 1, ('new york', 'boston'): 1, ('boston', 'new york'): 1}
+
+
+def test_export_graph(tmp_path):
+    graph_export.export_graph(str(tmp_path), 'g', lambda: iter(nodes), lambda: iter(links), people_location)
+    for lod in ('summary', 'detail'):
+        path = tmp_path / f'g.{lod}.graph'
+        data = path.read_bytes()
+        assert _decode(data)[0]['lod'] == lod
+        assert gzip.decompress((tmp_path / f'g.{lod}.graph.gz').read_bytes()) == data
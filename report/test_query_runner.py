@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+
+import pytest
+
+import query_runner
+from query_runner import QueryRunner
+
+# people at each location uid
+people = {
+    '0x1': [{'uid': f'0x1{index:03d}', 'anum': index} for index in range(7)],
+    '0x2': [],
+    '0x3': [{'uid': f'0x3{index:03d}', 'anum': 100 + index} for index in range(3)],
+    '0x4': [{'uid': '0x4000', 'anum': 200}],
+}
+names = {'0x1': 'new york', '0x2': 'boston', '0x3': 'chicago', '0x4': 'miami'}
+
+
+class Response(object):
+    def __init__(self, data: dict):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> dict:
+        return {'data': self.data}
+
+
+class Session(object):
+    # Answers the runner's two queries, slowly, counting requests in flight
+    lock = threading.Lock()
+    running = 0
+    most_running = 0
+    timeouts = []
+
+    def post(self, url, json, timeout=None):
+        with Session.lock:
+            Session.running += 1
+            Session.most_running = max(Session.most_running, Session.running)
+            Session.timeouts.append(timeout)
+        try:
+            time.sleep(0.02)
+            return Response(self._answer(json['query']))
+        finally:
+            with Session.lock:
+                Session.running -= 1
+
+    @staticmethod
+    def _answer(query: str) -> dict:
+        if 'root(' in query:
+            return {'root': [{'nat_loc': [{'uid': uid, 'name': name} for uid, name in names.items()]}]}
+
+        uid = re.search(r'uid\((\w+)\)', query).group(1)
+        first = int(re.search(r'first: (\d+)', query).group(1))
+        after = re.search(r'after: (\w+)', query)
+        page = people[uid]
+        if after is not None:
+            page = [person for person in page if person['uid'] > after.group(1)]
+        return {'loc': [{'people': page[:first]}]}
+
+
+class Consumer(object):
+    def __init__(self):
+        self.calls = []
+
+    def start_location(self, loc):
+        self.calls.append(('start', loc))
+
+    def add_people(self, loc, page):
+        self.calls.append(('add', loc, [person['anum'] for person in page]))
+
+    def end_location(self, loc):
+        self.calls.append(('end', loc))
+
+    def finish(self):
+        self.calls.append(('finish',))
+
+
+@pytest.fixture(autouse=True)
+def session(monkeypatch):
+    Session.running = Session.most_running = 0
+    Session.timeouts = []
+    monkeypatch.setattr(query_runner.requests, 'Session', Session)
+
+
+def test_stream_in_location_order():
+    consumers = [Consumer(), Consumer()]
+    QueryRunner(page_size=3, workers=3, request_timeout=5.0).run([
+        ({'people': 'anum'}, consumer) for consumer in consumers
+    ])
+
+    assert consumers[0].calls == consumers[1].calls == [
+        ('start', 'new york'),
+        ('add', 'new york', [0, 1, 2]),
+        ('add', 'new york', [3, 4, 5]),
+        ('add', 'new york', [6]),
+        ('end', 'new york'),
+        ('start', 'boston'),
+        ('end', 'boston'),
+        ('start', 'chicago'),
+        ('add', 'chicago', [100, 101, 102]),
+        ('end', 'chicago'),
+        ('start', 'miami'),
+        ('add', 'miami', [200]),
+        ('end', 'miami'),
+        ('finish',),
+    ]
+
+    # Identical queries share one run, whose locations are paged concurrently
+    assert 1 < Session.most_running <= 3
+    assert set(Session.timeouts) == {5.0}